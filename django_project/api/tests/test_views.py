@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import datetime
+import json
 
 from django.test import TestCase, Client
 from django.core.urlresolvers import reverse
@@ -70,6 +71,16 @@ class TestViews(TestCase):
 
         self.assertEqual(resp.status_code, 404)
 
+    def test_localities_api_view_extent(self):
+        LocalityF.create(geom='POINT(16 45)')
+
+        resp = self.client.get(reverse('api_localities'), {'extent': '15,44,17,46'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(json.loads(''.join(resp.streaming_content))), 1)
+
+        resp = self.client.get(reverse('api_localities'), {'extent': '-b,-a,b,a'})
+        self.assertEqual(resp.status_code, 404)
+
     def test_locality_api_view(self):
         user = UserF.create(id=1, username='test')
         chgset = ChangesetF.create(
@@ -118,3 +129,19 @@ class TestViews(TestCase):
         )
 
         self.assertEqual(resp.status_code, 404)
+
+    def test_locality_synonyms_api_view(self):
+        master = LocalityF.create(geom='POINT(16 45)')
+        LocalityF.create(
+            geom='POINT(16.1 45.1)', uuid='35570d8b22494bb6a88487a8108ffd70',
+            master=master
+        )
+
+        resp = self.client.get(reverse('api_locality_synonyms'))
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.streaming)
+
+        synonyms = json.loads(''.join(resp.streaming_content))
+        self.assertEqual(len(synonyms), 1)
+        self.assertEqual(synonyms[0]['uuid'], '35570d8b22494bb6a88487a8108ffd70')
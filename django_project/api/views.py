@@ -1,23 +1,26 @@
 # -*- coding: utf-8 -*-
 import logging
+import itertools
 import json
 import dicttoxml
 
 LOG = logging.getLogger(__name__)
 
 from braces.views import JSONResponseMixin
+from core.utilities import streaming_json_response
 from django.core.serializers.json import DjangoJSONEncoder
 from django.http import Http404, HttpResponse
 from django.views.generic import View
 from frontend.views import search_place
 from localities.models import Country, Locality, Value
-from localities.utils import parse_bbox, get_heathsites_master_by_polygon, get_heathsites_master_by_page, \
+from localities.utils import parse_bbox, get_heathsites_master_by_country, get_heathsites_master_by_polygon, \
+    get_heathsites_master_by_page, \
     get_heathsites_synonyms, limit, \
     locality_create
 from localities.views import get_locality_detail
 
 
-def formattedReturn(request, value):
+def getFormat(request):
     try:
         format = request.GET['format']
     except Exception as e:
@@ -25,14 +28,40 @@ def formattedReturn(request, value):
             format = request.POST['format']
         except Exception as e:
             format = 'json'
+    return format
+
 
-    if format == 'xml':
+def formattedReturn(request, value):
+    if getFormat(request) == 'xml':
         output = dicttoxml.dicttoxml(value)
     else:
         output = json.dumps(value, cls=DjangoJSONEncoder)
     return output
 
 
+def formattedStreamingReturn(request, values):
+    """
+    Create a response for an iterable of values, JSON list is streamed while
+    the values are iterated, so memory doesn't grow with the number of values
+    """
+    if getFormat(request) == 'xml':
+        return HttpResponse(dicttoxml.dicttoxml(list(values)), content_type='application/json')
+    return streaming_json_response(values)
+
+
+def prefetch_values(values):
+    """
+    Get the first of the values right away, so errors of the query behind
+    them are raised before a streamed response is started
+    """
+    values = iter(values)
+    try:
+        first = next(values)
+    except StopIteration:
+        return iter(())
+    return itertools.chain([first], values)
+
+
 class LocalityAPI(JSONResponseMixin, View):
     def _parse_request_params(self, request):
         if 'guid' in request.GET:
@@ -72,13 +101,11 @@ class LocalitySynonymsAPI(JSONResponseMixin, View):
                 return HttpResponse(formattedReturn(request, {'error': "facility doesn't exist"}),
                                     content_type='application/json')
         else:
-            return HttpResponse(formattedReturn(request, get_heathsites_synonyms()),
-                                content_type='application/json')
+            return formattedStreamingReturn(request, get_heathsites_synonyms())
 
-        value = []
-        for synonym in locality.get_synonyms():
-            value.append(get_locality_detail(synonym, None))
-        return HttpResponse(formattedReturn(request, value), content_type='application/json')
+        return formattedStreamingReturn(request, (
+            get_locality_detail(synonym, None) for synonym in locality.get_synonyms().iterator()
+        ))
 
 
 class LocalitiesAPI(JSONResponseMixin, View):
@@ -92,10 +119,10 @@ class LocalitiesAPI(JSONResponseMixin, View):
         if 'extent' in request.GET:
             try:
                 bbox_poly = parse_bbox(request.GET.get('extent'))
-                return HttpResponse(formattedReturn(request, get_heathsites_master_by_polygon(request, bbox_poly)),
-                                    content_type='application/json')
+                healthsites = prefetch_values(get_heathsites_master_by_polygon(request, bbox_poly))
             except Exception as e:
                 raise Http404
+            return formattedStreamingReturn(request, healthsites)
         elif 'page' in request.GET:
             page = request.GET.get('page')
             try:
@@ -103,11 +130,11 @@ class LocalitiesAPI(JSONResponseMixin, View):
                 if page == 0:
                     return HttpResponse(formattedReturn(request, {'error': "page less than 1"}),
                                         content_type='application/json')
-                return HttpResponse(formattedReturn(request, get_heathsites_master_by_page(page)),
-                                    content_type='application/json')
+                healthsites = prefetch_values(get_heathsites_master_by_page(page))
             except ValueError:
                 return HttpResponse(formattedReturn(request, {'error': "page is not a number"}),
                                     content_type='application/json')
+            return formattedStreamingReturn(request, healthsites)
 
 
 class LocalitySearchAPI(JSONResponseMixin, View):
@@ -127,7 +154,8 @@ class LocalitySearchAPI(JSONResponseMixin, View):
         if search_type == "placename":
             try:
                 country = Country.objects.get(name__icontains=place_name)
-                polygon = country.polygon_geometry
+                return formattedStreamingReturn(
+                    request, get_heathsites_master_by_country(request, country))
             except Exception as e:
                 # if country is not found
                 output = search_place(request, place_name)
@@ -138,23 +166,24 @@ class LocalitySearchAPI(JSONResponseMixin, View):
                     polygon = parse_bbox(bbox)
                 except Exception as e:
                     raise Http404
-            return HttpResponse(formattedReturn(request, get_heathsites_master_by_polygon(request, polygon)),
-                                content_type='application/json')
+            return formattedStreamingReturn(request, get_heathsites_master_by_polygon(request, polygon))
 
         if search_type == "facility":
             locality_values = Value.objects.filter(
                 specification__attribute__key='name').filter(
                 data__icontains=place_name)
-            output = []
-            index = 1;
-            for locality in locality_values:
-                uuid = locality.locality.uuid
-                locality = Locality.objects.get(uuid=uuid)
-                output.append(get_locality_detail(locality, None))
-                index += 1
-                if index == limit:
-                    break
-            return HttpResponse(formattedReturn(request, output), content_type='application/json')
+
+            def search_facilities():
+                index = 1;
+                for locality in locality_values.iterator():
+                    uuid = locality.locality.uuid
+                    locality = Locality.objects.get(uuid=uuid)
+                    yield get_locality_detail(locality, None)
+                    index += 1
+                    if index == limit:
+                        break
+
+            return formattedStreamingReturn(request, search_facilities())
 
 
 class LocalityCreateAPI(JSONResponseMixin, View):
@@ -3,6 +3,7 @@
 core.settings.contrib
 """
 import os
+from celery.schedules import crontab
 from .base import *  # noqa
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -137,6 +138,15 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 
+# cached clusters are updated incrementally on every change,
+# full regeneration keeps them consistent
+CELERYBEAT_SCHEDULE = {
+    'regenerate-cache-cluster': {
+        'task': 'localities.tasks.regenerate_cache_cluster',
+        'schedule': crontab(hour=2, minute=0),
+    },
+}
+
 # Django envelop for contact forms
 DEFAULT_FROM_EMAIL = 'enquiry@healthsites.io'
 ENVELOPE_EMAIL_RECIPIENTS = ['info@healthsites.io']
@@ -114,4 +114,52 @@ PIPELINE_CSS['home'] = {
 
 # Cache folder
 CLUSTER_CACHE_DIR = 'cache'
-CLUSTER_CACHE_MAX_ZOOM = 5
\ No newline at end of file
+CLUSTER_CACHE_MAX_ZOOM = 5
+
+# Clustering engine, 'numpy' or 'python'
+# 'numpy' engine falls back to 'python' if numpy is not installed, compare
+# both engines with the benchmark_clustering command before switching
+CLUSTER_ENGINE = 'python'
+
+# Clustering backend for uncached clusters, 'python' or 'postgis'
+# can be overridden by 'backend' argument of a localities.json request
+CLUSTER_BACKEND = 'python'
+
+# How long (seconds) clients and proxies can cache clustered tiles
+CLUSTER_TILE_MAX_AGE = 300
+
+# Number of clustered search results (tag, spec and data, uuid or country)
+# cached in memory by every process
+CLUSTER_SEARCH_CACHE_SIZE = 256
+
+# How long (seconds) a request waits for a missing cache file which is being
+# generated by another request
+CLUSTER_CACHE_LOCK_TIMEOUT = 30
+
+# Locality snapshot is rewritten when there are no changes of Localities
+# for LOCALITY_SNAPSHOT_REWRITE_DELAY seconds, or at the latest
+# LOCALITY_SNAPSHOT_REWRITE_MAX_DELAY seconds after the first change
+LOCALITY_SNAPSHOT_REWRITE_DELAY = 300
+LOCALITY_SNAPSHOT_REWRITE_MAX_DELAY = 1800
+
+# Icon sizes (width, height) which clusters are cached for, requested icon
+# sizes are snapped to the nearest one. Cached tiles are served by nginx only
+# for these icon sizes, see the $tile_icon_size map of the nginx config
+CLUSTER_ICON_SIZE_BUCKETS = ((32, 31), (48, 46), (96, 92))
+
+# Add counts of Localities by facility type and by completeness to every
+# cached cluster, counts are refreshed when the cache is regenerated
+CLUSTER_CACHE_FACETS = False
+
+# Density grids of master Localities have DENSITY_GRID_COLUMNS columns at
+# zoom 0, twice as many at every zoom above it, up to DENSITY_GRID_MAX_ZOOM
+DENSITY_GRID_COLUMNS = 256
+DENSITY_GRID_MAX_ZOOM = 4
+
+# Countries are subdivided into CountryParts of at most
+# COUNTRY_PART_MAX_VERTICES vertices, for locating points in countries
+COUNTRY_PART_MAX_VERTICES = 256
+
+# How often (seconds) every process checks if countries are changed by
+# another process, to reload its country locator
+COUNTRY_LOCATOR_TTL = 60
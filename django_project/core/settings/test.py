@@ -1,4 +1,7 @@
 
+import os
+import tempfile
+
 from .project import *  # noqa
 
 # http://hustoknow.blogspot.com/2011/02/setting-up-django-nose-on-hudson.html
@@ -8,6 +11,20 @@ INSTALLED_APPS += (
 
 TEST_RUNNER = 'django.test.runner.DiscoverRunner'
 
+# run celery tasks triggered by changes of Localities in the test process,
+# without a broker
+CELERY_ALWAYS_EAGER = True
+
+# countries of a test are rolled back without invalidating the country
+# locator, so it checks them every time
+COUNTRY_LOCATOR_TTL = 0
+
+# eager tasks update existing caches, keep them apart from the development
+# caches
+CLUSTER_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'healthsites_test_cache')
+if not os.path.exists(CLUSTER_CACHE_DIR):
+    os.makedirs(CLUSTER_CACHE_DIR)
+
 NOSE_ARGS = (
     '--with-coverage',
     '--cover-erase',
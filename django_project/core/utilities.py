@@ -4,6 +4,8 @@ __license__ = "GPL"
 __copyright__ = 'kartoza.com'
 
 import time
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
 from localities.models import Locality, Value
 
 
@@ -14,3 +16,38 @@ def extract_time(json):
         return int(time.mktime(json['changeset__created'].timetuple()))
     except KeyError:
         return 0
+
+
+def iter_json_list(items, cls=DjangoJSONEncoder, chunk_size=65536):
+    """
+    Serialize an iterable as a JSON list incrementally, yielding chunks of
+    about *chunk_size* characters
+
+    Serialized list is the same as the one of json.dumps, but only one item
+    at a time is kept in memory
+    """
+    encode = cls().encode
+    chunk = ['[']
+    size = 1
+    separator = ''
+    for item in items:
+        encoded = encode(item)
+        chunk.append(separator)
+        chunk.append(encoded)
+        separator = ', '
+        size += len(encoded) + 2
+        if size >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    chunk.append(']')
+    yield ''.join(chunk)
+
+
+def streaming_json_response(items, **kwargs):
+    """
+    Create a response which streams an iterable as a JSON list
+    """
+    return StreamingHttpResponse(
+        iter_json_list(items), content_type='application/json', **kwargs
+    )
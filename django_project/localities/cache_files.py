@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+import logging
+
+LOG = logging.getLogger(__name__)
+
+import errno
+import fcntl
+import gzip
+import os
+import tempfile
+import time
+
+from contextlib import contextmanager
+from StringIO import StringIO
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# extensions of precompressed siblings of a cache file
+COMPRESSED_EXTENSIONS = ('.gz', '.br')
+
+
+class CacheTimeout(Exception):
+    """
+    Raised when a cache file is not generated within the lock timeout
+    """
+
+
+def read_cache_file(filename):
+    """
+    Read a cache file, raises IOError if there is no cache file
+    """
+
+    with open(filename, 'rb') as cache_file:
+        return cache_file.read()
+
+
+def write_temp_file(filename, data):
+    """
+    Write data, a string or an iterable of strings, to a new temporary file
+    in the directory of a file, returns the name of the temporary file
+    """
+
+    directory = os.path.dirname(filename) or '.'
+    handle, temp_filename = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+    if isinstance(data, basestring):
+        data = [data]
+    try:
+        with os.fdopen(handle, 'wb') as temp_file:
+            for chunk in data:
+                temp_file.write(chunk)
+        # temporary files are only readable by their owner
+        os.chmod(temp_filename, 0644)
+    except:
+        os.remove(temp_filename)
+        raise
+    return temp_filename
+
+
+def replace_file(temp_filename, filename):
+    """
+    Replace a file with a temporary file, the temporary file is removed if
+    it can't be renamed
+    """
+
+    try:
+        os.rename(temp_filename, filename)
+    except:
+        os.remove(temp_filename)
+        raise
+
+
+def iter_file(filename, block_size=65536):
+    """
+    Read a file in blocks
+    """
+
+    with open(filename, 'rb') as source_file:
+        for block in iter(lambda: source_file.read(block_size), ''):
+            yield block
+
+
+def gzip_blocks(blocks):
+    """
+    Compress blocks of data with gzip, compressed data of the same data is
+    always the same, as the modification time is not stored
+    """
+
+    compressed = StringIO()
+    with gzip.GzipFile(fileobj=compressed, mode='wb', compresslevel=9, mtime=0) as gzip_file:
+        for block in blocks:
+            gzip_file.write(block)
+            yield compressed.getvalue()
+            compressed.seek(0)
+            compressed.truncate()
+    yield compressed.getvalue()
+
+
+def write_file(filename, data):
+    """
+    Write a file atomically, data is a string or an iterable of strings
+
+    Data is written to a temporary file which is renamed to the file, so
+    readers get either the previous or the new file, but never a partially
+    written one
+    """
+
+    replace_file(write_temp_file(filename, data), filename)
+
+
+def write_cache_file(filename, data, compress=False):
+    """
+    Write a cache file atomically, data is a string or an iterable of
+    strings, so large cache files can be written without keeping them in
+    memory
+
+    If *compress* is set, precompressed '.gz' (and '.br' if brotli is
+    installed) siblings of the cache file are written before it, so a web
+    server can serve them directly, otherwise stale siblings are removed
+    """
+
+    if not compress:
+        for extension in COMPRESSED_EXTENSIONS:
+            try:
+                os.remove(filename + extension)
+            except OSError:
+                pass
+        write_file(filename, data)
+        return
+
+    temp_filename = write_temp_file(filename, data)
+    try:
+        write_file(filename + '.gz', gzip_blocks(iter_file(temp_filename)))
+        if brotli is not None:
+            write_file(filename + '.br', brotli.compress(read_cache_file(temp_filename)))
+    except:
+        os.remove(temp_filename)
+        raise
+    replace_file(temp_filename, filename)
+
+
+@contextmanager
+def cache_lock(filename, timeout):
+    """
+    Hold an exclusive lock of a cache file, waiting at most *timeout* seconds
+    for the lock, raises CacheTimeout if the lock is not acquired in time
+    """
+
+    lock_file = open(filename + '.lock', 'a')
+    deadline = time.time() + timeout
+    try:
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                if time.time() >= deadline:
+                    raise CacheTimeout(filename)
+                time.sleep(0.1)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    finally:
+        lock_file.close()
+
+
+def get_cache_file(filename, generate, timeout=None, compress=False):
+    """
+    Read a cache file, or generate it if it's missing
+
+    Only one process generates a missing cache file, by calling *generate*
+    which returns the data of the cache file, other processes wait for it at
+    most *timeout* seconds (CLUSTER_CACHE_LOCK_TIMEOUT by default) and raise
+    CacheTimeout if it's not generated in time
+
+    Generated cache file is written with precompressed siblings if
+    *compress* is set
+    """
+
+    try:
+        return read_cache_file(filename)
+    except IOError:
+        pass
+
+    if timeout is None:
+        timeout = getattr(settings, 'CLUSTER_CACHE_LOCK_TIMEOUT', 30)
+
+    with cache_lock(filename, timeout):
+        # cache file might be generated while waiting for the lock
+        try:
+            return read_cache_file(filename)
+        except IOError:
+            pass
+
+        data = generate()
+        write_cache_file(filename, data, compress)
+        return data
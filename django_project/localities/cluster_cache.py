@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+import logging
+
+LOG = logging.getLogger(__name__)
+
+import glob
+import json
+import math
+import os
+import re
+
+from django.conf import settings
+from core.utilities import iter_json_list
+
+from .cache_files import cache_lock, write_cache_file
+from .map_clustering import (
+    COMPLETENESS_BUCKETS, FACILITY_TYPES, catchment_bbox, load_facets, update_minbbox,
+    within_bbox
+)
+from .models import Locality, Value
+
+
+def cluster_cache_filename(zoom, icon_size, country_name=None):
+    """
+    Get filename of cached clusters for a zoom and an icon size, for the world
+    or for a country
+    """
+
+    if country_name:
+        filename = '{}_{}_{}_localities_{}.json'.format(
+            zoom, icon_size[0], icon_size[1], country_name)
+    else:
+        filename = '{}_{}_{}_localities.json'.format(zoom, *icon_size)
+
+    return os.path.join(settings.CLUSTER_CACHE_DIR, filename)
+
+
+def icon_size_buckets():
+    """
+    Get icon sizes (width, height) which clusters are cached for
+    """
+
+    return [tuple(icon_size) for icon_size in getattr(settings, 'CLUSTER_ICON_SIZE_BUCKETS', ())]
+
+
+def snap_icon_size(icon_size):
+    """
+    Snap an icon size to the nearest icon size bucket, so clusters of every
+    icon size can be cached
+    """
+
+    buckets = icon_size_buckets()
+    if not buckets:
+        return list(icon_size)
+
+    return list(min(buckets, key=lambda bucket: (
+        (bucket[0] - icon_size[0]) ** 2 + (bucket[1] - icon_size[1]) ** 2
+    )))
+
+
+def cached_icon_sizes():
+    """
+    Get icon sizes which have cached world clusters
+    """
+
+    icon_sizes = []
+    pattern = os.path.join(settings.CLUSTER_CACHE_DIR, '0_*_*_localities.json')
+    for filename in glob.glob(pattern):
+        match = re.match(r'^0_(\d+)_(\d+)_localities\.json$', os.path.basename(filename))
+        if match:
+            icon_sizes.append((int(match.group(1)), int(match.group(2))))
+    return sorted(icon_sizes)
+
+
+def read_cluster_cache(filename):
+    """
+    Read cached clusters, raises IOError if there is no cache
+    """
+
+    with open(filename, 'rb') as cache_file:
+        return json.load(cache_file)
+
+
+def write_cluster_cache(filename, object_list):
+    """
+    Write cached clusters atomically, with precompressed siblings
+    """
+
+    write_cache_file(filename, iter_json_list(object_list), compress=True)
+
+
+class ClusterIndex(object):
+    """
+    Grid index of cached clusters, for finding clusters within a bbox
+
+    Every cluster is indexed in every grid cell its 'catchment' bbox overlaps
+    """
+
+    def __init__(self, clusters, cell_size=10.0):
+        self.clusters = clusters
+        self.cell_size = cell_size
+        self.grid = {}
+        self.extent = None
+
+        for index, cluster_point in enumerate(clusters):
+            bbox = cluster_point['bbox']
+            for cell in self._cells(bbox):
+                self.grid.setdefault(cell, []).append(index)
+
+            if self.extent is None:
+                self.extent = list(bbox)
+            else:
+                self.extent = [
+                    min(self.extent[0], bbox[0]), min(self.extent[1], bbox[1]),
+                    max(self.extent[2], bbox[2]), max(self.extent[3], bbox[3])
+                ]
+
+    def _cells(self, bbox):
+        min_col = int(math.floor(bbox[0] / self.cell_size))
+        min_row = int(math.floor(bbox[1] / self.cell_size))
+        max_col = int(math.floor(bbox[2] / self.cell_size))
+        max_row = int(math.floor(bbox[3] / self.cell_size))
+        for col in xrange(min_col, max_col + 1):
+            for row in xrange(min_row, max_row + 1):
+                yield (col, row)
+
+    def query(self, bbox):
+        """
+        Get clusters which 'catchment' bbox intersects a *bbox*
+        (minx, miny, maxx, maxy), in the order of the cached clusters
+        """
+
+        if self.extent is None:
+            return []
+
+        # bbox of a map view can be larger than the world
+        bbox = (
+            max(bbox[0], self.extent[0]), max(bbox[1], self.extent[1]),
+            min(bbox[2], self.extent[2]), min(bbox[3], self.extent[3])
+        )
+        if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            return []
+
+        indexes = set()
+        for cell in self._cells(bbox):
+            indexes.update(self.grid.get(cell, ()))
+
+        clusters = []
+        for index in sorted(indexes):
+            cluster_bbox = self.clusters[index]['bbox']
+            if (cluster_bbox[0] <= bbox[2] and bbox[0] <= cluster_bbox[2] and
+                    cluster_bbox[1] <= bbox[3] and bbox[1] <= cluster_bbox[3]):
+                clusters.append(self.clusters[index])
+        return clusters
+
+
+# cluster indexes of this process, keyed by cache filename
+_cluster_indexes = {}
+
+
+def get_cluster_index(filename):
+    """
+    Get a grid index of cached clusters, or None if there is no cache
+
+    Index is loaded once per process, and reloaded when the cache file is
+    modified
+    """
+
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+
+    version = (stat.st_mtime, stat.st_size)
+    cached = _cluster_indexes.get(filename)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    try:
+        cluster_index = ClusterIndex(read_cluster_cache(filename))
+    except IOError:
+        return None
+
+    _cluster_indexes[filename] = (version, cluster_index)
+    return cluster_index
+
+
+def locality_name(uuid):
+    """
+    Get the name of a Locality, or an empty string if it has no name
+    """
+
+    names = Value.objects.filter(locality__uuid=uuid).filter(
+        specification__attribute__key='name').values_list('data', flat=True)[:1]
+    return names[0] if names else ''
+
+
+def locality_facets(uuid):
+    """
+    Get packed facets of a Locality, as loaded by *load_facets*, or None if
+    cached clusters don't count facets or there is no such Locality
+    """
+
+    if not getattr(settings, 'CLUSTER_CACHE_FACETS', False):
+        return None
+
+    facets = load_facets(Locality.objects.filter(uuid=uuid)).values()
+    return facets[0] if facets else None
+
+
+def count_facets(cluster_point, facets, sign=1):
+    """
+    Add (*sign* 1) or subtract (*sign* -1) packed *facets* of a Locality to
+    the facet counts of a cached cluster, if the cluster has them
+    """
+
+    if facets is None or 'numbers' not in cluster_point:
+        return
+
+    types = len(FACILITY_TYPES)
+    for index, (name, keyword) in enumerate(FACILITY_TYPES):
+        if facets & (1 << index):
+            cluster_point['numbers'][name] = cluster_point['numbers'].get(name, 0) + sign
+    for index, name in enumerate(COMPLETENESS_BUCKETS):
+        if facets & (1 << (types + index)):
+            cluster_point['completeness'][name] = (
+                cluster_point['completeness'].get(name, 0) + sign)
+
+
+def add_point(clusters, zoom, pix_x, pix_y, uuid, name, geom, facets=None):
+    """
+    Add a Locality point to a list of clusters
+
+    A point is added to the first cluster that contains it, same as when it's
+    the last point walked by *cluster*, or creates a new cluster. Packed
+    *facets* of the Locality are counted if they are given
+    """
+
+    geomx, geomy = geom
+    for cluster_point in clusters:
+        if within_bbox(cluster_point['bbox'], geomx, geomy):
+            cluster_point['count'] += 1
+            cluster_point['minbbox'] = update_minbbox(geom, cluster_point['minbbox'])
+            count_facets(cluster_point, facets)
+            return True
+
+    cluster_point = {
+        'uuid': uuid,
+        'name': name,
+        'count': 1,
+        'geom': (geomx, geomy),
+        'bbox': catchment_bbox(zoom, pix_x, pix_y, geomx, geomy),
+        'minbbox': (geomx, geomy, geomx, geomy),
+        'localities': []
+    }
+    if facets is not None:
+        cluster_point['numbers'] = dict((name, 0) for name, keyword in FACILITY_TYPES)
+        cluster_point['completeness'] = dict((name, 0) for name in COMPLETENESS_BUCKETS)
+        count_facets(cluster_point, facets)
+    clusters.append(cluster_point)
+    return True
+
+
+def find_point(clusters, uuid, geom):
+    """
+    Get the cluster a Locality point is counted by, the cluster it created or
+    else the first cluster that contains it, or None
+    """
+
+    geomx, geomy = geom
+    matched = None
+    for cluster_point in clusters:
+        if cluster_point['uuid'] == uuid:
+            return cluster_point
+        if matched is None and within_bbox(cluster_point['bbox'], geomx, geomy):
+            matched = cluster_point
+    return matched
+
+
+def remove_point(clusters, uuid, geom, facets=None):
+    """
+    Remove a Locality point from a list of clusters
+
+    A point is removed from the cluster it's counted by, see *find_point*.
+    Cluster without points is removed, otherwise its 'geom' and minimum bbox
+    are kept until the clusters are regenerated. Packed *facets* of the
+    Locality are subtracted if they are given
+
+    Returns False if there is no cluster of the point
+    """
+
+    matched = find_point(clusters, uuid, geom)
+    if matched is None:
+        return False
+
+    matched['count'] -= 1
+    count_facets(matched, facets, -1)
+    if matched['count'] <= 0:
+        clusters.remove(matched)
+    return True
+
+
+def recount_point(clusters, uuid, geom, old_facets, new_facets):
+    """
+    Replace packed facets of a Locality which isn't moved in the cluster
+    it's counted by, returns True if the facet counts are changed
+    """
+
+    if old_facets is None or new_facets is None or old_facets == new_facets:
+        return False
+
+    matched = find_point(clusters, uuid, geom)
+    if matched is None or 'numbers' not in matched:
+        return False
+
+    count_facets(matched, old_facets, -1)
+    count_facets(matched, new_facets)
+    return True
+
+
+def rename_point(clusters, uuid, name):
+    """
+    Set a name of the cluster created by a Locality, returns True if the
+    name is changed
+    """
+
+    changed = False
+    for cluster_point in clusters:
+        if cluster_point['uuid'] == uuid and cluster_point.get('name') != name:
+            cluster_point['name'] = name
+            changed = True
+    return changed
+
+
+def apply_change(clusters, zoom, icon_size, uuid, name, old_geom, new_geom,
+                 old_facets=None, new_facets=None):
+    """
+    Apply a change of a Locality to a list of clusters, returns True if the
+    clusters are changed
+
+    Facets are counted only by clusters which have them, clusters generated
+    without facets don't get them
+    """
+
+    if not any('numbers' in cluster_point for cluster_point in clusters):
+        old_facets = new_facets = None
+
+    changed = False
+    if old_geom != new_geom:
+        if old_geom is not None:
+            changed = remove_point(clusters, uuid, old_geom, old_facets) or changed
+        if new_geom is not None:
+            changed = add_point(
+                clusters, zoom, icon_size[0], icon_size[1], uuid, name, new_geom, new_facets
+            ) or changed
+    elif new_geom is not None:
+        changed = recount_point(clusters, uuid, new_geom, old_facets, new_facets)
+    if new_geom is not None:
+        changed = rename_point(clusters, uuid, name) or changed
+    return changed
+
+
+def update_cluster_cache(filename, zoom, icon_size, uuid, name, old_geom, new_geom,
+                         old_facets=None, new_facets=None):
+    """
+    Apply a change of a Locality to cached clusters, *old_geom* is None for
+    an inserted Locality and *new_geom* is None for a deleted Locality.
+    *old_facets* and *new_facets* are packed facets of the Locality before
+    and after the change, if cached clusters count facets
+
+    Missing caches are not created, they are created when requested. Caches
+    which clusters are not changed are not rewritten
+    """
+
+    if not os.path.exists(filename):
+        return
+
+    with cache_lock(filename, getattr(settings, 'CLUSTER_CACHE_LOCK_TIMEOUT', 30)):
+        try:
+            clusters = read_cluster_cache(filename)
+        except IOError:
+            return
+
+        if apply_change(clusters, zoom, icon_size, uuid, name, old_geom, new_geom,
+                        old_facets, new_facets):
+            write_cluster_cache(filename, clusters)
+
+
+def update_cluster_caches(uuid, old_geom, new_geom, old_country=None, new_country=None,
+                          old_facets=None):
+    """
+    Apply a change of a Locality to cached world clusters and to cached
+    clusters of the countries the Locality was and is in, for every cached
+    zoom and icon size
+
+    *old_facets* are packed facets of the Locality before the change, its
+    facets are assumed to be unchanged if they are not given
+    """
+
+    name, new_facets = '', None
+    if new_geom is not None:
+        name = locality_name(uuid)
+        new_facets = locality_facets(uuid)
+    if old_facets is None:
+        old_facets = new_facets
+
+    changes = [(None, old_geom, new_geom)]
+    if old_country == new_country:
+        if old_country:
+            changes.append((old_country, old_geom, new_geom))
+    else:
+        if old_country:
+            changes.append((old_country, old_geom, None))
+        if new_country:
+            changes.append((new_country, None, new_geom))
+
+    for icon_size in cached_icon_sizes():
+        for zoom in range(settings.CLUSTER_CACHE_MAX_ZOOM + 1):
+            for country_name, country_old_geom, country_new_geom in changes:
+                update_cluster_cache(
+                    cluster_cache_filename(zoom, icon_size, country_name),
+                    zoom, icon_size, uuid, name, country_old_geom, country_new_geom,
+                    old_facets, new_facets
+                )
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import logging
+
+LOG = logging.getLogger(__name__)
+
+import math
+import time
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.db.models import Count, Max
+
+
+class CountryLocator(object):
+    """
+    Grid index of prepared CountryPart geometries, for locating the Country
+    of a point without querying the database
+
+    Every part is indexed in every grid cell its bbox overlaps, a point is
+    tested only against the parts of its cell
+    """
+
+    def __init__(self, parts, cell_size=1.0):
+        self.cell_size = cell_size
+        self.parts = []
+        self.grid = {}
+
+        for country_id, polygon in parts:
+            extent = polygon.extent
+            for cell in self._cells(extent):
+                self.grid.setdefault(cell, []).append(len(self.parts))
+            self.parts.append((country_id, extent, polygon.prepared))
+
+    def _cell(self, x, y):
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def _cells(self, bbox):
+        min_col, min_row = self._cell(bbox[0], bbox[1])
+        max_col, max_row = self._cell(bbox[2], bbox[3])
+        for col in xrange(min_col, max_col + 1):
+            for row in xrange(min_row, max_row + 1):
+                yield (col, row)
+
+    def locate(self, x, y):
+        """
+        Get id of the Country a point (x, y) is in, or None
+
+        Parts share their cut edges, so a point on a boundary is covered by
+        a part rather than contained in it
+        """
+
+        point = None
+        for index in self.grid.get(self._cell(x, y), ()):
+            country_id, extent, prepared = self.parts[index]
+            if extent[0] <= x <= extent[2] and extent[1] <= y <= extent[3]:
+                if point is None:
+                    point = Point(x, y, srid=4326)
+                if prepared.covers(point):
+                    return country_id
+        return None
+
+    def locate_points(self, points):
+        """
+        Get a dictionary of lists of points (id, uuid, geomx, geomy, ...),
+        keyed by the id of the Country they are in, or None
+        """
+
+        countries = {}
+        for point in points:
+            countries.setdefault(self.locate(point[2], point[3]), []).append(point)
+        return countries
+
+
+# country locator of this process, with the version of CountryParts it's
+# loaded from and the time the version was checked
+_country_locator = {'version': None, 'locator': None, 'checked': 0}
+
+
+def get_country_locator():
+    """
+    Get the country locator, CountryParts are loaded once per process and
+    reloaded when they are changed
+
+    CountryParts are replaced when a Country is saved, so their number and
+    their latest id are a version of them. The version is checked at most
+    every COUNTRY_LOCATOR_TTL seconds, and right away after a Country is
+    changed by this process
+    """
+
+    # avoid circular import, the locator is used by the models
+    from .models import CountryPart
+
+    now = time.time()
+    ttl = getattr(settings, 'COUNTRY_LOCATOR_TTL', 60)
+    if (_country_locator['locator'] is not None and
+            now - _country_locator['checked'] < ttl):
+        return _country_locator['locator']
+
+    version = CountryPart.objects.aggregate(count=Count('id'), latest=Max('id'))
+    version = (version['count'], version['latest'])
+    _country_locator['checked'] = now
+    if _country_locator['version'] == version:
+        return _country_locator['locator']
+
+    locator = CountryLocator(
+        CountryPart.objects.values_list('country_id', 'polygon').iterator())
+    _country_locator.update({'version': version, 'locator': locator})
+    LOG.debug('Loaded country locator of %s country parts', version[0])
+    return locator
+
+
+def invalidate_country_locator():
+    """
+    Check the version of CountryParts on the next use of the country locator
+    """
+
+    _country_locator['checked'] = 0
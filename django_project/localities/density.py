@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import logging
+
+LOG = logging.getLogger(__name__)
+
+import os
+import struct
+import sys
+from array import array
+
+from django.conf import settings
+from django.db import connection
+
+from .cache_files import write_cache_file
+from .map_clustering import FACILITY_TYPES
+from .models import Attribute, Locality, Specification, Value
+
+# magic, version, zoom, number of columns, number of rows, number of cells,
+# number of Localities
+HEADER = struct.Struct('<4sHHIIII')
+
+MAGIC = 'HSDG'
+VERSION = 1
+
+
+def grid_size(zoom):
+    """
+    Get number of columns and rows of a density grid for a zoom, the number
+    of columns doubles with every zoom
+    """
+
+    columns = getattr(settings, 'DENSITY_GRID_COLUMNS', 256) * 2 ** zoom
+    return columns, columns // 2
+
+
+def density_filename(zoom, facility_type=None):
+    """
+    Get filename of a density grid for a zoom, of all master Localities or
+    of a facility type
+    """
+
+    if facility_type:
+        filename = 'density_{}_{}.bin'.format(zoom, facility_type)
+    else:
+        filename = 'density_{}.bin'.format(zoom)
+
+    return os.path.join(settings.CLUSTER_CACHE_DIR, filename)
+
+
+def density_grids(query_set, zoom):
+    """
+    Count Localities in every cell of a density grid for a zoom, in a single
+    aggregate query
+
+    Cells are numbered from the top left corner (-180, 90) of the world.
+    Returns a dictionary of grids keyed by a facility type name of
+    FACILITY_TYPES, or None for all of the Localities, every grid is a
+    dictionary of counts keyed by a cell (column, row)
+    """
+
+    columns, rows = grid_size(zoom)
+    cell_size = 360.0 / columns
+    localities_sql, params = query_set.values('id').query.sql_with_params()
+
+    sql = """
+        SELECT
+            LEAST(floor((ST_X(l.geom) + 180) / %s)::int, %s),
+            LEAST(floor((90 - ST_Y(l.geom)) / %s)::int, %s),
+            count(*){type_counts}
+        FROM {locality} l
+        LEFT JOIN (
+            SELECT v.locality_id, lower(string_agg(v.data, ' ')) AS data
+            FROM {value} v
+            JOIN {specification} s ON s.id = v.specification_id
+            JOIN {attribute} a ON a.id = s.attribute_id
+            WHERE a.key = 'type'
+            GROUP BY v.locality_id
+        ) t ON t.locality_id = l.id
+        WHERE l.id IN ({localities})
+        GROUP BY 1, 2
+    """.format(
+        type_counts=''.join(
+            ', sum(CASE WHEN t.data LIKE %s THEN 1 ELSE 0 END)' for _ in FACILITY_TYPES
+        ),
+        locality=Locality._meta.db_table,
+        value=Value._meta.db_table,
+        specification=Specification._meta.db_table,
+        attribute=Attribute._meta.db_table,
+        localities=localities_sql
+    )
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            sql,
+            [cell_size, columns - 1, cell_size, rows - 1] +
+            ['%%%s%%' % keyword for name, keyword in FACILITY_TYPES] + list(params)
+        )
+        results = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    grids = dict((name, {}) for name, keyword in FACILITY_TYPES)
+    grids[None] = {}
+    for result in results:
+        cell = (result[0], result[1])
+        grids[None][cell] = result[2]
+        for (name, keyword), count in zip(FACILITY_TYPES, result[3:]):
+            if count:
+                grids[name][cell] = count
+
+    return grids
+
+
+def downsample_grid(grid):
+    """
+    Get a density grid for the zoom below, every cell of it is made of 2 x 2
+    cells of a *grid*
+    """
+
+    downsampled = {}
+    for (column, row), count in grid.iteritems():
+        cell = (column // 2, row // 2)
+        downsampled[cell] = downsampled.get(cell, 0) + count
+    return downsampled
+
+
+def encode_density_grid(zoom, grid):
+    """
+    Encode a density grid as a header followed by (cell index, count) records
+    of non empty cells, ordered by the cell index (row * columns + column)
+    """
+
+    columns, rows = grid_size(zoom)
+
+    records = array('I')
+    for index, count in sorted(
+            (row * columns + column, count) for (column, row), count in grid.iteritems()):
+        records.append(index)
+        records.append(count)
+    if sys.byteorder != 'little':
+        records.byteswap()
+
+    return HEADER.pack(
+        MAGIC, VERSION, zoom, columns, rows, len(grid), sum(grid.itervalues())
+    ) + records.tostring()
+
+
+def decode_density_grid(data):
+    """
+    Decode an encoded density grid, returns the zoom, number of columns and
+    rows and a dictionary of counts keyed by a cell (column, row)
+    """
+
+    magic, version, zoom, columns, rows, cells, total = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a density grid')
+
+    records = array('I')
+    records.fromstring(data[HEADER.size:HEADER.size + cells * 2 * records.itemsize])
+    if sys.byteorder != 'little':
+        records.byteswap()
+
+    grid = {}
+    for position in xrange(0, len(records), 2):
+        row, column = divmod(records[position], columns)
+        grid[(column, row)] = records[position + 1]
+
+    return zoom, columns, rows, grid
+
+
+def write_density_grids(query_set, max_zoom=None):
+    """
+    Write density grids of every zoom up to *max_zoom* (DENSITY_GRID_MAX_ZOOM
+    by default), of all of the Localities and of every facility type,
+    returns the number of counted Localities
+
+    Localities are counted in a single aggregate query for *max_zoom*, grids
+    of every lower zoom are downsampled from the zoom above it
+    """
+
+    if max_zoom is None:
+        max_zoom = settings.DENSITY_GRID_MAX_ZOOM
+
+    grids = density_grids(query_set, max_zoom)
+    for zoom in range(max_zoom, -1, -1):
+        if zoom < max_zoom:
+            grids = dict(
+                (facility_type, downsample_grid(grid))
+                for facility_type, grid in grids.iteritems()
+            )
+        for facility_type, grid in grids.iteritems():
+            write_cache_file(
+                density_filename(zoom, facility_type),
+                encode_density_grid(zoom, grid), compress=True
+            )
+
+    return sum(grids[None].itervalues())
@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+
+import itertools
+import json
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import Point
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from localities.map_clustering import cluster, numpy
+from localities.models import Attribute, Changeset, Domain, Locality, Specification, Value
+from localities.search_cache import search_cache
+from localities.utils import get_heathsites_master, get_statistic, parse_bbox
+from localities.views import LocalitiesLayer
+
+# populated areas (lng, lat, spread in degrees, weight) synthetic Localities
+# are concentrated around, the rest of them are spread over inhabited
+# latitudes
+HOTSPOTS = (
+    (3.38, 6.52, 2.0, 8),  # Lagos
+    (36.82, -1.29, 2.5, 6),  # Nairobi
+    (15.31, -4.32, 3.0, 5),  # Kinshasa
+    (31.24, 30.04, 1.5, 5),  # Cairo
+    (77.21, 28.61, 4.0, 10),  # Delhi
+    (90.41, 23.81, 1.5, 8),  # Dhaka
+    (106.85, -6.21, 2.0, 7),  # Jakarta
+    (120.98, 14.60, 2.0, 5),  # Manila
+    (-46.63, -23.55, 3.0, 6),  # Sao Paulo
+    (-99.13, 19.43, 2.5, 5),  # Mexico City
+    (-0.13, 51.51, 2.0, 4),  # London
+    (-74.01, 40.71, 2.0, 4),  # New York
+)
+BACKGROUND = 0.2
+
+# 'type' values of synthetic Localities and their weights
+FACILITY_TYPES = (
+    ('hospital', 10), ('clinic', 40), ('orthopaedic clinic', 2),
+    ('pharmacy', 20), ('', 28),
+)
+
+
+def synthetic_localities(seed):
+    """
+    Yield an endless reproducible sequence of synthetic Localities
+    (geomx, geomy, completeness, facility type)
+    """
+
+    rnd = random.Random(seed)
+    hotspots = [hotspot for hotspot in HOTSPOTS for _ in range(hotspot[3])]
+    facility_types = [
+        facility_type for facility_type, weight in FACILITY_TYPES
+        for _ in range(weight)
+    ]
+
+    while True:
+        if rnd.random() < BACKGROUND:
+            geomx, geomy = rnd.uniform(-170, 180), rnd.uniform(-56, 72)
+        else:
+            lng, lat, spread, weight = rnd.choice(hotspots)
+            geomx = max(-179.9, min(179.9, rnd.gauss(lng, spread)))
+            geomy = max(-84.9, min(84.9, rnd.gauss(lat, spread)))
+
+        bucket = rnd.random()
+        if bucket < 0.05:
+            completeness = 100.0
+        elif bucket < 0.4:
+            completeness = rnd.uniform(31, 99)
+        else:
+            completeness = rnd.uniform(5, 30)
+
+        yield geomx, geomy, completeness, rnd.choice(facility_types)
+
+
+def rss_kb(field):
+    """
+    Get a resident set size of this process in kB, 'VmRSS' for the current
+    one or 'VmHWM' for the peak one, or None if it's not known
+    """
+
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of this process to the current one,
+    returns False if it can't be reset
+    """
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except IOError:
+        return False
+    return True
+
+
+def viewport_bbox(zoom, lng, lat, width=1024, height=768):
+    """
+    Get bbox of a map view of *width* x *height* pixels centered at a point
+    """
+
+    lng_range = 360.0 * width / (256 * 2 ** zoom) / 2
+    lat_range = min(180.0 * height / (256 * 2 ** zoom) / 2, 85)
+    return (
+        max(lng - lng_range, -180), max(lat - lat_range, -90),
+        min(lng + lng_range, 180), min(lat + lat_range, 90)
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark clustering, cluster cache generation, the localities view '
+        'and statistics on synthetic Localities, and write a JSON report'
+    )
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--sizes', action='store', dest='sizes',
+            default='10000,100000,1000000',
+            help='Comma separated numbers of synthetic Localities'
+        ),
+        make_option(
+            '--max-zoom', action='store', type='int', dest='max_zoom', default=8,
+            help='Benchmark clustering and the view for zooms 0 to max zoom'
+        ),
+        make_option(
+            '--iconsize', action='store', dest='iconsize', default='48,46',
+            help='Icon size (width,height) of clusters'
+        ),
+        make_option(
+            '--seed', action='store', type='int', dest='seed', default=1,
+            help='Seed of the synthetic Localities'
+        ),
+        make_option(
+            '--output', action='store', dest='output', default=None,
+            help='Filename of the JSON report, written to stdout by default'
+        ),
+        make_option(
+            '--in-place', action='store_true', dest='in_place', default=False,
+            help='Add synthetic Localities to the current database in a '
+                 'transaction which is rolled back, instead of to a throwaway '
+                 'test database'
+        ),
+        make_option(
+            '--keepdb', action='store_true', dest='keepdb', default=False,
+            help='Keep the test database and its synthetic Localities for '
+                 'the next run'
+        ),
+    )
+
+    def handle(self, *args, **options):
+
+        try:
+            sizes = sorted(int(size) for size in options['sizes'].split(','))
+            icon_size = [int(size) for size in options['iconsize'].split(',')]
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if len(icon_size) != 2 or any(size < 0 for size in icon_size + sizes):
+            raise CommandError('Sizes should be positive numbers')
+        if options['max_zoom'] < 0:
+            raise CommandError('Max zoom should be a positive number')
+
+        self.icon_size = icon_size
+        self.zooms = range(options['max_zoom'] + 1)
+        self.results = []
+
+        if options['in_place']:
+            # synthetic Localities are never committed to the current database
+            with transaction.atomic():
+                self.benchmark_sizes(sizes, options['seed'])
+                transaction.set_rollback(True)
+        else:
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False,
+                keepdb=options['keepdb']
+            )
+            try:
+                self.benchmark_sizes(sizes, options['seed'])
+            finally:
+                connection.creation.destroy_test_db(
+                    old_name, verbosity=0, keepdb=options['keepdb'])
+
+        report = json.dumps({
+            'icon_size': icon_size,
+            'zooms': self.zooms,
+            'numpy': numpy is not None,
+            'results': self.results
+        }, indent=2)
+
+        if options['output']:
+            with open(options['output'], 'wb') as report_file:
+                report_file.write(report)
+        else:
+            self.stdout.write(report)
+
+    def benchmark_sizes(self, sizes, seed):
+        """
+        Add synthetic master Localities and run every benchmark for every
+        size, with caches written to a throwaway directory
+        """
+
+        cache_dir = tempfile.mkdtemp()
+        try:
+            localities = synthetic_localities(seed)
+            with override_settings(CLUSTER_CACHE_DIR=cache_dir):
+                for size in sizes:
+                    self.populate(localities, size)
+                    self.benchmark_size(size)
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    def populate(self, localities, size, batch_size=5000):
+        """
+        Add synthetic master Localities until there are *size* of them
+        """
+
+        user, created = User.objects.get_or_create(username='benchmark')
+        changeset = Changeset.objects.create(social_user=user)
+
+        domain = Domain.objects.filter(name='Health').first()
+        if domain is None:
+            domain = Domain(name='Health', changeset=changeset)
+            domain.save()
+
+        specifications = {}
+        for key in ('name', 'type'):
+            attribute = Attribute.objects.filter(key=key).first()
+            if attribute is None:
+                attribute = Attribute(key=key, changeset=changeset)
+                attribute.save()
+            specification = Specification.objects.filter(
+                domain=domain, attribute=attribute).first()
+            if specification is None:
+                specification = Specification(
+                    domain=domain, attribute=attribute, changeset=changeset)
+                specification.save()
+            specifications[key] = specification
+
+        existing = get_heathsites_master().count()
+        # synthetic Localities are the same for every size
+        localities = itertools.islice(localities, 0, max(size - existing, 0))
+
+        start = time.time()
+        added = 0
+        while True:
+            batch = list(itertools.islice(localities, batch_size))
+            if not batch:
+                break
+
+            uuids = [uuid.uuid4().hex for _ in batch]
+            Locality.objects.bulk_create([
+                Locality(
+                    domain=domain, changeset=changeset, version=1,
+                    uuid=locality_uuid, upstream_id=u'benchmark::%s' % locality_uuid,
+                    geom=Point(geomx, geomy, srid=4326), completeness=completeness
+                )
+                for locality_uuid, (geomx, geomy, completeness, facility_type)
+                in zip(uuids, batch)
+            ])
+
+            # bulk created Localities have no ids
+            ids = dict(Locality.objects.filter(uuid__in=uuids).values_list('uuid', 'id'))
+            values = []
+            for index, (locality_uuid, locality) in enumerate(zip(uuids, batch), added):
+                values.append(Value(
+                    locality_id=ids[locality_uuid], specification=specifications['name'],
+                    changeset=changeset, version=1, data=u'Facility %s' % index
+                ))
+                if locality[3]:
+                    values.append(Value(
+                        locality_id=ids[locality_uuid], specification=specifications['type'],
+                        changeset=changeset, version=1, data=locality[3]
+                    ))
+            Value.objects.bulk_create(values)
+
+            added += len(batch)
+
+        self.stderr.write(
+            'Added %s synthetic Localities in %.2fs' % (added, time.time() - start))
+
+    def measure(self, benchmark, size, function, **params):
+        """
+        Measure wall time, peak memory and number of queries of a function,
+        and add them to the report
+
+        Peak memory is the peak resident set size of this process while the
+        function runs, 'peak_rss_kb', and its growth over the resident set
+        size before, 'rss_growth_kb'. The peak is reset before every
+        measurement, both are None where it can't be reset
+        """
+
+        peak_rss = rss_before = None
+        if reset_peak_rss():
+            rss_before = rss_kb('VmRSS')
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.time()
+            result = function()
+            wall_time = time.time() - start
+
+        if rss_before is not None:
+            peak_rss = rss_kb('VmHWM')
+
+        params.update({
+            'benchmark': benchmark,
+            'size': size,
+            'wall_time': round(wall_time, 4),
+            'peak_rss_kb': peak_rss,
+            'rss_growth_kb': (
+                peak_rss - rss_before if peak_rss is not None else None),
+            'queries': len(queries),
+            'result': result
+        })
+        self.results.append(params)
+        self.stderr.write(
+            '%(benchmark)s, size: %(size)s, zoom: %(zoom)s in %(wall_time).2fs, '
+            '%(queries)s queries' % dict({'zoom': '-'}, **params)
+        )
+
+    def benchmark_size(self, size):
+        """
+        Run every benchmark for master Localities of a size
+        """
+
+        world = get_heathsites_master().in_bbox(parse_bbox('-180,-90,180,90'))
+        engines = ['python', 'numpy'] if numpy is not None else ['python']
+        view = LocalitiesLayer.as_view()
+        factory = RequestFactory()
+        center = HOTSPOTS[0]
+        icon_size = self.icon_size
+
+        for zoom in self.zooms:
+            for engine in engines:
+                self.measure(
+                    'cluster', size,
+                    lambda: len(cluster(world, zoom, icon_size[0], icon_size[1], engine=engine)),
+                    zoom=zoom, engine=engine
+                )
+
+        self.measure(
+            'gen_locality_snapshot', size,
+            lambda: call_command('gen_locality_snapshot', stdout=sys.stderr)
+        )
+        self.measure(
+            'gen_cluster_cache', size,
+            lambda: call_command(
+                'gen_cluster_cache', icon_size[0], icon_size[1], stdout=sys.stderr)
+        )
+
+        for zoom in self.zooms:
+            bbox = viewport_bbox(zoom, center[0], center[1])
+
+            def request_view():
+                search_cache.clear()
+                request = factory.get('/localities.json', {
+                    'bbox': ','.join(str(coord) for coord in bbox),
+                    'zoom': zoom, 'iconsize': '%s,%s' % tuple(icon_size),
+                    'geoname': '', 'tag': '', 'spec': '', 'data': '', 'uuid': ''
+                })
+                response = view(request)
+                if response.streaming:
+                    return sum(len(chunk) for chunk in response.streaming_content)
+                return len(response.content)
+
+            self.measure('view', size, request_view, zoom=zoom, bbox=bbox)
+
+        self.measure(
+            'get_statistic', size, lambda: get_statistic(world)['localities']
+        )
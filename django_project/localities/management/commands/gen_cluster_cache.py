@@ -1,68 +1,204 @@
 # -*- coding: utf-8 -*-
 from optparse import make_option
 
-import json
+import multiprocessing
+import time
 
-import os
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
+from django.db import connections
 from localities.models import Locality, Country
-from localities.map_clustering import cluster
+from localities.cluster_cache import cluster_cache_filename, icon_size_buckets, write_cluster_cache
+from localities.country_locator import get_country_locator
+from localities.map_clustering import cluster, cluster_pyramid, load_facets, load_points
+from localities.snapshot import get_fresh_snapshot
 from localities.utils import parse_bbox, get_heathsites_master
 
+# points and facets of master Localities and points of every country, loaded
+# once and shared with forked workers
+WORLD_POINTS = []
+WORLD_FACETS = {}
+COUNTRY_POINTS = {}
+
+
+def close_connections():
+    """
+    Close database connections, so every worker process opens its own
+    """
+
+    for connection in connections.all():
+        connection.close()
+
+
+def generate_cluster_cache(job):
+    """
+    Generate cached clusters for a job (country_id, zooms, icon_size, exact,
+    facets), clusters are generated for the world if country_id is None
+
+    Returns the job, the name of its country and the time it took
+    """
+
+    country_id, zooms, icon_size, exact, facets = job
+    start = time.time()
+
+    country_name = None
+    if country_id is None:
+        localities = get_heathsites_master().in_bbox(parse_bbox('-180,-90,180,90'))
+    else:
+        country = Country.objects.get(id=country_id)
+        country_name = country.name
+        localities = get_heathsites_master().in_country(country)
+
+    if exact:
+        for zoom in zooms:
+            object_list = cluster(localities, zoom, icon_size[0], icon_size[1], facets=facets)
+            write_cluster_cache(cluster_cache_filename(zoom, icon_size, country_name), object_list)
+    else:
+        points = WORLD_POINTS
+        if country_id is not None:
+            points = COUNTRY_POINTS.get(country_id, [])
+
+        pyramid = cluster_pyramid(
+            points, min(zooms), max(zooms), icon_size[0], icon_size[1],
+            WORLD_FACETS if facets else None
+        )
+        for zoom, object_list in pyramid.items():
+            write_cluster_cache(cluster_cache_filename(zoom, icon_size, country_name), object_list)
+
+    return job, country_name, time.time() - start
+
 
 class Command(BaseCommand):
-    args = '<icon_width> <icon_height>'
-    help = 'Generate locality cluster cache'
+    args = '[<icon_width> <icon_height>]'
+    help = 'Generate locality cluster cache, for every icon size bucket if no icon size is given'
 
     option_list = BaseCommand.option_list + (
         make_option(
             '--tabs', action='store_true', dest='use_tabs', default=False,
             help='Use when input file is tab delimited'
         ),
+        make_option(
+            '--exact', action='store_true', dest='exact', default=False,
+            help='Cluster Localities from scratch for every zoom, instead '
+                 'of building clusters of all zooms in a single pass'
+        ),
+        make_option(
+            '--workers', action='store', type='int', dest='workers', default=1,
+            help='Number of worker processes generating the cache'
+        ),
+        make_option(
+            '--facets', action='store_true', dest='facets',
+            default=getattr(settings, 'CLUSTER_CACHE_FACETS', False),
+            help='Add counts of Localities by facility type and by '
+                 'completeness to every cluster, CLUSTER_CACHE_FACETS by default'
+        ),
+        make_option(
+            '--no-facets', action='store_false', dest='facets',
+            help='Don\'t add counts of Localities to clusters'
+        ),
     )
 
     def handle(self, *args, **options):
 
-        if len(args) != 2:
+        icon_sizes = self.parse_icon_sizes(args)
+
+        workers = options.get('workers', 1)
+        if workers is None or workers < 1:
+            raise CommandError('Number of workers should be a positive number')
+
+        exact = options.get('exact')
+        facets = options.get('facets')
+        zooms = range(settings.CLUSTER_CACHE_MAX_ZOOM + 1)
+        country_ids = [None] + list(Country.objects.order_by('id').values_list('id', flat=True))
+
+        if exact:
+            # every zoom of every country and icon size is a separate job
+            jobs = [
+                (country_id, [zoom], icon_size, exact, facets)
+                for icon_size in icon_sizes
+                for country_id in country_ids for zoom in zooms
+            ]
+        else:
+            # a cluster pyramid has clusters of every zoom of a country
+            jobs = [
+                (country_id, zooms, icon_size, exact, facets)
+                for icon_size in icon_sizes for country_id in country_ids
+            ]
+            self.load_world_points(facets)
+
+        start = time.time()
+        if workers > 1:
+            # forked workers can't share the database connection
+            close_connections()
+            pool = multiprocessing.Pool(workers, initializer=close_connections)
+            try:
+                results = pool.imap_unordered(generate_cluster_cache, jobs)
+                self.report(results, len(jobs))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            self.report((generate_cluster_cache(job) for job in jobs), len(jobs))
+
+        self.stdout.write(
+            'Generated cluster cache for %s jobs in %.2fs' % (len(jobs), time.time() - start)
+        )
+
+    def parse_icon_sizes(self, args):
+        """
+        Get icon sizes [width, height] of arguments, or of every icon size
+        bucket if no icon size is given
+        """
+
+        if len(args) == 0:
+            # generate every icon size bucket
+            icon_sizes = [list(icon_size) for icon_size in icon_size_buckets()]
+            if not icon_sizes:
+                raise CommandError('There are no CLUSTER_ICON_SIZE_BUCKETS')
+        elif len(args) == 2:
+            try:
+                icon_sizes = [[int(size) for size in args[0:2]]]
+            except Exception as e:
+                raise CommandError(str(e))
+        else:
             raise CommandError('Missing required arguments')
 
-        try:
-            icon_size = [int(size) for size in args[0:2]]
-        except Exception as e:
-            raise CommandError(str(e))
-
-        if any((size < 0 for size in icon_size)):
+        if any((size < 0 for icon_size in icon_sizes for size in icon_size)):
             # icon sizes should be positive
             raise CommandError('Icon sizes should be positive numbers')
 
-        for zoom in range(settings.CLUSTER_CACHE_MAX_ZOOM + 1):
-            filename = os.path.join(
-                settings.CLUSTER_CACHE_DIR,
-                '{}_{}_{}_localities.json'.format(zoom, *icon_size)
-            )
-
-            localities = get_heathsites_master().in_bbox(parse_bbox('-180,-90,180,90'))
-            object_list = cluster(localities, zoom, *icon_size)
-
-            with open(filename, 'wb') as cache_file:
-                json.dump(object_list, cache_file)
-
-            self.stdout.write('Generated cluster cache for zoom: %s' % zoom)
-
-        for country in Country.objects.all():
-            self.stdout.write('Generated cluster for %s' % country.name)
-            polygon = country.polygon_geometry
-            localities = get_heathsites_master().in_polygon(polygon)
-            for zoom in range(settings.CLUSTER_CACHE_MAX_ZOOM + 1):
-                filename = os.path.join(
-                    settings.CLUSTER_CACHE_DIR,
-                    '{}_{}_{}_localities_{}.json'.format(zoom, icon_size[0], icon_size[1], country.name)
+        return icon_sizes
+
+    def load_world_points(self, facets):
+        """
+        Load points and facets of master Localities once, for every job, and
+        locate points in countries
+        """
+
+        world = get_heathsites_master().in_bbox(parse_bbox('-180,-90,180,90'))
+        snapshot = get_fresh_snapshot()
+        if snapshot is not None:
+            WORLD_POINTS[:] = snapshot.points()
+        else:
+            WORLD_POINTS[:] = load_points(world)
+        WORLD_FACETS.clear()
+        if facets:
+            WORLD_FACETS.update(load_facets(world))
+
+        # points are located in countries in process, instead of
+        # querying Localities of every country
+        COUNTRY_POINTS.clear()
+        COUNTRY_POINTS.update(get_country_locator().locate_points(WORLD_POINTS))
+
+    def report(self, results, number):
+        """
+        Report progress and time of finished jobs
+        """
+
+        for index, (job, country_name, job_time) in enumerate(results, 1):
+            self.stdout.write(
+                '[%s/%s] Generated cluster cache for %s, icon size: %sx%s, zoom: %s in %.2fs' % (
+                    index, number, country_name or 'world', job[2][0], job[2][1],
+                    ', '.join(str(zoom) for zoom in job[1]), job_time
                 )
-
-                object_list = cluster(localities, zoom, *icon_size)
-
-                with open(filename, 'wb') as cache_file:
-                    json.dump(object_list, cache_file)
-
-                self.stdout.write('Generated cluster cache for zoom: %s' % zoom)
+            )
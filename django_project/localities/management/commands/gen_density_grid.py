@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from localities.density import write_density_grids
+from localities.utils import get_heathsites_master
+
+
+class Command(BaseCommand):
+    help = 'Generate density grids of master Localities for every zoom'
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--max-zoom', action='store', type='int', dest='max_zoom',
+            default=None,
+            help='Highest zoom of density grids, DENSITY_GRID_MAX_ZOOM by default'
+        ),
+    )
+
+    def handle(self, *args, **options):
+
+        max_zoom = options.get('max_zoom')
+        if max_zoom is None:
+            max_zoom = settings.DENSITY_GRID_MAX_ZOOM
+        if max_zoom < 0:
+            raise CommandError('Max zoom should be a positive number')
+
+        start = time.time()
+        count = write_density_grids(get_heathsites_master(), max_zoom)
+        self.stdout.write(
+            'Generated density grids of %s Localities for zoom 0 to %s in %.2fs' % (
+                count, max_zoom, time.time() - start)
+        )
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from localities.snapshot import snapshot_filename, write_snapshot
+
+
+class Command(BaseCommand):
+    args = '[<filename>]'
+    help = 'Generate binary snapshot of master Localities used for clustering'
+
+    def handle(self, *args, **options):
+
+        if len(args) > 1:
+            raise CommandError('Too many arguments')
+
+        filename = args[0] if args else snapshot_filename()
+
+        start = time.time()
+        count = write_snapshot(filename)
+        self.stdout.write(
+            'Generated snapshot of %s Localities in %s in %.2fs' % (
+                count, filename, time.time() - start)
+        )
@@ -7,7 +7,7 @@ __copyright__ = 'kartoza.com'
 from django.core.management.base import BaseCommand
 from django.contrib.gis.gdal import DataSource
 from django.contrib.gis.geos import MultiPolygon, Polygon
-from localities.models import Country
+from localities.models import Country, Locality
 
 
 class Command(BaseCommand):
@@ -81,3 +81,7 @@ class Command(BaseCommand):
                 country = Country(name=country_name)
                 country.polygon_geometry = geometry
             country.save()
+
+        # countries are recreated, Localities are assigned to them again
+        updated = Locality.objects.all().update_countries()
+        self.stdout.write('Assigned countries of %s localities' % updated)
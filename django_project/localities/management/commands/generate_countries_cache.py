@@ -3,53 +3,28 @@ from optparse import make_option
 
 from django.core.management.base import BaseCommand
 
-from localities.models import Country, Locality
-import os
-import json
-from django.conf import settings
-from localities.utils import get_statistic
-from django.core.serializers.json import DjangoJSONEncoder
-from localities.utils import get_heathsites_master
+from localities.models import Country
+from localities.utils import update_country_statistic
 
 
 class Command(BaseCommand):
-    help = 'Import Localities from CSV file'
+    help = 'Count statistics of the world and of every country from scratch'
 
     def handle(self, *args, **options):
 
         countries = Country.objects.all()
 
         try:
-            # write world cache
-            filename = os.path.join(
-                    settings.CLUSTER_CACHE_DIR,
-                    'world_statistic')
-            healthsites = get_heathsites_master().all()
-            output = get_statistic(healthsites)
-            result = json.dumps(output, cls=DjangoJSONEncoder)
-            file = open(filename, 'w')
-            file.write(result)  # python will convert \n to os.linesep
-            file.close()  # you can omit in most cases as the destructor will call it
+            # world statistics
+            update_country_statistic()
             print "world cache is finished"
         except Exception as ex:
             print "skip world"
 
         for country in countries:
             try:
-                polygons = country.polygon_geometry
-
-                # write country cache
-                filename = os.path.join(
-                        settings.CLUSTER_CACHE_DIR,
-                        country.name + '_statistic'
-                )
-                healthsites = get_heathsites_master().in_polygon(
-                        polygons)
-                output = get_statistic(healthsites)
-                result = json.dumps(output, cls=DjangoJSONEncoder)
-                file = open(filename, 'w')
-                file.write(result)  # python will convert \n to os.linesep
-                file.close()  # you can omit in most cases as the destructor will call it
+                # country statistics
+                update_country_statistic(country)
                 print country.name + " cache is finished"
             except Exception as e:
                 print e
@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 from optparse import make_option
 
-from core.utilities import extract_time
 from django.core.management.base import BaseCommand, CommandError
 from localities.models import Changeset, Locality
 from localities.utils import parse_bbox
@@ -53,33 +52,35 @@ class Command(BaseCommand):
             print "%s/%s count : %s" % (index, number, loc_cluster['count'])
             index += 1
             if loc_cluster['count'] > 1:
-                loc_cluster['localities'].sort(key=extract_time, reverse=True)
+                # Localities of a cluster are fetched in bulk, latest first
+                members = list(
+                    Locality.objects.filter(id__in=loc_cluster['localities']).order_by(
+                        '-changeset__created', 'id')
+                )
                 # check_master
                 master = None
                 index = 0
-                for locality in loc_cluster['localities']:
-                    checked_loc = Locality.objects.get(id=locality['id'])
-                    if "raw_source" in checked_loc.repr_dict()['values']:
-                        master = loc_cluster['localities'].pop(index)
+                for locality in members:
+                    if "raw_source" in locality.repr_dict()['values']:
+                        master = members.pop(index)
                         break
                     index += 1
                 if not master:
-                    master = loc_cluster['localities'].pop(0)
+                    master = members.pop(0)
 
-                print "master : %s " % master['uuid']
+                print "master : %s " % master.uuid
                 try:
-                    locality_master = Locality.objects.get(id=master['id'])
+                    locality_master = master
                     locality_master.master = None
                     locality_master.save()
 
                     synonyms = []
-                    for synonym in loc_cluster['localities']:
+                    for locality in members:
                         # set master of synonym
                         try:
-                            locality = Locality.objects.get(id=synonym['id'])
                             locality.master = locality_master
                             locality.save()
-                            synonyms.append(str(synonym['uuid']))
+                            synonyms.append(str(locality.uuid))
 
                             # fill the existed value
                             synonym_value = locality.repr_dict()['values']
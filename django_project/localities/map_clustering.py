@@ -4,7 +4,26 @@ import logging
 LOG = logging.getLogger(__name__)
 
 import math
-from localities.models import Value
+from array import array
+
+from django.conf import settings
+from django.db import connection
+from localities.models import Locality, Value
+
+try:
+    import numpy
+except ImportError:
+    # numpy engine is optional, pure Python engine is used instead
+    numpy = None
+
+# facility types (name, keyword of a 'type' value) and completeness buckets
+# counted by cluster facets, same as in the Locality statistics
+FACILITY_TYPES = (
+    ('hospital', 'hospital'),
+    ('medical_clinic', 'clinic'),
+    ('orthopaedic_clinic', 'orthopaedic'),
+)
+COMPLETENESS_BUCKETS = ('complete', 'partial', 'basic')
 
 
 def within_bbox(bbox, geomx, geomy):
@@ -36,6 +55,107 @@ def overlapping_area(zoom, pix_x, pix_y, lat):
     return (lng_deg, lat_deg)
 
 
+def grid_cell_size(zoom, pix_x, pix_y):
+    """
+    Calculate the size (lng_deg, lat_deg) of a grid cell used to index
+    clusters for a zoom and an icon size
+
+    A cluster 'catchment' area is largest at the equator, so a cell as wide
+    as the largest catchment half-width guarantees that a point can only be
+    within clusters indexed in its own or in one of the neighbouring cells
+    """
+
+    x_range, y_range = overlapping_area(zoom, pix_x, pix_y, 0)
+
+    # degenerate catchment areas can't contain any point, any size will do
+    return (x_range * 1.5 or 1.0, y_range * 1.5 or 1.0)
+
+
+def grid_cell(cell_size, geomx, geomy):
+    """
+    Get a grid cell index (column, row) for a point (geomx, geomy)
+    """
+
+    return (
+        int(math.floor(geomx / cell_size[0])),
+        int(math.floor(geomy / cell_size[1]))
+    )
+
+
+def find_cluster(cluster_grid, cluster_points, cell_size, geomx, geomy):
+    """
+    Find index of the first created cluster which 'catchment' area contains a
+    point (geomx, geomy), or None if there is no such cluster
+
+    *cluster_grid* maps grid cells to indexes of clusters created in a cell,
+    only clusters in the neighbouring grid cells are checked
+    """
+
+    col, row = grid_cell(cell_size, geomx, geomy)
+    matched = None
+    for cell_col in (col - 1, col, col + 1):
+        for cell_row in (row - 1, row, row + 1):
+            for cluster_index in cluster_grid.get((cell_col, cell_row), ()):
+                if matched is not None and cluster_index > matched:
+                    # cells are in creation order, later clusters lose
+                    break
+                if within_bbox(
+                        cluster_points[cluster_index].bbox, geomx, geomy):
+                    matched = cluster_index
+                    break
+
+    return matched
+
+
+def catchment_bbox(zoom, pix_x, pix_y, geomx, geomy):
+    """
+    Calculate cluster 'catchment' bbox (minx, miny, maxx, maxy) for a cluster
+    created at a point (geomx, geomy)
+    """
+
+    x_range, y_range = overlapping_area(zoom, pix_x, pix_y, geomy)
+
+    return (
+        geomx - x_range * 1.5, geomy - y_range * 1.5,
+        geomx + x_range * 1.5, geomy + y_range * 1.5
+    )
+
+
+def get_locality_names(uuids, batch_size=5000):
+    """
+    Get names of Localities keyed by their uuids, a Locality without a name
+    is not in the result
+
+    Names are retrieved in bulk, batch by batch, instead of a query for every
+    Locality
+    """
+
+    locality_names = {}
+    for start in range(0, len(uuids), batch_size):
+        names = Value.objects.filter(
+            locality__uuid__in=uuids[start:start + batch_size]).filter(
+            specification__attribute__key='name').values_list(
+            'locality__uuid', 'data')
+        for uuid, name in names:
+            locality_names.setdefault(uuid, name)
+
+    return locality_names
+
+
+def set_cluster_names(cluster_points, batch_size=5000):
+    """
+    Set names of clusters, a name of a cluster is the name of the Locality
+    that created the cluster
+    """
+
+    locality_names = get_locality_names(
+        [cluster_point['uuid'] for cluster_point in cluster_points], batch_size
+    )
+
+    for cluster_point in cluster_points:
+        cluster_point['name'] = locality_names.get(cluster_point['uuid'], '')
+
+
 def update_minbbox(point, minbbox):
     """
     For every cluster we are calculating minimum bbox for Localities in the
@@ -59,7 +179,175 @@ def update_minbbox(point, minbbox):
     return new_minbbox
 
 
-def cluster(query_set, zoom, pix_x, pix_y, localities_is_needed=False):
+def completeness_bucket(completeness):
+    """
+    Get index of the completeness bucket of a Locality in
+    COMPLETENESS_BUCKETS, or None if completeness is not known
+    """
+
+    if completeness is None:
+        return None
+    if completeness == 100:
+        return 0
+    if 30 < completeness < 100:
+        return 1
+    if completeness <= 30:
+        return 2
+    return None
+
+
+def load_facets(query_set):
+    """
+    Load facets of a set of Localities, keyed by Locality id
+
+    Facets of a Locality are packed in a single integer, a bit for every
+    matched facility type of FACILITY_TYPES followed by a bit for its
+    completeness bucket of COMPLETENESS_BUCKETS
+    """
+
+    facets = {}
+    localities = query_set.values_list('id', 'completeness')
+    for locality_id, completeness in localities.iterator():
+        bucket = completeness_bucket(completeness)
+        facets[locality_id] = 0 if bucket is None else 1 << (len(FACILITY_TYPES) + bucket)
+
+    values = Value.objects.filter(locality__in=query_set).filter(
+        specification__attribute__key='type').values_list('locality_id', 'data')
+    for locality_id, data in values.iterator():
+        if locality_id not in facets:
+            continue
+        data = (data or '').lower()
+        for index, (name, keyword) in enumerate(FACILITY_TYPES):
+            if keyword in data:
+                facets[locality_id] |= 1 << index
+
+    return facets
+
+
+class Cluster(object):
+    """
+    Compact point cluster used while clustering
+
+    Minimum bbox is updated in place and only ids of Localities in a cluster
+    are kept, and only if they are needed. Facet counts are kept only if
+    facets of Localities are added. Clusters are converted to the public
+    dictionary format by *as_dict* once clustering is done
+    """
+
+    __slots__ = (
+        'uuid', 'name', 'count', 'geomx', 'geomy', 'bbox',
+        'minx', 'miny', 'maxx', 'maxy', 'locality_ids', 'facets'
+    )
+
+    def __init__(self, uuid, name, geomx, geomy, bbox=None, count=1, minbbox=None):
+        self.uuid = uuid
+        self.name = name
+        self.count = count
+        self.geomx = geomx
+        self.geomy = geomy
+        self.bbox = bbox
+        if minbbox is None:
+            minbbox = (geomx, geomy, geomx, geomy)
+        self.minx, self.miny, self.maxx, self.maxy = minbbox
+        self.locality_ids = None
+        self.facets = None
+
+    def add_point(self, geomx, geomy):
+        """
+        Add a point (geomx, geomy) to the cluster
+        """
+
+        self.count += 1
+        if geomx < self.minx:
+            self.minx = geomx
+        if geomx > self.maxx:
+            self.maxx = geomx
+        if geomy < self.miny:
+            self.miny = geomy
+        if geomy > self.maxy:
+            self.maxy = geomy
+
+    def add_cluster(self, other):
+        """
+        Add count and minimum bbox of an *other* cluster to the cluster
+        """
+
+        self.count += other.count
+        if other.minx < self.minx:
+            self.minx = other.minx
+        if other.maxx > self.maxx:
+            self.maxx = other.maxx
+        if other.miny < self.miny:
+            self.miny = other.miny
+        if other.maxy > self.maxy:
+            self.maxy = other.maxy
+        if other.facets is not None:
+            if self.facets is None:
+                self.facets = [0] * len(other.facets)
+            for index, count in enumerate(other.facets):
+                self.facets[index] += count
+
+    def add_locality(self, locality_id):
+        """
+        Add a Locality id to the ids of Localities in the cluster
+        """
+
+        if self.locality_ids is None:
+            self.locality_ids = array('l')
+        self.locality_ids.append(locality_id)
+
+    def add_facets(self, facets):
+        """
+        Count packed *facets* of a Locality, as loaded by *load_facets*
+        """
+
+        size = len(FACILITY_TYPES) + len(COMPLETENESS_BUCKETS)
+        if self.facets is None:
+            self.facets = [0] * size
+        for index in xrange(size):
+            if facets & (1 << index):
+                self.facets[index] += 1
+
+    def as_dict(self):
+        """
+        Get the public dictionary format of the cluster, 'localities' is a
+        list of ids of Localities in the cluster, if they were kept
+
+        If facets were counted, 'numbers' are counts of Localities by
+        facility type and 'completeness' are counts of Localities by
+        completeness bucket, same as in the Locality statistics
+        """
+
+        geom = (self.geomx, self.geomy)
+        if self.count > 1:
+            minbbox = [self.minx, self.miny, self.maxx, self.maxy]
+        else:
+            minbbox = geom + geom
+
+        cluster_point = {
+            'uuid': self.uuid,
+            'name': self.name,
+            'count': self.count,
+            'geom': geom,
+            'bbox': self.bbox,
+            'minbbox': minbbox,
+            'localities': list(self.locality_ids or ())
+        }
+        if self.facets is not None:
+            types = len(FACILITY_TYPES)
+            cluster_point['numbers'] = dict(
+                (name, self.facets[index])
+                for index, (name, keyword) in enumerate(FACILITY_TYPES)
+            )
+            cluster_point['completeness'] = dict(
+                (name, self.facets[types + index])
+                for index, name in enumerate(COMPLETENESS_BUCKETS)
+            )
+        return cluster_point
+
+
+def cluster(query_set, zoom, pix_x, pix_y, localities_is_needed=False,
+            engine=None, facets=False):
     """
     Walk though a set of Localities and create point clusters
 
@@ -68,55 +356,347 @@ def cluster(query_set, zoom, pix_x, pix_y, localities_is_needed=False):
 
     If a point is within a cluster 'catchment' area increase point count for
     that cluster and recalculate clusters minimum bbox
+
+    Clustering *engine* is either 'python' or 'numpy', by default it's set by
+    CLUSTER_ENGINE setting. Both engines produce the same clusters, 'numpy'
+    engine falls back to 'python' if numpy is not available or when
+    Localities of a cluster are needed
+
+    If *localities_is_needed*, 'localities' of every cluster is a list of ids
+    of Localities in the cluster
+
+    If *facets*, every cluster has counts of its Localities by facility type
+    ('numbers') and by completeness bucket ('completeness'), see
+    *Cluster.as_dict*
     """
 
-    cluster_points = []
+    if engine is None:
+        engine = getattr(settings, 'CLUSTER_ENGINE', 'python')
+
+    if (engine == 'numpy' and numpy is not None and not localities_is_needed and
+            not facets):
+        return _cluster_numpy(query_set, zoom, pix_x, pix_y)
+
+    return _cluster_python(
+        query_set, zoom, pix_x, pix_y, localities_is_needed, facets
+    )
+
+
+def _cluster_python(query_set, zoom, pix_x, pix_y, localities_is_needed,
+                    facets=False):
+    """
+    Pure Python clustering engine
+
+    Clusters are indexed in a uniform grid, so every point is checked only
+    against clusters in the neighbouring grid cells. A point is added to the
+    first created cluster that contains it, same as checking every cluster
+    """
 
-    localites = query_set.get_lnglat().values('id', 'uuid', 'lnglat', 'changeset__created')
+    clusters = []
+    cell_size = grid_cell_size(zoom, pix_x, pix_y)
+    cluster_grid = {}
+    locality_facets = load_facets(query_set) if facets else None
+
+    localites = query_set.get_lnglat().values_list('id', 'uuid', 'lnglat')
     number = localites.count()
     index = 1
-    for locality in localites.iterator():
+    for locality_id, uuid, lnglat in localites.iterator():
         if localities_is_needed:
             print "%s/%s" % (index, number)
         index += 1
-        geomx, geomy = map(float, locality['lnglat'].split(','))
-
-        # check every point in cluster_points
-        for pt in cluster_points:
-            if within_bbox(pt['bbox'], geomx, geomy):
-                # it's in the cluster 'catchment' area
-                pt['count'] += 1
-                pt['minbbox'] = update_minbbox((geomx, geomy), pt['minbbox'])
-                if localities_is_needed:
-                    pt['localities'].append(locality)
-                break
+        geomx, geomy = map(float, lnglat.split(','))
+
+        matched = find_cluster(
+            cluster_grid, clusters, cell_size, geomx, geomy
+        )
+        if matched is not None:
+            # it's in the cluster 'catchment' area
+            cluster_point = clusters[matched]
+            cluster_point.add_point(geomx, geomy)
 
         else:
             # point is not in the catchment area of any cluster
-            x_range, y_range = overlapping_area(zoom, pix_x, pix_y, geomy)
-            locality_name = ""
-            try:
-                locality_name = Value.objects.filter(locality__uuid=locality['uuid']).filter(
-                    specification__attribute__key='name')[0].data
-            except Exception as e:
-                print e
-
-            bbox = (
-                geomx - x_range * 1.5, geomy - y_range * 1.5,
-                geomx + x_range * 1.5, geomy + y_range * 1.5
+            cluster_point = Cluster(
+                uuid, '', geomx, geomy,
+                catchment_bbox(zoom, pix_x, pix_y, geomx, geomy)
             )
-            new_cluster = {
-                'uuid': locality['uuid'],
-                'name': locality_name,
-                'count': 1,
-                'geom': (geomx, geomy),
-                'bbox': bbox,
-                'minbbox': (geomx, geomy, geomx, geomy),
-                'localities': []
-            }
-            if localities_is_needed:
-                new_cluster['localities'].append(locality)
+            cluster_grid.setdefault(
+                grid_cell(cell_size, geomx, geomy), []
+            ).append(len(clusters))
+            clusters.append(cluster_point)
+
+        if localities_is_needed:
+            cluster_point.add_locality(locality_id)
+        if locality_facets is not None:
+            cluster_point.add_facets(locality_facets.get(locality_id, 0))
+
+    cluster_points = [cluster_point.as_dict() for cluster_point in clusters]
+    set_cluster_names(cluster_points)
+
+    return cluster_points
+
+
+def _cluster_numpy(query_set, zoom, pix_x, pix_y):
+    """
+    Vectorized clustering engine
+
+    All of the coordinates are parsed at once into float64 arrays and points
+    are grouped by the same grid cells as in the pure Python engine. Clusters
+    are created in the same order as in the pure Python engine, and every new
+    cluster claims all of the unclaimed points of the neighbouring grid cells
+    within its 'catchment' area in a single vectorized operation. Claimed
+    points are not checked against any of the later clusters, which is
+    exactly the first match rule of the pure Python engine
+    """
 
+    localities = list(query_set.get_lnglat().values_list('uuid', 'lnglat'))
+    if not localities:
+        return []
+
+    uuids = [locality[0] for locality in localities]
+    coords = numpy.fromstring(
+        ','.join([locality[1] for locality in localities]),
+        dtype=numpy.float64, sep=','
+    ).reshape(-1, 2)
+    del localities
+
+    geomx = numpy.ascontiguousarray(coords[:, 0])
+    geomy = numpy.ascontiguousarray(coords[:, 1])
+    number = len(uuids)
+
+    # group point indexes by grid cells
+    cell_size = grid_cell_size(zoom, pix_x, pix_y)
+    cols = numpy.floor(geomx / cell_size[0]).astype(numpy.int64)
+    rows = numpy.floor(geomy / cell_size[1]).astype(numpy.int64)
+    order = numpy.lexsort((rows, cols))
+    cell_keys = numpy.column_stack((cols[order], rows[order]))
+    cell_starts = numpy.flatnonzero(
+        numpy.concatenate(([True], (cell_keys[1:] != cell_keys[:-1]).any(1)))
+    )
+    cell_ends = numpy.append(cell_starts[1:], number)
+    cells = {}
+    for start, end in zip(cell_starts.tolist(), cell_ends.tolist()):
+        cells[tuple(cell_keys[start].tolist())] = order[start:end]
+
+    assignment = numpy.full(number, -1, dtype=numpy.intp)
+    seeds = []
+    seed = 0
+    while seed < number:
+        if assignment[seed] != -1:
+            seed += 1
+            continue
+
+        # seed is not within any of the existing clusters
+        seedx, seedy = float(geomx[seed]), float(geomy[seed])
+        bbox = catchment_bbox(zoom, pix_x, pix_y, seedx, seedy)
+        assignment[seed] = len(seeds)
+
+        col, row = grid_cell(cell_size, seedx, seedy)
+        candidates = [
+            cells[(cell_col, cell_row)]
+            for cell_col in (col - 1, col, col + 1)
+            for cell_row in (row - 1, row, row + 1)
+            if (cell_col, cell_row) in cells
+        ]
+        candidates = numpy.concatenate(candidates)
+        candidates = candidates[assignment[candidates] == -1]
+        candidates_x = geomx[candidates]
+        candidates_y = geomy[candidates]
+        within = (
+            (bbox[0] < candidates_x) & (candidates_x < bbox[2]) &
+            (bbox[1] < candidates_y) & (candidates_y < bbox[3])
+        )
+        assignment[candidates[within]] = len(seeds)
+
+        seeds.append((seed, bbox))
+        seed += 1
+
+    counts = numpy.bincount(assignment, minlength=len(seeds))
+    min_x = numpy.full(len(seeds), numpy.inf)
+    min_y = numpy.full(len(seeds), numpy.inf)
+    max_x = numpy.full(len(seeds), -numpy.inf)
+    max_y = numpy.full(len(seeds), -numpy.inf)
+    numpy.minimum.at(min_x, assignment, geomx)
+    numpy.minimum.at(min_y, assignment, geomy)
+    numpy.maximum.at(max_x, assignment, geomx)
+    numpy.maximum.at(max_y, assignment, geomy)
+
+    cluster_points = []
+    for index, (seed, bbox) in enumerate(seeds):
+        geom = (float(geomx[seed]), float(geomy[seed]))
+        if counts[index] > 1:
+            minbbox = [
+                float(min_x[index]), float(min_y[index]),
+                float(max_x[index]), float(max_y[index])
+            ]
+        else:
+            minbbox = geom + geom
+
+        cluster_points.append({
+            'uuid': uuids[seed],
+            'name': '',
+            'count': int(counts[index]),
+            'geom': geom,
+            'bbox': bbox,
+            'minbbox': minbbox,
+            'localities': []
+        })
+
+    set_cluster_names(cluster_points)
+
+    return cluster_points
+
+
+def load_points(query_set):
+    """
+    Load points (id, uuid, geomx, geomy) for a set of Localities
+
+    Loaded points can be clustered for any number of zooms
+    without querying the database again
+    """
+
+    points = []
+    localities = query_set.get_lnglat().values_list('id', 'uuid', 'lnglat')
+    for locality_id, uuid, lnglat in localities.iterator():
+        geomx, geomy = map(float, lnglat.split(','))
+        points.append((locality_id, uuid, geomx, geomy))
+
+    return points
+
+
+def merge_clusters(clusters, zoom, pix_x, pix_y):
+    """
+    Cluster existing clusters (*Cluster* instances) for a lower zoom
+
+    Clusters are walked in order, every cluster which is not within any new
+    cluster creates a new cluster at its 'geom', otherwise its count and
+    minimum bbox are added to the first new cluster that contains it
+    """
+
+    cluster_points = []
+    cell_size = grid_cell_size(zoom, pix_x, pix_y)
+    cluster_grid = {}
+
+    for cluster_point in clusters:
+        geomx, geomy = cluster_point.geomx, cluster_point.geomy
+
+        matched = find_cluster(
+            cluster_grid, cluster_points, cell_size, geomx, geomy
+        )
+        if matched is not None:
+            cluster_points[matched].add_cluster(cluster_point)
+
+        else:
+            cluster_grid.setdefault(
+                grid_cell(cell_size, geomx, geomy), []
+            ).append(len(cluster_points))
+            new_cluster = Cluster(
+                cluster_point.uuid, cluster_point.name, geomx, geomy,
+                catchment_bbox(zoom, pix_x, pix_y, geomx, geomy),
+                cluster_point.count,
+                (cluster_point.minx, cluster_point.miny,
+                 cluster_point.maxx, cluster_point.maxy)
+            )
+            if cluster_point.facets is not None:
+                new_cluster.facets = list(cluster_point.facets)
             cluster_points.append(new_cluster)
 
     return cluster_points
+
+
+def cluster_pyramid(points, min_zoom, max_zoom, pix_x, pix_y, facets=None):
+    """
+    Create point clusters for every zoom from *min_zoom* to *max_zoom* in a
+    single pass over loaded *points*
+
+    Points are clustered only for *max_zoom*, clusters for every lower zoom
+    are created by merging clusters of the zoom above it. Clusters of
+    *max_zoom* are the same as the ones created by *cluster*, clusters for
+    lower zooms are an approximation, as the catchment area of a cluster is
+    calculated for its 'geom' and not for every point in it
+
+    Points can have a name (id, uuid, geomx, geomy, name), as the ones of a
+    Locality snapshot, otherwise cluster names are queried from the database
+
+    If *facets* of Localities, as loaded by *load_facets*, are given, every
+    cluster has its facet counts, same as the ones created by *cluster*
+
+    Returns a dictionary of cluster lists, keyed by zoom
+    """
+
+    clusters = [
+        Cluster(point[1], point[4] if len(point) > 4 else '', point[2], point[3])
+        for point in points
+    ]
+    if facets is not None:
+        for point, cluster_point in zip(points, clusters):
+            cluster_point.add_facets(facets.get(point[0], 0))
+    has_names = bool(points) and len(points[0]) > 4
+
+    pyramid = {}
+    for zoom in range(max_zoom, min_zoom - 1, -1):
+        clusters = merge_clusters(clusters, zoom, pix_x, pix_y)
+        if zoom == max_zoom and not has_names:
+            # every lower zoom clusters take names from these ones
+            locality_names = get_locality_names(
+                [cluster_point.uuid for cluster_point in clusters])
+            for cluster_point in clusters:
+                cluster_point.name = locality_names.get(cluster_point.uuid, '')
+        pyramid[zoom] = [cluster_point.as_dict() for cluster_point in clusters]
+
+    return pyramid
+
+
+def cluster_in_database(query_set, zoom, pix_x, pix_y):
+    """
+    Create point clusters in the database
+
+    Localities are grouped by snapping them to a grid which cells are as
+    large as a cluster 'catchment' area at the equator, so only aggregated
+    clusters are sent from the database. A Locality with the lowest id in a
+    grid cell is the representative point of the cluster
+
+    Clusters have the same structure as the ones created by *cluster*
+    """
+
+    cell_size = grid_cell_size(zoom, pix_x, pix_y)
+    localities_sql, params = query_set.values('id').query.sql_with_params()
+
+    sql = """
+        SELECT
+            (array_agg(l.uuid ORDER BY l.id))[1],
+            count(*),
+            (array_agg(ST_X(l.geom) ORDER BY l.id))[1],
+            (array_agg(ST_Y(l.geom) ORDER BY l.id))[1],
+            ST_XMin(ST_Extent(l.geom)), ST_YMin(ST_Extent(l.geom)),
+            ST_XMax(ST_Extent(l.geom)), ST_YMax(ST_Extent(l.geom))
+        FROM {table} l
+        WHERE l.id IN ({localities})
+        GROUP BY ST_SnapToGrid(l.geom, %s, %s)
+        ORDER BY min(l.id)
+    """.format(table=Locality._meta.db_table, localities=localities_sql)
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            sql, list(params) + [cell_size[0] * 2, cell_size[1] * 2]
+        )
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    cluster_points = []
+    for uuid, count, geomx, geomy, minx, miny, maxx, maxy in rows:
+        cluster_points.append({
+            'uuid': uuid,
+            'name': '',
+            'count': count,
+            'geom': (geomx, geomy),
+            'bbox': catchment_bbox(zoom, pix_x, pix_y, geomx, geomy),
+            'minbbox': [minx, miny, maxx, maxy],
+            'localities': []
+        })
+
+    set_cluster_names(cluster_points)
+
+    return cluster_points
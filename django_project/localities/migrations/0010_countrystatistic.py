@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('localities', '0009_locality_completeness'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CountryStatistic',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('localities', models.IntegerField(default=0)),
+                ('hospital', models.IntegerField(default=0)),
+                ('medical_clinic', models.IntegerField(default=0)),
+                ('orthopaedic_clinic', models.IntegerField(default=0)),
+                ('complete', models.IntegerField(default=0)),
+                ('partial', models.IntegerField(default=0)),
+                ('basic', models.IntegerField(default=0)),
+                ('last_update', models.TextField(default='[]')),
+                ('country', models.OneToOneField(null=True, blank=True, to='localities.Country')),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('localities', '0010_countrystatistic'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='locality',
+            name='country',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.SET_NULL, default=None, blank=True, to='localities.Country', null=True),
+        ),
+        # assign existing Localities in a single spatial join
+        migrations.RunSQL(
+            """
+            UPDATE localities_locality l SET country_id = (
+                SELECT c.id FROM localities_country c
+                WHERE ST_Covers(c.polygon_geometry, l.geom)
+                ORDER BY c.id
+                LIMIT 1
+            )
+            """,
+            migrations.RunSQL.noop
+        ),
+    ]
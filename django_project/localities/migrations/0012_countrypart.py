@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.contrib.gis.db.models.fields
+
+from localities.subdivide import subdivide
+
+
+def create_country_parts(apps, schema_editor):
+    Country = apps.get_model('localities', 'Country')
+    CountryPart = apps.get_model('localities', 'CountryPart')
+
+    max_vertices = getattr(settings, 'COUNTRY_PART_MAX_VERTICES', 256)
+    for country in Country.objects.all().iterator():
+        CountryPart.objects.bulk_create([
+            CountryPart(country=country, polygon=polygon)
+            for polygon in subdivide(country.polygon_geometry, max_vertices)
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('localities', '0011_locality_country'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CountryPart',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('polygon', django.contrib.gis.db.models.fields.PolygonField(srid=4326)),
+                ('country', models.ForeignKey(related_name='parts', to='localities.Country')),
+            ],
+        ),
+        migrations.RunPython(create_country_parts, migrations.RunPython.noop),
+    ]
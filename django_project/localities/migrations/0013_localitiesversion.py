@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def create_version(apps, schema_editor):
+    Changeset = apps.get_model('localities', 'Changeset')
+    LocalitiesVersion = apps.get_model('localities', 'LocalitiesVersion')
+
+    # existing snapshots are written for the latest changeset, they are stale
+    latest = Changeset.objects.aggregate(latest=Max('id'))['latest'] or 0
+    LocalitiesVersion.objects.create(pk=1, version=latest + 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('localities', '0012_countrypart'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocalitiesVersion',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('version', models.BigIntegerField(default=0)),
+                ('changed_since', models.DateTimeField(null=True, blank=True)),
+            ],
+        ),
+        migrations.RunPython(create_version, migrations.RunPython.noop),
+    ]
@@ -4,14 +4,18 @@ import logging
 LOG = logging.getLogger(__name__)
 
 import itertools
+import json
 
+from .country_locator import get_country_locator, invalidate_country_locator
 from .querysets import PassThroughGeoManager, LocalitiesQuerySet
+from .subdivide import subdivide
 from datetime import datetime
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.gis.db import models
 from django.contrib.sites.models import Site
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db.models.signals import post_save, pre_delete
 from django.utils import timezone
 from django.utils.text import slugify
@@ -150,6 +154,9 @@ class Locality(UpdateMixin, ChangesetMixin):
     geom = models.PointField(srid=4326)
     specifications = models.ManyToManyField('Specification', through='Value')
     master = models.ForeignKey('Locality', null=True, default=None)
+    # Country the Locality is in, set when it's created or moved
+    country = models.ForeignKey(
+        'Country', null=True, blank=True, default=None, on_delete=models.SET_NULL)
 
     # completeness is a big calculation
     # so it has to be an field
@@ -163,6 +170,19 @@ class Locality(UpdateMixin, ChangesetMixin):
         if self.tracker.previous('uuid') and self.tracker.has_changed('uuid'):
             self.uuid = self.tracker.previous('uuid')
 
+        if kwargs.get('create') or self.tracker.has_changed('geom'):
+            self.locate_country()
+
+    def locate_country(self):
+        """
+        Set the Country the Locality is in
+        """
+
+        if self.geom is None:
+            self.country_id = None
+        else:
+            self.country_id = get_country_locator().locate(self.geom.x, self.geom.y)
+
     def _get_attr_map(self):
         return (
             self.domain.specification_set
@@ -533,6 +553,20 @@ class LocalityIndex(models.Model):
     ))
 
 
+class LocalitiesVersion(models.Model):
+    """
+    Version of Localities and their Values, a single row which is bumped by
+    every saved or deleted Locality or Value
+
+    Snapshot and cached search results are fresh while the version is the
+    same, *changed_since* is the time of the first change after the latest
+    snapshot
+    """
+
+    version = models.BigIntegerField(default=0)
+    changed_since = models.DateTimeField(null=True, blank=True)
+
+
 # register signals
 import signals  # noqa
 from .tasks import load_data_task
@@ -692,10 +726,106 @@ class Country(Boundary):
         """Meta Class"""
         verbose_name_plural = 'Countries'
 
+    def save(self, *args, **kwargs):
+        super(Country, self).save(*args, **kwargs)
+        self.update_parts()
+
+    def delete(self, *args, **kwargs):
+        super(Country, self).delete(*args, **kwargs)
+        invalidate_country_locator()
+
+    def update_parts(self):
+        """
+        Replace CountryParts of the Country by its subdivided polygon geometry
+        """
+        max_vertices = getattr(settings, 'COUNTRY_PART_MAX_VERTICES', 256)
+        self.parts.all().delete()
+        CountryPart.objects.bulk_create([
+            CountryPart(country=self, polygon=polygon)
+            for polygon in subdivide(self.polygon_geometry, max_vertices)
+        ])
+        invalidate_country_locator()
+
 
 Country._meta.get_field('name').verbose_name = 'Country name'
 Country._meta.get_field('name').help_text = 'The name of the country.'
 
+
+class CountryPart(models.Model):
+    """
+    Piece of a subdivided polygon geometry of a Country
+
+    Country geometries have many vertices and large bboxes, points are
+    located in small pieces instead, which are filtered effectively by the
+    spatial index
+    """
+
+    country = models.ForeignKey('Country', related_name='parts')
+    polygon = models.PolygonField(srid=4326)
+
+    objects = models.GeoManager()
+
+
+class CountryStatistic(models.Model):
+    """
+    Statistics of master Localities of a Country, or of the world if
+    *country* is None, counts of Localities by facility type and by
+    completeness and the latest updates
+
+    Counts are updated by deltas when a Locality or its type is changed, and
+    recounted from scratch by the generate_countries_cache command. Latest
+    updates are refreshed by the regenerate_cache task
+    """
+
+    country = models.OneToOneField('Country', null=True, blank=True)
+
+    localities = models.IntegerField(default=0)
+    hospital = models.IntegerField(default=0)
+    medical_clinic = models.IntegerField(default=0)
+    orthopaedic_clinic = models.IntegerField(default=0)
+    complete = models.IntegerField(default=0)
+    partial = models.IntegerField(default=0)
+    basic = models.IntegerField(default=0)
+
+    # JSON list of the latest updates
+    last_update = models.TextField(default='[]')
+
+    def __unicode__(self):
+        return u'{}'.format(self.country or 'World')
+
+    def set_statistic(self, statistic):
+        """
+        Set counts and the latest updates from statistics of Localities, as
+        returned by *utils.get_statistic*
+        """
+
+        self.localities = statistic['localities']
+        for key, value in statistic['numbers'].items():
+            setattr(self, key, value)
+        for key, value in statistic['completeness'].items():
+            setattr(self, key, value)
+        self.last_update = json.dumps(statistic['last_update'], cls=DjangoJSONEncoder)
+
+    def get_statistic(self):
+        """
+        Get statistics in the same format as *utils.get_statistic*
+        """
+
+        return {
+            'numbers': {
+                'hospital': self.hospital,
+                'medical_clinic': self.medical_clinic,
+                'orthopaedic_clinic': self.orthopaedic_clinic
+            },
+            'completeness': {
+                'complete': self.complete,
+                'partial': self.partial,
+                'basic': self.basic
+            },
+            'localities': self.localities,
+            'last_update': json.loads(self.last_update)
+        }
+
 from django.core.exceptions import ValidationError
 
 
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import logging
+
+LOG = logging.getLogger(__name__)
+
+import math
+import struct
+
+# Mapbox Vector Tile specification version
+MVT_VERSION = 2
+MVT_EXTENT = 4096
+
+# protobuf wire types
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+
+# geometry type and command of a point feature
+POINT = 1
+MOVE_TO = 1
+
+
+def encode_varint(value):
+    """
+    Encode an unsigned integer as a protobuf varint
+    """
+
+    encoded = bytearray()
+    while True:
+        bits = value & 0x7f
+        value >>= 7
+        if value:
+            encoded.append(bits | 0x80)
+        else:
+            encoded.append(bits)
+            return str(encoded)
+
+
+def zigzag(value):
+    """
+    Map a signed integer to an unsigned one, so small negative numbers are
+    encoded as short varints
+    """
+
+    return (value << 1) ^ (value >> 63)
+
+
+def encode_key(field, wire_type):
+    return encode_varint((field << 3) | wire_type)
+
+
+def encode_uint(field, value):
+    return encode_key(field, VARINT) + encode_varint(value)
+
+
+def encode_bytes(field, value):
+    return encode_key(field, LENGTH_DELIMITED) + encode_varint(len(value)) + value
+
+
+def encode_packed(field, values):
+    return encode_bytes(field, ''.join(encode_varint(value) for value in values))
+
+
+def encode_value(value):
+    """
+    Encode a feature property value as a vector tile Value message
+    """
+
+    if isinstance(value, bool):
+        return encode_uint(7, int(value))
+    elif isinstance(value, (int, long)):
+        if value >= 0:
+            return encode_uint(5, value)
+        return encode_uint(6, zigzag(value))
+    elif isinstance(value, float):
+        return encode_key(3, FIXED64) + struct.pack('<d', value)
+    else:
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        return encode_bytes(1, str(value))
+
+
+def tile_pixel(zoom, x, y, lng, lat, extent=MVT_EXTENT):
+    """
+    Project a point (lng, lat) to integer coordinates within a slippy map
+    tile, which spans from 0 to *extent* with y axis pointing down
+    """
+
+    tiles = 2.0 ** zoom
+    lat = math.radians(max(min(lat, 85.0511287798066), -85.0511287798066))
+
+    tile_x = (lng + 180.0) / 360.0 * tiles
+    tile_y = (1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2 * tiles
+
+    return (
+        int(round((tile_x - x) * extent)), int(round((tile_y - y) * extent))
+    )
+
+
+def cluster_properties(cluster_point):
+    """
+    Get vector tile feature properties of a cluster, minimum bbox is split
+    into separate properties as vector tiles have no list values
+    """
+
+    minbbox = cluster_point['minbbox']
+    return [
+        ('uuid', cluster_point['uuid']),
+        ('name', cluster_point.get('name') or u''),
+        ('count', cluster_point['count']),
+        ('min_lng', float(minbbox[0])),
+        ('min_lat', float(minbbox[1])),
+        ('max_lng', float(minbbox[2])),
+        ('max_lat', float(minbbox[3])),
+    ]
+
+
+def encode_tile(zoom, x, y, clusters, layer_name='localities', extent=MVT_EXTENT):
+    """
+    Encode clusters of a slippy map tile as a Mapbox Vector Tile with a
+    single layer of point features
+
+    Every cluster is a point at its 'geom', with its uuid, name, count and
+    minimum bbox as properties
+    """
+
+    keys, key_indexes = [], {}
+    values, value_indexes = [], {}
+    features = []
+
+    for cluster_point in clusters:
+        tags = []
+        for key, value in cluster_properties(cluster_point):
+            if key not in key_indexes:
+                key_indexes[key] = len(keys)
+                keys.append(key)
+            value_key = (type(value), value)
+            if value_key not in value_indexes:
+                value_indexes[value_key] = len(values)
+                values.append(value)
+            tags.extend((key_indexes[key], value_indexes[value_key]))
+
+        lng, lat = cluster_point['geom']
+        pixel_x, pixel_y = tile_pixel(zoom, x, y, lng, lat, extent)
+        geometry = [(MOVE_TO & 0x7) | (1 << 3), zigzag(pixel_x), zigzag(pixel_y)]
+
+        features.append(
+            encode_packed(2, tags) + encode_uint(3, POINT) + encode_packed(4, geometry)
+        )
+
+    layer = ''.join([
+        encode_uint(15, MVT_VERSION),
+        encode_bytes(1, layer_name),
+        ''.join(encode_bytes(2, feature) for feature in features),
+        ''.join(encode_bytes(3, key) for key in keys),
+        ''.join(encode_bytes(4, encode_value(value)) for value in values),
+        encode_uint(5, extent),
+    ])
+
+    return encode_bytes(3, layer)
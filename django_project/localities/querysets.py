@@ -3,6 +3,7 @@ import logging
 LOG = logging.getLogger(__name__)
 
 from django.contrib.gis.db import models
+from django.db import connection
 from django.contrib.gis.db.models.query import GeoQuerySet
 
 from model_utils.managers import PassThroughManagerMixin
@@ -41,3 +42,42 @@ class LocalitiesQuerySet(GeoQuerySet):
 
         LOG.debug('Filtering Localities using polygon: %s', polygon)
         return self.filter(geom__within=polygon)
+
+    def in_country(self, country):
+        """
+        Filter Localities in a Country
+        """
+
+        LOG.debug('Filtering Localities using country: %s', country)
+        return self.filter(country=country)
+
+    def update_countries(self):
+        """
+        Set Countries of Localities in a single spatial UPDATE, instead of
+        saving every Locality, points are located in CountryParts
+        """
+
+        # avoid circular import, querysets are imported by the models
+        from .models import CountryPart
+
+        localities_sql, params = self.values('id').query.sql_with_params()
+
+        sql = """
+            UPDATE {locality} l SET country_id = (
+                SELECT p.country_id FROM {part} p
+                WHERE ST_Covers(p.polygon, l.geom)
+                ORDER BY p.country_id
+                LIMIT 1
+            )
+            WHERE l.id IN ({localities})
+        """.format(
+            locality=self.model._meta.db_table, part=CountryPart._meta.db_table,
+            localities=localities_sql
+        )
+
+        cursor = connection.cursor()
+        try:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+        finally:
+            cursor.close()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import logging
+
+LOG = logging.getLogger(__name__)
+
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .tiles import point_tile, tile_bbox
+
+
+def snap_bbox(zoom, bbox):
+    """
+    Snap a bbox (minx, miny, maxx, maxy) to the slippy map tiles that cover
+    it, so every bbox within the same tiles gets the same clusters
+
+    Returns the tile range (min_x, min_y, max_x, max_y) and the snapped bbox,
+    which is extended to the poles and the antimeridian at the edge tiles
+    """
+
+    min_x, min_y = point_tile(zoom, bbox[0], bbox[3])
+    max_x, max_y = point_tile(zoom, bbox[2], bbox[1])
+
+    minx, _, _, maxy = tile_bbox(zoom, min_x, min_y)
+    _, miny, maxx, _ = tile_bbox(zoom, max_x, max_y)
+
+    last_tile = 2 ** zoom - 1
+    if min_x == 0:
+        minx = -180.0
+    if max_x == last_tile:
+        maxx = 180.0
+    if min_y == 0:
+        maxy = 90.0
+    if max_y == last_tile:
+        miny = -90.0
+
+    return (min_x, min_y, max_x, max_y), (minx, miny, maxx, maxy)
+
+
+class SearchCache(object):
+    """
+    Least recently used cache of clustered search results
+
+    Results are cached for a version of Localities (see
+    snapshot.current_watermark), which every saved or deleted Locality or
+    Value bumps, and the cache is cleared when a result for another version
+    is cached
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.watermark = None
+        self.results = OrderedDict()
+
+    def get(self, key, watermark):
+        """
+        Get a cached result, or None if it's not cached
+        """
+
+        if watermark != self.watermark:
+            return None
+        try:
+            result = self.results.pop(key)
+        except KeyError:
+            return None
+        # move the result to the end, as the most recently used one
+        self.results[key] = result
+        return result
+
+    def set(self, key, watermark, result):
+        """
+        Cache a result, evicting the least recently used results above the
+        size of the cache
+        """
+
+        if self.size <= 0:
+            return
+        if watermark != self.watermark:
+            self.results.clear()
+            self.watermark = watermark
+
+        self.results.pop(key, None)
+        self.results[key] = result
+        while len(self.results) > self.size:
+            self.results.popitem(last=False)
+
+    def clear(self):
+        self.results.clear()
+        self.watermark = None
+
+
+search_cache = SearchCache(getattr(settings, 'CLUSTER_SEARCH_CACHE_SIZE', 256))
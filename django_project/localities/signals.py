@@ -4,7 +4,7 @@ import logging
 LOG = logging.getLogger(__name__)
 
 from django.dispatch import receiver, Signal
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
 from django.contrib.contenttypes.models import ContentType
 
 from .models import (
@@ -20,6 +20,7 @@ from .models import (
     Value,
     ValueArchive
 )
+from .statistics import counted_state, update_locality_statistics, update_type_statistics
 
 # define custom signals
 SIG_locality_values_updated = Signal()
@@ -91,6 +92,24 @@ def specification_archive_handler(sender, instance, created, raw, **kwargs):
     archive.save()
 
 
+@receiver(post_save, sender=Locality)
+@receiver(post_delete, sender=Locality)
+@receiver(post_save, sender=Value)
+@receiver(post_delete, sender=Value)
+def localities_version_handler(sender, instance, **kwargs):
+    """
+    *post_save* and *post_delete* triggered bump of the version of
+    Localities, which snapshot and cached search results are checked by
+    """
+
+    # avoid circular import
+    from .snapshot import bump_watermark
+
+    if kwargs.get('raw'):
+        return
+    bump_watermark()
+
+
 @receiver(post_save, sender=Locality)
 def locality_archive_handler(sender, instance, created, raw, **kwargs):
     """
@@ -119,6 +138,158 @@ def locality_archive_handler(sender, instance, created, raw, **kwargs):
     archive.save()
 
 
+@receiver(pre_delete, sender=Locality)
+def locality_pre_delete_handler(sender, instance, **kwargs):
+    """
+    *pre_delete* triggered lookup of the facets of a master Locality which
+    cached clusters count, before its 'type' Values are removed
+    """
+
+    # avoid circular import
+    from .cluster_cache import locality_facets
+
+    instance._cluster_facets = None
+    if instance.master_id is None:
+        instance._cluster_facets = locality_facets(instance.uuid)
+
+
+@receiver(post_delete, sender=Locality)
+def locality_delete_handler(sender, instance, **kwargs):
+    """
+    *post_delete* triggered removal of a master Locality from cached clusters
+    and cached tiles
+    """
+
+    # avoid circular import
+    from .tasks import update_cache_cluster
+    from .tiles import invalidate_tiles
+
+    if instance.master_id is None:
+        update_cache_cluster.delay(
+            instance.uuid, [instance.geom.x, instance.geom.y], None,
+            getattr(instance, '_cluster_facets', None)
+        )
+        invalidate_tiles(instance.geom.x, instance.geom.y)
+
+
+def tile_state(locality):
+    """
+    Get the point (lng, lat) of a master Locality, which cached tiles show,
+    or None if it's not a master Locality
+    """
+
+    if locality.master_id is not None or locality.geom is None:
+        return None
+    return (locality.geom.x, locality.geom.y)
+
+
+@receiver(post_save, sender=Locality)
+def locality_tiles_handler(sender, instance, created, raw, **kwargs):
+    """
+    *post_save* triggered removal of cached tiles of a master Locality which
+    is created, moved, re-mastered or becomes a master Locality, wherever it
+    is saved
+    """
+
+    # avoid circular import
+    from .tiles import invalidate_tiles
+
+    if raw:
+        return
+
+    old_state = getattr(instance, '_tile_state', None)
+    new_state = tile_state(instance)
+    if old_state != new_state:
+        for state in (old_state, new_state):
+            if state is not None:
+                invalidate_tiles(*state)
+    instance._tile_state = None
+
+
+@receiver(pre_save, sender=Locality)
+def locality_statistic_pre_save_handler(sender, instance, raw, **kwargs):
+    """
+    *pre_save* triggered lookup of the counted state and of the tile state of
+    a changed Locality, before it's changed
+    """
+
+    instance._counted_state = None
+    instance._tile_state = None
+    if raw or not instance.pk:
+        return
+
+    previous = Locality.objects.filter(pk=instance.pk).only(
+        'id', 'geom', 'master', 'country', 'completeness').first()
+    if previous is not None:
+        instance._counted_state = counted_state(previous)
+        instance._tile_state = tile_state(previous)
+
+
+@receiver(post_save, sender=Locality)
+def locality_statistic_handler(sender, instance, created, raw, **kwargs):
+    """
+    *post_save* triggered update of Country statistics by a Locality change
+    """
+
+    if raw:
+        return
+
+    update_locality_statistics(
+        instance.pk, getattr(instance, '_counted_state', None), counted_state(instance)
+    )
+    instance._counted_state = None
+
+
+@receiver(post_delete, sender=Locality)
+def locality_statistic_delete_handler(sender, instance, **kwargs):
+    """
+    *post_delete* triggered removal of a Locality from Country statistics,
+    its 'type' Values are removed before it
+    """
+
+    update_locality_statistics(instance.pk, counted_state(instance), None)
+
+
+@receiver(pre_save, sender=Value)
+def value_statistic_pre_save_handler(sender, instance, raw, **kwargs):
+    """
+    *pre_save* triggered lookup of the data of a changed Value, before it's
+    changed
+    """
+
+    instance._counted_data = None
+    if raw or not instance.pk:
+        return
+
+    instance._counted_data = Value.objects.filter(pk=instance.pk).values_list(
+        'data', flat=True).first()
+
+
+@receiver(post_save, sender=Value)
+def value_statistic_handler(sender, instance, created, raw, **kwargs):
+    """
+    *post_save* triggered update of Country statistics by a 'type' Value
+    change
+    """
+
+    if raw:
+        return
+
+    update_type_statistics(
+        instance, getattr(instance, '_counted_data', None), instance.data
+    )
+    instance._counted_data = None
+
+
+@receiver(post_delete, sender=Value)
+def value_statistic_delete_handler(sender, instance, **kwargs):
+    """
+    *post_delete* triggered removal of a 'type' Value from Country statistics
+    """
+
+    update_type_statistics(instance, instance.data, None)
+
+
 @receiver(post_save, sender=Value)
 def value_archive_handler(sender, instance, created, raw, **kwargs):
     """
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+import logging
+
+LOG = logging.getLogger(__name__)
+
+import mmap
+import os
+import struct
+import tempfile
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .map_clustering import cluster_pyramid, numpy
+from .models import LocalitiesVersion, Locality, Value
+
+# magic, version, number of records, number of strings, Localities version
+HEADER = struct.Struct('<4sHxxIIQ')
+# id, lon, lat, completeness, uuid string index, name string index
+RECORD = struct.Struct('<ifffII')
+OFFSET = struct.Struct('<I')
+
+if numpy is not None:
+    RECORD_DTYPE = numpy.dtype([
+        ('id', '<i4'), ('lon', '<f4'), ('lat', '<f4'), ('completeness', '<f4'),
+        ('uuid', '<u4'), ('name', '<u4')
+    ])
+
+MAGIC = 'HSLS'
+VERSION = 1
+
+
+def snapshot_filename():
+    """
+    Get filename of the master Locality snapshot
+    """
+
+    return os.path.join(settings.CLUSTER_CACHE_DIR, 'localities.snapshot')
+
+
+def current_watermark():
+    """
+    Get the version of Localities, every saved or deleted Locality or Value
+    bumps it
+    """
+
+    versions = LocalitiesVersion.objects.values_list('version', flat=True)[:1]
+    return versions[0] if versions else 0
+
+
+def bump_watermark():
+    """
+    Bump the version of Localities after a change, and note the time of the
+    first change after the latest snapshot
+    """
+
+    if not LocalitiesVersion.objects.filter(pk=1).update(version=F('version') + 1):
+        LocalitiesVersion.objects.create(pk=1, version=1, changed_since=timezone.now())
+        return
+    LocalitiesVersion.objects.filter(pk=1, changed_since=None).update(
+        changed_since=timezone.now())
+
+
+def changed_since():
+    """
+    Get the time of the first change after the latest snapshot, or None
+    """
+
+    return LocalitiesVersion.objects.filter(pk=1).values_list(
+        'changed_since', flat=True).first()
+
+
+def write_snapshot(filename=None):
+    """
+    Write a compact binary snapshot of all master Localities
+
+    The snapshot consists of a header, fixed size records (id, float32 lon and
+    lat, completeness and indexes of uuid and name in a string table) and a
+    string table of UTF-8 encoded strings (offsets followed by the data)
+
+    Snapshot is written to a temporary file and renamed, so readers never see
+    a partial snapshot. Changes made while it's written are pending since it
+    was written
+    """
+
+    filename = filename or snapshot_filename()
+    watermark = current_watermark()
+
+    names = {}
+    values = Value.objects.filter(
+        specification__attribute__key='name', locality__master=None
+    ).values_list('locality_id', 'data')
+    for locality_id, name in values.iterator():
+        names.setdefault(locality_id, name)
+
+    strings = []
+    string_indexes = {}
+
+    def string_index(value):
+        value = (value or u'').encode('utf-8')
+        if value not in string_indexes:
+            string_indexes[value] = len(strings)
+            strings.append(value)
+        return string_indexes[value]
+
+    records = []
+    localities = Locality.objects.filter(master=None).get_lnglat().values_list(
+        'id', 'uuid', 'lnglat', 'completeness')
+    for locality_id, uuid, lnglat, completeness in localities.iterator():
+        geomx, geomy = map(float, lnglat.split(','))
+        records.append(RECORD.pack(
+            locality_id, geomx, geomy, completeness or 0.0,
+            string_index(uuid), string_index(names.get(locality_id))
+        ))
+
+    directory = os.path.dirname(filename) or '.'
+    handle, temp_filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as snapshot_file:
+            snapshot_file.write(HEADER.pack(
+                MAGIC, VERSION, len(records), len(strings), watermark))
+            snapshot_file.write(''.join(records))
+
+            offset = 0
+            for value in strings:
+                snapshot_file.write(OFFSET.pack(offset))
+                offset += len(value)
+            snapshot_file.write(OFFSET.pack(offset))
+            snapshot_file.write(''.join(strings))
+        os.rename(temp_filename, filename)
+    except:
+        os.remove(temp_filename)
+        raise
+
+    if filename == snapshot_filename():
+        LocalitiesVersion.objects.filter(pk=1, version=watermark).update(changed_since=None)
+        LocalitiesVersion.objects.filter(pk=1, version__gt=watermark).update(
+            changed_since=timezone.now())
+
+    return len(records)
+
+
+class LocalitySnapshot(object):
+    """
+    Read only, memory mapped, master Locality snapshot
+
+    Memory of the snapshot is shared by all of the processes that open it
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.mtime = os.path.getmtime(filename)
+        with open(filename, 'rb') as snapshot_file:
+            self.data = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.count, self.string_count, self.watermark = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise IOError('Not a Locality snapshot: %s' % filename)
+
+        self.records_offset = HEADER.size
+        self.offsets_offset = self.records_offset + self.count * RECORD.size
+        self.strings_offset = self.offsets_offset + (self.string_count + 1) * OFFSET.size
+
+        # records and string offsets are viewed in place, without copying
+        self.records = self.offsets = None
+        if numpy is not None:
+            self.records = numpy.frombuffer(
+                self.data, dtype=RECORD_DTYPE, count=self.count, offset=self.records_offset)
+            self.offsets = numpy.frombuffer(
+                self.data, dtype='<u4', count=self.string_count + 1, offset=self.offsets_offset)
+
+    def __len__(self):
+        return self.count
+
+    def is_stale(self):
+        """
+        Check if there are changes made after the snapshot
+        """
+
+        return self.watermark < current_watermark()
+
+    def string(self, index):
+        """
+        Get a string from the string table
+        """
+
+        start, end = struct.unpack_from(
+            '<II', self.data, self.offsets_offset + index * OFFSET.size)
+        return self.data[self.strings_offset + start:self.strings_offset + end].decode('utf-8')
+
+    def record(self, index):
+        """
+        Get a record (id, lon, lat, completeness, uuid index, name index)
+        """
+
+        return RECORD.unpack_from(self.data, self.records_offset + index * RECORD.size)
+
+    def points(self, bbox=None):
+        """
+        Get points (id, uuid, geomx, geomy, name) of master Localities, within
+        an optional *bbox* (minx, miny, maxx, maxy)
+
+        Points have the same structure as the ones loaded by
+        *map_clustering.load_points*, with an additional name. Records are
+        filtered by a vectorized bbox mask if numpy is available, strings are
+        decoded only for the points within the bbox
+        """
+
+        if self.records is not None:
+            return self._points_numpy(bbox)
+
+        points = []
+        for index in xrange(self.count):
+            locality_id, geomx, geomy, completeness, uuid_index, name_index = self.record(index)
+            if bbox is not None and not (
+                    bbox[0] <= geomx <= bbox[2] and bbox[1] <= geomy <= bbox[3]):
+                continue
+            points.append((
+                locality_id, self.string(uuid_index), geomx, geomy, self.string(name_index)
+            ))
+        return points
+
+    def _points_numpy(self, bbox):
+        records = self.records
+        if bbox is not None:
+            # compare as float64, same as unpacked records
+            lon = records['lon'].astype(numpy.float64)
+            lat = records['lat'].astype(numpy.float64)
+            records = records[
+                (lon >= bbox[0]) & (lon <= bbox[2]) & (lat >= bbox[1]) & (lat <= bbox[3])
+            ]
+
+        strings_offset = self.strings_offset
+        offsets = self.offsets
+        data = self.data
+
+        def string(index):
+            start, end = int(offsets[index]), int(offsets[index + 1])
+            return data[strings_offset + start:strings_offset + end].decode('utf-8')
+
+        return [
+            (locality_id, string(uuid_index), geomx, geomy, string(name_index))
+            for locality_id, geomx, geomy, uuid_index, name_index in zip(
+                records['id'].tolist(), records['lon'].astype(numpy.float64).tolist(),
+                records['lat'].astype(numpy.float64).tolist(),
+                records['uuid'].tolist(), records['name'].tolist()
+            )
+        ]
+
+    def close(self):
+        # views of the memory map have to be released before it's closed
+        self.records = self.offsets = None
+        self.data.close()
+
+
+_snapshot = None
+
+
+def get_snapshot():
+    """
+    Get the master Locality snapshot of this process, or None if there is no
+    snapshot
+
+    Snapshot is reopened when its file is replaced
+    """
+
+    global _snapshot
+
+    filename = snapshot_filename()
+    try:
+        mtime = os.path.getmtime(filename)
+    except OSError:
+        return None
+
+    if _snapshot is None or _snapshot.filename != filename or _snapshot.mtime != mtime:
+        try:
+            snapshot = LocalitySnapshot(filename)
+        except (IOError, ValueError, struct.error) as e:
+            LOG.warning('Can not open Locality snapshot: %s', e)
+            return None
+        if _snapshot is not None:
+            _snapshot.close()
+        _snapshot = snapshot
+
+    return _snapshot
+
+
+def get_fresh_snapshot():
+    """
+    Get the master Locality snapshot if there are no changes made after it,
+    otherwise None
+    """
+
+    snapshot = get_snapshot()
+    if snapshot is None or snapshot.is_stale():
+        return None
+    return snapshot
+
+
+def cluster_snapshot(snapshot, zoom, pix_x, pix_y, bbox=None):
+    """
+    Create point clusters of master Localities in a snapshot, within an
+    optional *bbox* (minx, miny, maxx, maxy), without querying the database
+    """
+
+    return cluster_pyramid(snapshot.points(bbox), zoom, zoom, pix_x, pix_y)[zoom]
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import logging
+
+LOG = logging.getLogger(__name__)
+
+from django.db.models import F, Q
+
+from .map_clustering import COMPLETENESS_BUCKETS, FACILITY_TYPES, completeness_bucket
+
+
+def type_counts(data):
+    """
+    Get counts of facility types of FACILITY_TYPES matched by data of a
+    'type' Value
+    """
+
+    data = (data or '').lower()
+    return dict((name, 1) for name, keyword in FACILITY_TYPES if keyword in data)
+
+
+def locality_type_counts(locality_id):
+    """
+    Get counts of facility types of a Locality
+    """
+
+    from .models import Value
+
+    counts = {}
+    values = Value.objects.filter(
+        locality_id=locality_id, specification__attribute__key='type'
+    ).values_list('data', flat=True)
+    for data in values:
+        for name, count in type_counts(data).items():
+            counts[name] = counts.get(name, 0) + count
+    return counts
+
+
+def counted_state(locality):
+    """
+    Get the state of a Locality which its statistics depend on, a tuple of
+    the id of its Country and its completeness, or None if it's not a master
+    Locality
+    """
+
+    if locality.master_id is not None or locality.geom is None:
+        return None
+
+    return (locality.country_id, locality.completeness)
+
+
+def add_counts(deltas, country_id, counts, sign=1):
+    """
+    Add (*sign* 1) or subtract (*sign* -1) *counts* to the *deltas* of a
+    Country
+    """
+
+    delta = deltas.setdefault(country_id, {})
+    for field, count in counts.items():
+        delta[field] = delta.get(field, 0) + sign * count
+
+
+def apply_deltas(deltas):
+    """
+    Apply deltas of counts, keyed by Country id, to the statistics of the
+    Countries and of the world, deltas of None are applied to the world only
+
+    Statistics which don't exist yet are not created, they are counted from
+    scratch when they are needed
+    """
+
+    from .models import CountryStatistic
+
+    world = {}
+    for country_id, delta in deltas.items():
+        for field, count in delta.items():
+            world[field] = world.get(field, 0) + count
+
+    changes = [(Q(country__isnull=True), world)] + [
+        (Q(country_id=country_id), delta)
+        for country_id, delta in deltas.items() if country_id is not None
+    ]
+    for condition, delta in changes:
+        updates = dict(
+            (field, F(field) + count) for field, count in delta.items() if count
+        )
+        if updates:
+            CountryStatistic.objects.filter(condition).update(**updates)
+
+
+def update_locality_statistics(locality_id, old_state, new_state):
+    """
+    Update statistics by the change of a Locality from its *old_state* to its
+    *new_state*, as returned by *counted_state*
+
+    Facility types of a Locality are counted by its 'type' Values, they move
+    with a Locality when it's moved to another Country, it's not a master
+    Locality anymore or it becomes one
+    """
+
+    if old_state == new_state:
+        return
+
+    old_country = old_state[0] if old_state is not None else None
+    new_country = new_state[0] if new_state is not None else None
+    moved = (old_state is None or new_state is None or old_country != new_country)
+
+    types = locality_type_counts(locality_id) if moved else {}
+
+    deltas = {}
+    for state, sign in ((old_state, -1), (new_state, 1)):
+        if state is None:
+            continue
+        counts = {'localities': 1}
+        bucket = completeness_bucket(state[1])
+        if bucket is not None:
+            counts[COMPLETENESS_BUCKETS[bucket]] = 1
+        counts.update(types)
+        add_counts(deltas, state[0], counts, sign)
+
+    apply_deltas(deltas)
+
+
+def update_type_statistics(value, old_data, new_data):
+    """
+    Update statistics by the change of a 'type' Value of a master Locality
+    from *old_data* to *new_data*, None if the Value is created or deleted
+    """
+
+    from .models import Locality, Specification
+
+    if old_data == new_data:
+        return
+    if not Specification.objects.filter(
+            pk=value.specification_id, attribute__key='type').exists():
+        return
+
+    localities = Locality.objects.filter(pk=value.locality_id, master=None)
+    country_ids = localities.values_list('country_id', flat=True)[:1]
+    if not country_ids:
+        return
+
+    deltas = {}
+    country_id = country_ids[0]
+    add_counts(deltas, country_id, type_counts(old_data), -1)
+    add_counts(deltas, country_id, type_counts(new_data), 1)
+    apply_deltas(deltas)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import logging
+
+LOG = logging.getLogger(__name__)
+
+from django.contrib.gis.geos import Polygon
+
+
+def polygons(geometry):
+    """
+    Yield non empty polygons of a geometry, a polygon, a multipolygon or a
+    geometry collection
+    """
+
+    if geometry.empty:
+        return
+    if geometry.geom_type == 'Polygon':
+        if geometry.area > 0:
+            yield geometry
+    elif geometry.geom_type in ('MultiPolygon', 'GeometryCollection'):
+        for part in geometry:
+            for polygon in polygons(part):
+                yield polygon
+
+
+def subdivide(geometry, max_vertices=256, max_depth=32):
+    """
+    Yield polygons of a geometry subdivided until none of them has more than
+    *max_vertices* vertices, like ST_Subdivide of PostGIS 2.2
+
+    A polygon with too many vertices is split in halves of its bbox, across
+    its longer side. Small pieces have tight bboxes, so they are filtered
+    effectively by a spatial index
+    """
+
+    srid = geometry.srid
+    stack = [(polygon, 0) for polygon in polygons(geometry)]
+    while stack:
+        polygon, depth = stack.pop()
+        if polygon.num_coords <= max_vertices or depth >= max_depth:
+            polygon.srid = srid
+            yield polygon
+            continue
+
+        minx, miny, maxx, maxy = polygon.extent
+        if maxx - minx >= maxy - miny:
+            middle = (minx + maxx) / 2.0
+            halves = ((minx, miny, middle, maxy), (middle, miny, maxx, maxy))
+        else:
+            middle = (miny + maxy) / 2.0
+            halves = ((minx, miny, maxx, middle), (minx, middle, maxx, maxy))
+
+        for half in halves:
+            clip = Polygon.from_bbox(half)
+            clip.srid = polygon.srid
+            for piece in polygons(polygon.intersection(clip)):
+                stack.append((piece, depth + 1))
@@ -55,6 +55,7 @@ def send_email(data_loader, report, additional_email=[]):
 def load_data_task(self, data_loader_pk):
     # Put here to avoid circular import
     from .models import DataLoader, DataLoaderPermission
+    from .tiles import clear_tiles
     from django.core.management import call_command
     try:
         data_loader = DataLoader.objects.get(pk=data_loader_pk)
@@ -108,6 +109,7 @@ def load_data_task(self, data_loader_pk):
 
             call_command('generate_countries_cache')
             regenerate_cache_cluster()
+            clear_tiles()
         except DataLoaderPermission.DoesNotExist:
             print "file is not authenticated"
             logger.info("file is not authenticated")
@@ -119,49 +121,26 @@ def load_data_task(self, data_loader_pk):
 
 @app.task(bind=True)
 def regenerate_cache(self, changeset_pk, locality_pk):
+    """
+    Refresh the latest updates of the world statistics and of statistics of
+    the Country of a changed Locality, their counts are updated by deltas
+    when the Locality is saved
+    """
     # Put here to avoid circular import
     from .models import Changeset
     from .models import Locality
-    from localities.models import Country
-    import os
-    import json
-    from django.conf import settings
-    from localities.utils import get_statistic
-    from django.core.serializers.json import DjangoJSONEncoder
+    from localities.utils import update_country_statistic_updates
 
     try:
         changeset = Changeset.objects.get(pk=changeset_pk)
         locality = Locality.objects.get(pk=locality_pk)
-        country = Country.objects.filter(polygon_geometry__contains=locality.geom)
-
-        # write world cache
-        filename = os.path.join(
-            settings.CLUSTER_CACHE_DIR,
-            'world_statistic')
-        healthsites = Locality.objects.all()
-        output = get_statistic(healthsites)
-        result = json.dumps(output, cls=DjangoJSONEncoder)
-        file = open(filename, 'w')
-        file.write(result)  # python will convert \n to os.linesep
-        file.close()  # you can omit in most cases as the destructor will call it
-
-        # getting country's polygon
-        if len(country):
-            country = country[0]
-            polygons = country.polygon_geometry
-
-            # write country cache
-            filename = os.path.join(
-                settings.CLUSTER_CACHE_DIR,
-                country.name + '_statistic'
-            )
-            healthsites = Locality.objects.in_polygon(
-                polygons)
-            output = get_statistic(healthsites)
-            result = json.dumps(output, cls=DjangoJSONEncoder)
-            file = open(filename, 'w')
-            file.write(result)  # python will convert \n to os.linesep
-            file.close()  # you can omit in most cases as the destructor will call it
+
+        # world statistics
+        update_country_statistic_updates()
+
+        # country statistics
+        if locality.country_id is not None:
+            update_country_statistic_updates(locality.country)
 
     except Changeset.DoesNotExist as exc:
         raise self.retry(exc=exc, countdown=5, max_retries=10)
@@ -173,5 +152,99 @@ def regenerate_cache(self, changeset_pk, locality_pk):
 
 @app.task(bind=True)
 def regenerate_cache_cluster(self):
+    """
+    Regenerate the Locality snapshot, density grids and cached clusters of
+    every icon size bucket, buckets are generated concurrently by separate
+    tasks
+    """
     from django.core.management import call_command
-    call_command('gen_cluster_cache', 48, 46)
+    from .cluster_cache import icon_size_buckets
+    call_command('gen_locality_snapshot')
+    call_command('gen_density_grid')
+    for icon_size in icon_size_buckets():
+        regenerate_cache_cluster_icon_size.delay(*icon_size)
+
+
+@app.task(bind=True)
+def regenerate_cache_cluster_icon_size(self, icon_width, icon_height):
+    from django.core.management import call_command
+    call_command('gen_cluster_cache', icon_width, icon_height)
+
+
+@app.task(bind=True)
+def update_cache_cluster(self, uuid, old_geom, new_geom, old_facets=None):
+    """
+    Apply an insert, move or delete of a master Locality to the cached
+    clusters, *old_geom* is None if the Locality was not a master Locality and
+    *new_geom* is None if it's not a master Locality anymore. *old_facets* are
+    packed facets of the Locality before the change, see locality_facets
+
+    Cached clusters are fully regenerated by the periodic
+    regenerate_cache_cluster task, an existing Locality snapshot is
+    rewritten once changes settle down, see rewrite_locality_snapshot
+    """
+    import os
+    from django.conf import settings
+    from .cluster_cache import update_cluster_caches
+    from .country_locator import get_country_locator
+    from .models import Country
+    from .snapshot import current_watermark, snapshot_filename
+
+    locator = get_country_locator()
+
+    def get_country_name(geom):
+        if geom is None:
+            return None
+        country_id = locator.locate(geom[0], geom[1])
+        if country_id is None:
+            return None
+        countries = Country.objects.filter(id=country_id).values_list('name', flat=True)
+        if countries:
+            return countries[0]
+        return None
+
+    update_cluster_caches(
+        uuid, old_geom, new_geom,
+        get_country_name(old_geom), get_country_name(new_geom), old_facets
+    )
+
+    if os.path.exists(snapshot_filename()):
+        rewrite_locality_snapshot.apply_async(
+            (current_watermark(),),
+            countdown=getattr(settings, 'LOCALITY_SNAPSHOT_REWRITE_DELAY', 300)
+        )
+
+
+@app.task(bind=True)
+def rewrite_locality_snapshot(self, watermark):
+    """
+    Rewrite an existing Locality snapshot after a change, which was the
+    latest one at *watermark*
+
+    Rewrites are debounced, a rewrite is skipped if a later change scheduled
+    its own rewrite or the snapshot isn't stale anymore. Changes pending for
+    LOCALITY_SNAPSHOT_REWRITE_MAX_DELAY seconds are written anyway, so a
+    steady stream of changes doesn't postpone the rewrite forever
+    """
+    import os
+    from datetime import timedelta
+    from django.conf import settings
+    from django.utils import timezone
+    from .snapshot import (
+        changed_since, current_watermark, get_snapshot, snapshot_filename, write_snapshot
+    )
+
+    if not os.path.exists(snapshot_filename()):
+        return
+    if current_watermark() > watermark:
+        pending_since = changed_since()
+        max_delay = timedelta(
+            seconds=getattr(settings, 'LOCALITY_SNAPSHOT_REWRITE_MAX_DELAY', 1800))
+        if pending_since is None or timezone.now() - pending_since < max_delay:
+            return
+
+    snapshot = get_snapshot()
+    if snapshot is not None and not snapshot.is_stale():
+        return
+
+    write_snapshot()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import gzip
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from ..cache_files import CacheTimeout, cache_lock, get_cache_file, write_cache_file
+
+
+class TestCacheFiles(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.filename = os.path.join(cache_dir, 'cache.json')
+        self.generated = 0
+
+    def generate(self):
+        self.generated += 1
+        return '[]'
+
+    def test_write_cache_file(self):
+        write_cache_file(self.filename, '[1]')
+        write_cache_file(self.filename, '[2]')
+
+        with open(self.filename, 'rb') as cache_file:
+            self.assertEqual(cache_file.read(), '[2]')
+        # only the cache file is left
+        self.assertListEqual(os.listdir(os.path.dirname(self.filename)), ['cache.json'])
+
+    def test_write_cache_file_compressed(self):
+        write_cache_file(self.filename, '[1]', compress=True)
+
+        with gzip.open(self.filename + '.gz', 'rb') as gzip_file:
+            self.assertEqual(gzip_file.read(), '[1]')
+
+        # stale compressed siblings are removed
+        write_cache_file(self.filename, '[2]')
+
+        self.assertFalse(os.path.exists(self.filename + '.gz'))
+
+    def test_get_cache_file(self):
+        self.assertEqual(get_cache_file(self.filename, self.generate), '[]')
+        self.assertEqual(get_cache_file(self.filename, self.generate), '[]')
+        self.assertEqual(self.generated, 1)
+
+    def test_get_cache_file_timeout(self):
+        with cache_lock(self.filename, 1):
+            self.assertRaises(
+                CacheTimeout, get_cache_file, self.filename, self.generate, 0.2
+            )
+        self.assertEqual(self.generated, 0)
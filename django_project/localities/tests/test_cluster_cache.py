@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from ..cluster_cache import (
+    ClusterIndex, add_point, apply_change, read_cluster_cache, remove_point, rename_point, snap_icon_size,
+    update_cluster_cache, write_cluster_cache
+)
+
+
+class TestClusterCache(TestCase):
+    def setUp(self):
+        self.clusters = [{
+            'uuid': '93b7e8c4621a4597938dfd3d27659160', 'name': 'first',
+            'count': 2, 'geom': [0.0, 0.0],
+            'bbox': [-10.546875, -10.546875, 10.546875, 10.546875],
+            'minbbox': [0.0, 0.0, 1.0, 1.0], 'localities': []
+        }]
+
+    def test_add_point(self):
+        add_point(
+            self.clusters, 3, 40, 40, '93b7e8c4621a4597938dfd3d27659161',
+            'second', (-1.0, 2.0)
+        )
+
+        self.assertEqual(len(self.clusters), 1)
+        self.assertEqual(self.clusters[0]['count'], 3)
+        self.assertListEqual(self.clusters[0]['minbbox'], [-1.0, 0.0, 1.0, 2.0])
+
+        add_point(
+            self.clusters, 3, 40, 40, '93b7e8c4621a4597938dfd3d27659162',
+            'third', (45.0, 45.0)
+        )
+
+        self.assertEqual(len(self.clusters), 2)
+        self.assertEqual(self.clusters[1]['uuid'], '93b7e8c4621a4597938dfd3d27659162')
+        self.assertEqual(self.clusters[1]['count'], 1)
+        self.assertEqual(self.clusters[1]['bbox'], (
+            37.54223316717313, 37.54223316717313,
+            52.45776683282687, 52.45776683282687)
+        )
+
+    def test_remove_point(self):
+        remove_point(self.clusters, '93b7e8c4621a4597938dfd3d27659161', (1.0, 1.0))
+
+        self.assertEqual(self.clusters[0]['count'], 1)
+
+        remove_point(self.clusters, '93b7e8c4621a4597938dfd3d27659160', (0.0, 0.0))
+
+        self.assertListEqual(self.clusters, [])
+
+    def test_rename_point(self):
+        rename_point(self.clusters, '93b7e8c4621a4597938dfd3d27659160', 'renamed')
+
+        self.assertEqual(self.clusters[0]['name'], 'renamed')
+
+    def test_facets(self):
+        self.clusters[0]['numbers'] = {
+            'hospital': 1, 'medical_clinic': 0, 'orthopaedic_clinic': 0}
+        self.clusters[0]['completeness'] = {'complete': 0, 'partial': 2, 'basic': 0}
+        hospital_complete = 1 | 1 << 3
+        clinic_partial = 1 << 1 | 1 << 4
+
+        add_point(
+            self.clusters, 3, 40, 40, '93b7e8c4621a4597938dfd3d27659161',
+            'second', (-1.0, 2.0), hospital_complete
+        )
+        add_point(
+            self.clusters, 3, 40, 40, '93b7e8c4621a4597938dfd3d27659162',
+            'third', (45.0, 45.0), clinic_partial
+        )
+
+        self.assertDictEqual(self.clusters[0]['numbers'], {
+            'hospital': 2, 'medical_clinic': 0, 'orthopaedic_clinic': 0})
+        self.assertDictEqual(
+            self.clusters[0]['completeness'], {'complete': 1, 'partial': 2, 'basic': 0})
+        self.assertDictEqual(self.clusters[1]['numbers'], {
+            'hospital': 0, 'medical_clinic': 1, 'orthopaedic_clinic': 0})
+        self.assertDictEqual(
+            self.clusters[1]['completeness'], {'complete': 0, 'partial': 1, 'basic': 0})
+
+        # facets changed without a move
+        self.assertTrue(apply_change(
+            self.clusters, 3, [40, 40], '93b7e8c4621a4597938dfd3d27659161', 'second',
+            (-1.0, 2.0), (-1.0, 2.0), hospital_complete, clinic_partial
+        ))
+        self.assertDictEqual(self.clusters[0]['numbers'], {
+            'hospital': 1, 'medical_clinic': 1, 'orthopaedic_clinic': 0})
+        self.assertDictEqual(
+            self.clusters[0]['completeness'], {'complete': 0, 'partial': 3, 'basic': 0})
+
+        remove_point(
+            self.clusters, '93b7e8c4621a4597938dfd3d27659161', (-1.0, 2.0), clinic_partial)
+        self.assertDictEqual(self.clusters[0]['numbers'], {
+            'hospital': 1, 'medical_clinic': 0, 'orthopaedic_clinic': 0})
+        self.assertDictEqual(
+            self.clusters[0]['completeness'], {'complete': 0, 'partial': 2, 'basic': 0})
+
+    def test_apply_change_without_facets(self):
+        apply_change(
+            self.clusters, 3, [40, 40], '93b7e8c4621a4597938dfd3d27659162', 'third',
+            None, (45.0, 45.0), None, 1
+        )
+
+        self.assertEqual(len(self.clusters), 2)
+        self.assertNotIn('numbers', self.clusters[1])
+
+    def test_update_cluster_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        filename = os.path.join(cache_dir, '3_40_40_localities.json')
+        write_cluster_cache(filename, self.clusters)
+        os.remove(filename + '.gz')
+
+        # unchanged clusters are not rewritten
+        update_cluster_cache(
+            filename, 3, [40, 40], '93b7e8c4621a4597938dfd3d27659160', 'first',
+            (0.0, 0.0), (0.0, 0.0)
+        )
+        self.assertFalse(os.path.exists(filename + '.gz'))
+
+        update_cluster_cache(
+            filename, 3, [40, 40], '93b7e8c4621a4597938dfd3d27659160', 'renamed',
+            (0.0, 0.0), (0.0, 0.0)
+        )
+        self.assertTrue(os.path.exists(filename + '.gz'))
+        self.assertEqual(read_cluster_cache(filename)[0]['name'], 'renamed')
+
+    def test_cluster_index(self):
+        clusters = self.clusters + [{
+            'uuid': '93b7e8c4621a4597938dfd3d27659161', 'name': 'second',
+            'count': 1, 'geom': [45.0, 45.0],
+            'bbox': [34.453125, 34.453125, 55.546875, 55.546875],
+            'minbbox': [45.0, 45.0, 45.0, 45.0], 'localities': []
+        }]
+        cluster_index = ClusterIndex(clusters)
+
+        self.assertListEqual(cluster_index.query((-360, -180, 360, 180)), clusters)
+        self.assertListEqual(cluster_index.query((10, 10, 20, 20)), clusters[:1])
+        self.assertListEqual(cluster_index.query((50, 50, 60, 60)), clusters[1:])
+        self.assertListEqual(cluster_index.query((-100, -80, -90, -70)), [])
+
+    def test_snap_icon_size(self):
+        with self.settings(CLUSTER_ICON_SIZE_BUCKETS=((32, 31), (48, 46), (96, 92))):
+            self.assertListEqual(snap_icon_size([48, 46]), [48, 46])
+            self.assertListEqual(snap_icon_size([40, 40]), [48, 46])
+            self.assertListEqual(snap_icon_size([20, 20]), [32, 31])
+            self.assertListEqual(snap_icon_size([128, 128]), [96, 92])
+
+        with self.settings(CLUSTER_ICON_SIZE_BUCKETS=()):
+            self.assertListEqual(snap_icon_size([40, 40]), [40, 40])
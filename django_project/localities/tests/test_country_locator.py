@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from django.contrib.gis.geos import MultiPolygon, Polygon
+from django.test import TestCase
+
+from ..country_locator import CountryLocator, get_country_locator
+from ..models import Country
+
+
+class TestCountryLocator(TestCase):
+    def test_locate(self):
+        locator = CountryLocator([
+            (1, Polygon.from_bbox((0, 0, 10, 10))),
+            (1, Polygon.from_bbox((10, 0, 20, 10))),
+            (2, Polygon.from_bbox((-5, -5, -1, -1)))
+        ])
+
+        self.assertEqual(locator.locate(5, 5), 1)
+        # on the shared edge of parts
+        self.assertEqual(locator.locate(10, 5), 1)
+        self.assertEqual(locator.locate(-3, -3), 2)
+        self.assertIsNone(locator.locate(-0.5, -0.5))
+        self.assertIsNone(locator.locate(50, 50))
+
+    def test_locate_points(self):
+        locator = CountryLocator([(1, Polygon.from_bbox((0, 0, 10, 10)))])
+
+        self.assertDictEqual(
+            locator.locate_points([(1, 'a', 5, 5), (2, 'b', 50, 50)]),
+            {1: [(1, 'a', 5, 5)], None: [(2, 'b', 50, 50)]}
+        )
+
+    def test_get_country_locator(self):
+        self.assertIsNone(get_country_locator().locate(5, 5))
+
+        # reloaded when countries are changed
+        country = Country.objects.create(
+            name='Test', polygon_geometry=MultiPolygon(Polygon.from_bbox((0, 0, 10, 10)))
+        )
+        locator = get_country_locator()
+        self.assertEqual(locator.locate(5, 5), country.id)
+        self.assertIs(get_country_locator(), locator)
+
+        country.delete()
+        self.assertIsNone(get_country_locator().locate(5, 5))
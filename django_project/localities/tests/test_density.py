@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from .model_factories import LocalityF, ValueF
+
+from ..density import (
+    decode_density_grid, density_filename, density_grids, downsample_grid,
+    encode_density_grid, grid_size, write_density_grids
+)
+from ..models import Locality
+
+
+class TestDensity(TestCase):
+    def test_grid_size(self):
+        with self.settings(DENSITY_GRID_COLUMNS=256):
+            self.assertEqual(grid_size(0), (256, 128))
+            self.assertEqual(grid_size(2), (1024, 512))
+
+    def test_downsample_grid(self):
+        self.assertDictEqual(
+            downsample_grid({(0, 0): 1, (1, 1): 2, (2, 1): 3, (5, 4): 4}),
+            {(0, 0): 3, (1, 0): 3, (2, 2): 4}
+        )
+
+    def test_encode_density_grid(self):
+        grid = {(0, 0): 1, (255, 127): 7, (3, 2): 1000000}
+
+        data = encode_density_grid(0, grid)
+
+        self.assertEqual(data[:4], 'HSDG')
+        self.assertEqual(decode_density_grid(data), (0, 256, 128, grid))
+        self.assertRaises(ValueError, decode_density_grid, 'XXXX' + data[4:])
+
+    def test_density_grids(self):
+        LocalityF.create(geom='POINT(-180 90)')
+        hospital = LocalityF.create(geom='POINT(180 -90)')
+        LocalityF.create(geom='POINT(179.5 -89.5)')
+        ValueF.create(
+            locality=hospital, specification__attribute__key='type', data='Hospital')
+
+        with self.settings(DENSITY_GRID_COLUMNS=4):
+            grids = density_grids(Locality.objects.all(), 0)
+
+        self.assertDictEqual(grids[None], {(0, 0): 1, (3, 1): 2})
+        self.assertDictEqual(grids['hospital'], {(3, 1): 1})
+        self.assertDictEqual(grids['medical_clinic'], {})
+
+    def test_write_density_grids(self):
+        LocalityF.create(geom='POINT(16 45)')
+        LocalityF.create(geom='POINT(-16 -45)')
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with self.settings(CLUSTER_CACHE_DIR=cache_dir, DENSITY_GRID_COLUMNS=4):
+            self.assertEqual(write_density_grids(Locality.objects.all(), 2), 2)
+
+            for zoom in range(3):
+                with open(density_filename(zoom), 'rb') as grid_file:
+                    zoom, columns, rows, grid = decode_density_grid(grid_file.read())
+                self.assertEqual(sum(grid.values()), 2)
+                self.assertEqual(columns, 4 * 2 ** zoom)
@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+
 from django.test import TestCase
 from django.core.management import call_command
 from django.core.management.base import CommandError
 
-from .model_factories import AttributeF, DomainSpecification3AF
+from .model_factories import AttributeF, DomainSpecification3AF, LocalityF
 
 from ..models import Locality, Value
 
@@ -35,3 +40,68 @@ class TestManagementCommands(TestCase):
         self.assertRaises(
             CommandError, call_command, 'import_csv', 'Test', 'test_imp'
         )
+
+    def test_gen_cluster_cache(self):
+        LocalityF.create(geom='POINT(16 45)')
+        LocalityF.create(geom='POINT(16.1 45.1)')
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with self.settings(CLUSTER_CACHE_DIR=cache_dir, CLUSTER_CACHE_MAX_ZOOM=2):
+            call_command('gen_cluster_cache', 48, 46, workers=1)
+
+        for zoom in range(3):
+            with open(os.path.join(cache_dir, '{}_48_46_localities.json'.format(zoom))) as cache_file:
+                clusters = json.load(cache_file)
+            self.assertEqual(len(clusters), 1)
+            self.assertEqual(clusters[0]['count'], 2)
+
+    def test_gen_cluster_cache_facets(self):
+        LocalityF.create(geom='POINT(16 45)')
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        filename = os.path.join(cache_dir, '0_48_46_localities.json')
+        with self.settings(CLUSTER_CACHE_DIR=cache_dir, CLUSTER_CACHE_MAX_ZOOM=0):
+            for facets in (True, False):
+                call_command('gen_cluster_cache', 48, 46, facets=facets)
+                with open(filename) as cache_file:
+                    clusters = json.load(cache_file)
+                self.assertEqual('numbers' in clusters[0], facets)
+
+    def test_gen_cluster_cache_bad_arguments(self):
+        self.assertRaises(
+            CommandError, call_command, 'gen_cluster_cache', 48
+        )
+        self.assertRaises(
+            CommandError, call_command, 'gen_cluster_cache', 48, 46, workers=0
+        )
+
+    def test_benchmark_clustering(self):
+        handle, output = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        self.addCleanup(os.remove, output)
+
+        with self.settings(CLUSTER_CACHE_MAX_ZOOM=1):
+            call_command(
+                'benchmark_clustering', sizes='20,40', max_zoom=1,
+                in_place=True, output=output
+            )
+
+        with open(output) as report_file:
+            report = json.load(report_file)
+
+        # synthetic Localities are rolled back
+        self.assertEqual(Locality.objects.count(), 0)
+        self.assertSetEqual(
+            set(result['benchmark'] for result in report['results']),
+            {'cluster', 'gen_locality_snapshot', 'gen_cluster_cache', 'view', 'get_statistic'}
+        )
+        for result in report['results']:
+            self.assertIn(result['size'], (20, 40))
+            self.assertIn('wall_time', result)
+            self.assertIn('peak_rss_kb', result)
+            self.assertIn('rss_growth_kb', result)
+            self.assertIn('queries', result)
+            if result['benchmark'] == 'get_statistic':
+                self.assertEqual(result['result'], result['size'])
@@ -1,14 +1,24 @@
 # -*- coding: utf-8 -*-
+from unittest import skipIf
+
 from django.test import TestCase
 
 
-from .model_factories import LocalityF
+from .model_factories import LocalityF, ValueF
 
 from ..map_clustering import (
+    Cluster,
     within_bbox,
     cluster,
     overlapping_area,
-    update_minbbox
+    update_minbbox,
+    grid_cell_size,
+    grid_cell,
+    numpy,
+    load_facets,
+    load_points,
+    cluster_pyramid,
+    cluster_in_database
 )
 
 from ..models import Locality
@@ -40,6 +50,22 @@ class TestMapClustering(TestCase):
             (0.10986328125000001, 0.10986328125000001)
         )
 
+    def test_grid_cell_size(self):
+        self.assertEqual(
+            grid_cell_size(zoom=0, pix_x=10, pix_y=10),
+            (21.09375, 21.09375)
+        )
+
+        # degenerate icon size
+        self.assertEqual(grid_cell_size(zoom=0, pix_x=0, pix_y=0), (1.0, 1.0))
+
+    def test_grid_cell(self):
+        cell_size = (10.0, 5.0)
+
+        self.assertEqual(grid_cell(cell_size, 0, 0), (0, 0))
+        self.assertEqual(grid_cell(cell_size, 15, 7), (1, 1))
+        self.assertEqual(grid_cell(cell_size, -1, -1), (-1, -1))
+
     def test_update_minbbox(self):
         minbbox = (0, 0, 0, 0)
         self.assertListEqual(update_minbbox((0, 0), minbbox), [0, 0, 0, 0])
@@ -49,6 +75,60 @@ class TestMapClustering(TestCase):
         self.assertListEqual(update_minbbox((1, -1), minbbox), [0, -1, 1, 0])
         self.assertListEqual(update_minbbox((1, 1), minbbox), [0, 0, 1, 1])
 
+    def test_cluster_record(self):
+        cluster_point = Cluster('93b7e8c4621a4597938dfd3d27659160', 'first', 0.0, 0.0)
+
+        self.assertEqual(cluster_point.as_dict()['minbbox'], (0.0, 0.0, 0.0, 0.0))
+
+        cluster_point.add_point(-1.0, 2.0)
+        cluster_point.add_cluster(Cluster('93b7e8c4621a4597938dfd3d27659161', '', 3.0, -4.0))
+        cluster_point.add_locality(7)
+
+        self.assertDictEqual(cluster_point.as_dict(), {
+            'uuid': '93b7e8c4621a4597938dfd3d27659160', 'name': 'first',
+            'count': 3, 'geom': (0.0, 0.0), 'bbox': None,
+            'minbbox': [-1.0, -4.0, 3.0, 2.0], 'localities': [7]
+        })
+
+    def test_cluster_localities(self):
+        first = LocalityF.create(geom='POINT(0 0)')
+        second = LocalityF.create(geom='POINT(1 1)')
+        third = LocalityF.create(geom='POINT(45 45)')
+
+        dict_cluster = cluster(Locality.objects.order_by('id'), 3, 40, 40, True)
+
+        self.assertListEqual(
+            [cluster_point['localities'] for cluster_point in dict_cluster],
+            [[first.id, second.id], [third.id]]
+        )
+
+    def test_cluster_facets(self):
+        first = LocalityF.create(geom='POINT(0 0)')
+        second = LocalityF.create(geom='POINT(1 1)', completeness=100)
+        LocalityF.create(geom='POINT(45 45)', completeness=50)
+        ValueF.create(
+            locality=first, specification__attribute__key='type', data='Hospital')
+        ValueF.create(
+            locality=second, specification__attribute__key='type', data='orthopaedic clinic')
+
+        dict_cluster = cluster(Locality.objects.all(), 3, 40, 40, facets=True)
+
+        self.assertDictEqual(dict_cluster[0]['numbers'], {
+            'hospital': 1, 'medical_clinic': 1, 'orthopaedic_clinic': 1
+        })
+        self.assertDictEqual(dict_cluster[0]['completeness'], {
+            'complete': 1, 'partial': 0, 'basic': 1
+        })
+        self.assertDictEqual(dict_cluster[1]['completeness'], {
+            'complete': 0, 'partial': 1, 'basic': 0
+        })
+
+        pyramid = cluster_pyramid(
+            load_points(Locality.objects.all()), 0, 3, 40, 40,
+            load_facets(Locality.objects.all())
+        )
+        self.assertListEqual(pyramid[3], dict_cluster)
+
     def test_cluster(self):
 
         LocalityF.create(uuid='93b7e8c4621a4597938dfd3d27659160')
@@ -92,3 +172,62 @@ class TestMapClustering(TestCase):
                     37.54223316717313, 37.54223316717313,
                     52.45776683282687, 52.45776683282687)}
         ])
+
+    @skipIf(numpy is None, 'numpy is not installed')
+    def test_cluster_engines(self):
+        points = [
+            (0, 0), (0.5, 0.5), (1, -1), (28, 28), (30, 30), (32, 32),
+            (45, 45), (-73.9, 40.7), (-74, 40.8), (151.2, -33.9), (179, 85)
+        ]
+        for point in points:
+            LocalityF.create(geom='POINT({} {})'.format(*point))
+
+        queryset = Locality.objects.all()
+
+        for zoom in (0, 3, 6, 12):
+            self.assertListEqual(
+                cluster(queryset, zoom, 48, 46, engine='numpy'),
+                cluster(queryset, zoom, 48, 46, engine='python')
+            )
+
+    def test_cluster_pyramid(self):
+        points = [
+            (0, 0), (0.5, 0.5), (1, -1), (28, 28), (30, 30), (32, 32),
+            (45, 45), (-73.9, 40.7), (-74, 40.8), (151.2, -33.9), (179, 85)
+        ]
+        for point in points:
+            LocalityF.create(geom='POINT({} {})'.format(*point))
+
+        queryset = Locality.objects.all()
+        pyramid = cluster_pyramid(load_points(queryset), 0, 6, 48, 46)
+
+        self.assertListEqual(sorted(pyramid.keys()), range(7))
+        # the highest zoom is clustered exactly
+        self.assertListEqual(
+            pyramid[6], cluster(queryset, 6, 48, 46, engine='python')
+        )
+        for zoom in range(7):
+            self.assertEqual(
+                sum(cluster_point['count'] for cluster_point in pyramid[zoom]),
+                len(points)
+            )
+
+    def test_cluster_in_database(self):
+        LocalityF.create(
+            uuid='93b7e8c4621a4597938dfd3d27659160', geom='POINT(1 1)'
+        )
+        LocalityF.create(
+            uuid='93b7e8c4621a4597938dfd3d27659161', geom='POINT(2 2)'
+        )
+        LocalityF.create(
+            uuid='93b7e8c4621a4597938dfd3d27659162', geom='POINT(-100 -40)'
+        )
+
+        dict_cluster = cluster_in_database(Locality.objects.all(), 2, 48, 46)
+
+        self.assertEqual(len(dict_cluster), 2)
+        self.assertEqual(dict_cluster[0]['uuid'], '93b7e8c4621a4597938dfd3d27659160')
+        self.assertEqual(dict_cluster[0]['count'], 2)
+        self.assertEqual(dict_cluster[0]['geom'], (1.0, 1.0))
+        self.assertListEqual(dict_cluster[0]['minbbox'], [1.0, 1.0, 2.0, 2.0])
+        self.assertEqual(dict_cluster[1]['count'], 1)
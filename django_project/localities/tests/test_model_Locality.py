@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from django.contrib.gis.geos import MultiPolygon, Point, Polygon
 from django.test import TestCase
 
 from django.db import IntegrityError
@@ -16,7 +17,7 @@ from .model_factories import (
     ChangesetF
 )
 
-from ..models import Locality
+from ..models import Country, Locality
 
 
 class TestModelLocality(TestCase):
@@ -248,3 +249,24 @@ class TestModelLocality(TestCase):
         self.assertEqual(locality.prepare_for_fts(), {
             u'A': u'1test 2test', u'D': u'3test 4test'
         })
+
+    def test_country_assignment(self):
+        country = Country.objects.create(
+            name='Test', polygon_geometry=MultiPolygon(Polygon.from_bbox((0, 0, 10, 10)))
+        )
+
+        locality = LocalityF.create(geom='POINT(5 5)')
+        self.assertEqual(locality.country, country)
+        self.assertEqual(list(Locality.objects.in_country(country)), [locality])
+
+        locality.geom = Point(20, 20)
+        locality.save()
+        self.assertIsNone(Locality.objects.get(pk=locality.pk).country)
+
+        # bulk assignment of Localities, e.g. when countries are recreated
+        Locality.objects.filter(pk=locality.pk).update(geom=Point(1, 1))
+        self.assertEqual(Locality.objects.all().update_countries(), 1)
+        self.assertEqual(Locality.objects.get(pk=locality.pk).country, country)
+
+        country.delete()
+        self.assertIsNone(Locality.objects.get(pk=locality.pk).country)
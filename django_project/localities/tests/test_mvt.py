@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from django.test import TestCase
+
+from ..mvt import encode_tile, encode_varint, tile_pixel, zigzag
+
+
+class TestMVT(TestCase):
+    def test_encode_varint(self):
+        self.assertEqual(encode_varint(1), '\x01')
+        self.assertEqual(encode_varint(300), '\xac\x02')
+
+    def test_zigzag(self):
+        self.assertListEqual(
+            [zigzag(value) for value in (0, -1, 1, -2, 2)], [0, 1, 2, 3, 4]
+        )
+
+    def test_tile_pixel(self):
+        self.assertEqual(tile_pixel(0, 0, 0, 0.0, 0.0), (2048, 2048))
+        self.assertEqual(tile_pixel(3, 4, 2, 16.0, 45.0), (1456, 3595))
+
+    def test_encode_tile(self):
+        tile = encode_tile(3, 4, 2, [{
+            'uuid': '93b7e8c4621a4597938dfd3d27659162', 'name': u'first',
+            'count': 3, 'geom': (16.0, 45.0), 'minbbox': [15.0, 44.0, 17.0, 46.0]
+        }])
+
+        # a single 'localities' layer
+        self.assertEqual(tile[0], '\x1a')
+        self.assertIn('\x0a\x0alocalities', tile)
+        # a point feature (type 1) with geometry MoveTo(1456, 3595)
+        self.assertIn('\x18\x01\x22\x05\x09\xe0\x16\x96\x38', tile)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from django.test import TestCase
+
+from ..search_cache import SearchCache, snap_bbox
+
+
+class TestSearchCache(TestCase):
+    def test_snap_bbox(self):
+        tiles, bbox = snap_bbox(0, (-10, -10, 10, 10))
+
+        self.assertEqual(tiles, (0, 0, 0, 0))
+        self.assertEqual(bbox, (-180.0, -90.0, 180.0, 90.0))
+
+        tiles, bbox = snap_bbox(2, (10, 10, 20, 20))
+
+        self.assertEqual(tiles, (2, 1, 2, 1))
+        self.assertEqual(bbox, (0.0, 0.0, 90.0, 66.51326044311186))
+
+        self.assertEqual(snap_bbox(2, (1, 1, 89, 60))[0], tiles)
+
+    def test_search_cache(self):
+        search_cache = SearchCache(2)
+        search_cache.set('first', 1, [1])
+        search_cache.set('second', 1, [2])
+
+        self.assertEqual(search_cache.get('first', 1), [1])
+
+        # 'second' is the least recently used result
+        search_cache.set('third', 1, [3])
+
+        self.assertIsNone(search_cache.get('second', 1))
+        self.assertEqual(search_cache.get('third', 1), [3])
+        self.assertIsNone(search_cache.get('first', 2))
+
+        # caching a result for a newer watermark clears the cache
+        search_cache.set('fourth', 2, [4])
+
+        self.assertIsNone(search_cache.get('third', 2))
+        self.assertEqual(search_cache.get('fourth', 2), [4])
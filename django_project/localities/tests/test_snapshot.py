@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from .model_factories import LocalityF
+
+from ..map_clustering import cluster
+from ..snapshot import (
+    LocalitySnapshot, cluster_snapshot, current_watermark, snapshot_filename, write_snapshot
+)
+from ..tasks import rewrite_locality_snapshot
+from ..models import Locality
+
+
+class TestSnapshot(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.filename = os.path.join(cache_dir, 'localities.snapshot')
+
+    def test_write_snapshot(self):
+        points = [(0, 0), (0.5, 0.5), (28, 28), (-73.5, 40.5)]
+        for point in points:
+            LocalityF.create(geom='POINT({} {})'.format(*point))
+        master = LocalityF.create(geom='POINT(1 1)')
+        LocalityF.create(geom='POINT(2 2)', master=master)
+
+        self.assertEqual(write_snapshot(self.filename), 5)
+
+        snapshot = LocalitySnapshot(self.filename)
+        self.assertEqual(len(snapshot), 5)
+        self.assertFalse(snapshot.is_stale())
+
+        uuids = sorted(point[1] for point in snapshot.points())
+        self.assertListEqual(
+            uuids, sorted(Locality.objects.filter(master=None).values_list('uuid', flat=True))
+        )
+        self.assertEqual(len(snapshot.points(bbox=(-1, -1, 1, 1))), 3)
+
+        # vectorized and pure Python readers get the same points
+        points = snapshot.points(bbox=(-1, -1, 1, 1))
+        records, snapshot.records = snapshot.records, None
+        self.assertListEqual(snapshot.points(bbox=(-1, -1, 1, 1)), points)
+        snapshot.records = records
+
+        self.assertListEqual(
+            cluster_snapshot(snapshot, 2, 48, 46),
+            cluster(Locality.objects.filter(master=None), 2, 48, 46, engine='python')
+        )
+
+        LocalityF.create(geom='POINT(3 3)')
+        self.assertTrue(snapshot.is_stale())
+        snapshot.close()
+
+    def test_rewrite_locality_snapshot(self):
+        LocalityF.create(geom='POINT(0 0)')
+        with self.settings(CLUSTER_CACHE_DIR=os.path.dirname(self.filename)):
+            write_snapshot()
+
+            LocalityF.create(geom='POINT(1 1)')
+            watermark = current_watermark()
+            LocalityF.create(geom='POINT(2 2)')
+
+            # a later change has its own rewrite
+            rewrite_locality_snapshot(watermark)
+            self.assertEqual(len(LocalitySnapshot(snapshot_filename())), 1)
+
+            rewrite_locality_snapshot(current_watermark())
+            snapshot = LocalitySnapshot(snapshot_filename())
+            self.assertEqual(len(snapshot), 3)
+            self.assertFalse(snapshot.is_stale())
+            snapshot.close()
+
+    def test_rewrite_locality_snapshot_max_delay(self):
+        LocalityF.create(geom='POINT(0 0)')
+        with self.settings(
+                CLUSTER_CACHE_DIR=os.path.dirname(self.filename),
+                LOCALITY_SNAPSHOT_REWRITE_MAX_DELAY=0):
+            write_snapshot()
+
+            LocalityF.create(geom='POINT(1 1)')
+            watermark = current_watermark()
+            LocalityF.create(geom='POINT(2 2)')
+
+            # changes are pending for too long
+            rewrite_locality_snapshot(watermark)
+            snapshot = LocalitySnapshot(snapshot_filename())
+            self.assertEqual(len(snapshot), 3)
+            snapshot.close()
+
+    def test_deleted_locality(self):
+        locality = LocalityF.create(geom='POINT(0 0)')
+        LocalityF.create(geom='POINT(1 1)')
+        with self.settings(CLUSTER_CACHE_DIR=os.path.dirname(self.filename)):
+            write_snapshot()
+            snapshot = LocalitySnapshot(snapshot_filename())
+            self.assertFalse(snapshot.is_stale())
+
+            # deletes create no changeset, but they bump the version
+            locality.delete()
+            self.assertTrue(snapshot.is_stale())
+            snapshot.close()
+
+            # the delete triggers a rewrite of the snapshot
+            rewrite_locality_snapshot(current_watermark())
+            snapshot = LocalitySnapshot(snapshot_filename())
+            self.assertEqual(len(snapshot), 1)
+            self.assertFalse(snapshot.is_stale())
+            snapshot.close()
+
+    def test_snapshot_not_a_snapshot(self):
+        with open(self.filename, 'wb') as snapshot_file:
+            snapshot_file.write('\0' * 64)
+
+        self.assertRaises(IOError, LocalitySnapshot, self.filename)
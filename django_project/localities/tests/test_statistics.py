@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from django.contrib.gis.geos import MultiPolygon, Point, Polygon
+from django.test import TestCase
+
+from .model_factories import LocalityF, ValueF
+
+from ..models import Country, CountryStatistic
+from ..statistics import type_counts
+from ..utils import get_country_statistic, update_country_statistic
+
+
+class TestStatistics(TestCase):
+    def setUp(self):
+        self.country = Country.objects.create(
+            name='Test', polygon_geometry=MultiPolygon(Polygon.from_bbox((0, 0, 10, 10)))
+        )
+
+    def assertCounts(self, country, **counts):
+        statistic = CountryStatistic.objects.get(country=country)
+        for field, count in counts.items():
+            self.assertEqual(getattr(statistic, field), count, field)
+
+    def test_type_counts(self):
+        self.assertDictEqual(type_counts('Orthopaedic Clinic'), {
+            'medical_clinic': 1, 'orthopaedic_clinic': 1
+        })
+        self.assertDictEqual(type_counts(None), {})
+
+    def test_update_by_deltas(self):
+        update_country_statistic()
+        update_country_statistic(self.country)
+
+        locality = LocalityF.create(geom='POINT(5 5)')
+        self.assertCounts(None, localities=1, basic=1)
+        self.assertCounts(self.country, localities=1, basic=1)
+
+        value = ValueF.create(
+            locality=locality, specification__attribute__key='type', data='Hospital')
+        self.assertCounts(self.country, hospital=1, medical_clinic=0)
+
+        value.data = 'clinic'
+        value.save()
+        self.assertCounts(self.country, hospital=0, medical_clinic=1)
+
+        locality.completeness = 100
+        locality.save()
+        self.assertCounts(self.country, localities=1, basic=0, complete=1)
+
+        # moved out of the country, with its type
+        locality.geom = Point(20, 20)
+        locality.save()
+        self.assertCounts(None, localities=1, medical_clinic=1, complete=1)
+        self.assertCounts(self.country, localities=0, medical_clinic=0, complete=0)
+
+        # updated statistics are the same as the counted ones
+        updated = get_country_statistic('')
+        counted = update_country_statistic().get_statistic()
+        self.assertDictEqual(updated['numbers'], counted['numbers'])
+        self.assertDictEqual(updated['completeness'], counted['completeness'])
+
+        locality.delete()
+        self.assertCounts(None, localities=0, medical_clinic=0, complete=0)
+
+    def test_get_country_statistic(self):
+        LocalityF.create(geom='POINT(5 5)', completeness=50)
+
+        statistic = get_country_statistic('test')
+
+        self.assertEqual(statistic['localities'], 1)
+        self.assertEqual(statistic['completeness']['partial'], 1)
+        self.assertTrue(CountryStatistic.objects.filter(country=self.country).exists())
+        self.assertEqual(get_country_statistic('unknown'), '')
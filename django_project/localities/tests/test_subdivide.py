@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import math
+
+from django.contrib.gis.geos import MultiPolygon, Polygon
+from django.test import TestCase
+
+from ..models import Country, CountryPart
+from ..subdivide import subdivide
+
+
+def circle(x, y, radius, vertices):
+    coords = [
+        (x + radius * math.cos(2 * math.pi * index / vertices),
+         y + radius * math.sin(2 * math.pi * index / vertices))
+        for index in range(vertices)
+    ]
+    return Polygon(coords + coords[:1])
+
+
+class TestSubdivide(TestCase):
+    def test_subdivide(self):
+        geometry = MultiPolygon(
+            circle(20, 0, 10, 2000), Polygon.from_bbox((50, 50, 51, 51)), srid=4326)
+
+        polygons = list(subdivide(geometry, 64))
+
+        self.assertTrue(len(polygons) > 2)
+        self.assertTrue(all(polygon.num_coords <= 64 for polygon in polygons))
+        self.assertTrue(all(polygon.srid == 4326 for polygon in polygons))
+        self.assertAlmostEqual(sum(polygon.area for polygon in polygons), geometry.area)
+
+    def test_small_polygon(self):
+        geometry = MultiPolygon(Polygon.from_bbox((0, 0, 10, 10)), srid=4326)
+
+        self.assertEqual(len(list(subdivide(geometry, 64))), 1)
+
+    def test_country_parts(self):
+        with self.settings(COUNTRY_PART_MAX_VERTICES=64):
+            country = Country.objects.create(
+                name='Test', polygon_geometry=MultiPolygon(circle(0, 0, 10, 500))
+            )
+            self.assertTrue(country.parts.count() > 1)
+
+            country.polygon_geometry = MultiPolygon(Polygon.from_bbox((0, 0, 10, 10)))
+            country.save()
+            self.assertEqual(country.parts.count(), 1)
+
+        country.delete()
+        self.assertFalse(CountryPart.objects.exists())
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 from django.test import TestCase
 
-from ..utils import render_fragment, parse_bbox
+from .model_factories import LocalityF, ValueF
+
+from ..models import Locality, Value
+from ..utils import get_statistic, render_fragment, parse_bbox
 
 
 class TestUtils(TestCase):
@@ -27,3 +30,31 @@ class TestUtils(TestCase):
             u'000000000, 180.0000000000000000 -90.0000000000000000, -180.00000'
             u'00000000000 -90.0000000000000000))'
         )
+
+    def test_get_statistic(self):
+        hospital = LocalityF.create(completeness=100)
+        clinic = LocalityF.create(completeness=50)
+        LocalityF.create(completeness=10)
+        ValueF.create(
+            locality=hospital, specification__attribute__key='type', data='Hospital')
+        ValueF.create(
+            locality=clinic, specification__attribute__key='type', data='orthopaedic clinic')
+
+        statistic = get_statistic(Locality.objects.all())
+
+        self.assertEqual(statistic['localities'], 3)
+        self.assertDictEqual(statistic['numbers'], {
+            'hospital': 1, 'medical_clinic': 1, 'orthopaedic_clinic': 1
+        })
+        self.assertDictEqual(statistic['completeness'], {
+            'complete': 1, 'partial': 1, 'basic': 1
+        })
+
+        # Locality ids of search results
+        statistic = get_statistic(
+            Value.objects.filter(specification__attribute__key='type').values('locality'))
+
+        self.assertEqual(statistic['localities'], 2)
+        self.assertDictEqual(statistic['completeness'], {
+            'complete': 1, 'partial': 1, 'basic': 0
+        })
@@ -1,4 +1,9 @@
 # -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+
 from django.test import TestCase, Client
 from django.core.urlresolvers import reverse
 
@@ -15,6 +20,7 @@ from .model_factories import (
 )
 
 from ..models import Locality
+from ..search_cache import search_cache
 
 
 class TestViews(TestCase):
@@ -43,6 +49,137 @@ class TestViews(TestCase):
             )
         )
 
+    def test_localities_view_deleted_locality(self):
+        search_cache.clear()
+        locality = LocalityF.create(geom='POINT(16 45)')
+        params = {
+            'zoom': 8, 'bbox': '15,44,17,46', 'iconsize': '40,40',
+            'geoname': '', 'tag': '', 'spec': '', 'data': '', 'uuid': ''
+        }
+
+        resp = self.client.get(reverse('localities'), data=params)
+        self.assertEqual(len(json.loads(''.join(resp.streaming_content))), 1)
+
+        # cached search results are not used after a delete
+        locality.delete()
+        resp = self.client.get(reverse('localities'), data=params)
+        self.assertEqual(json.loads(''.join(resp.streaming_content)), [])
+
+    def test_localities_tile_view(self):
+        LocalityF.create(
+            uuid='93b7e8c4621a4597938dfd3d27659162', geom='POINT(16 45)'
+        )
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with self.settings(CLUSTER_CACHE_DIR=cache_dir):
+            resp = self.client.get(reverse(
+                'localities-tile', kwargs={'zoom': 1, 'x': 1, 'y': 0}
+            ))
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Type'], 'application/json')
+
+        clusters = json.loads(resp.content)
+        self.assertEqual(len(clusters), 1)
+        self.assertEqual(
+            clusters[0]['uuid'], '93b7e8c4621a4597938dfd3d27659162'
+        )
+
+    def test_localities_tile_view_deleted_locality(self):
+        locality = LocalityF.create(geom='POINT(16 45)')
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        url = reverse('localities-tile', kwargs={'zoom': 1, 'x': 1, 'y': 0})
+
+        with self.settings(CLUSTER_CACHE_DIR=cache_dir):
+            self.assertEqual(len(json.loads(self.client.get(url).content)), 1)
+
+            # cached tile and its lock file are removed with the Locality
+            locality.delete()
+            self.assertListEqual(os.listdir(os.path.join(cache_dir, 'tiles', '1', '1')), [])
+            self.assertListEqual(json.loads(self.client.get(url).content), [])
+
+    def test_localities_vector_tile_view(self):
+        LocalityF.create(
+            uuid='93b7e8c4621a4597938dfd3d27659162', geom='POINT(16 45)'
+        )
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with self.settings(CLUSTER_CACHE_DIR=cache_dir):
+            resp = self.client.get(reverse(
+                'localities-tile-mvt', kwargs={'zoom': 1, 'x': 1, 'y': 0}
+            ))
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        self.assertIn('93b7e8c4621a4597938dfd3d27659162', resp.content)
+
+    def test_localities_tile_view_bad_params(self):
+        resp = self.client.get(reverse(
+            'localities-tile', kwargs={'zoom': 1, 'x': 2, 'y': 0}
+        ))
+
+        self.assertEqual(resp.status_code, 404)
+
+        resp = self.client.get(reverse(
+            'localities-tile', kwargs={'zoom': 21, 'x': 0, 'y': 0}
+        ))
+
+        self.assertEqual(resp.status_code, 404)
+
+    def test_localities_clusters_view(self):
+        LocalityF.create(
+            uuid='93b7e8c4621a4597938dfd3d27659162', geom='POINT(16 45)'
+        )
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with self.settings(CLUSTER_CACHE_DIR=cache_dir):
+            resp = self.client.get(reverse(
+                'localities-clusters', kwargs={'zoom': 1, 'width': 48, 'height': 46}
+            ))
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(json.loads(resp.content)), 1)
+        # compressed sibling can be served by the web server
+        self.assertTrue(
+            os.path.exists(os.path.join(cache_dir, '1_48_46_localities.json.gz'))
+        )
+
+        resp = self.client.get(reverse(
+            'localities-clusters', kwargs={'zoom': 20, 'width': 48, 'height': 46}
+        ))
+
+        self.assertEqual(resp.status_code, 404)
+
+    def test_localities_density_view(self):
+        LocalityF.create(geom='POINT(16 45)')
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with self.settings(CLUSTER_CACHE_DIR=cache_dir, DENSITY_GRID_COLUMNS=4):
+            resp = self.client.get(reverse('localities-density', kwargs={'zoom': 0}))
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp['Content-Type'], 'application/octet-stream')
+            self.assertEqual(resp.content[:4], 'HSDG')
+
+            resp = self.client.get(reverse('localities-density-json', kwargs={'zoom': 0}))
+
+            self.assertEqual(resp.status_code, 200)
+            grid = json.loads(resp.content)
+            self.assertEqual(grid['columns'], 4)
+            self.assertListEqual(grid['cells'], [[2, 0, 1]])
+
+            resp = self.client.get(
+                reverse('localities-density-json', kwargs={'zoom': 0}), data={'type': 'hospital'})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertListEqual(json.loads(resp.content)['cells'], [])
+
+        resp = self.client.get(
+            reverse('localities-density', kwargs={'zoom': 0}), data={'type': 'unknown'})
+
+        self.assertEqual(resp.status_code, 404)
+
     def test_localities_view_bad_params(self):
         resp = self.client.get(reverse('localities'), data={
             'bbox': '-180,-90,180,90'
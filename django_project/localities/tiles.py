@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import logging
+
+LOG = logging.getLogger(__name__)
+
+import errno
+import glob
+import json
+import math
+import os
+import shutil
+
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+
+from .cache_files import get_cache_file, write_cache_file
+from .map_clustering import cluster, grid_cell_size
+from .models import Locality
+from .mvt import encode_tile
+from .snapshot import cluster_snapshot, get_fresh_snapshot
+
+# web mercator latitude limit
+MAX_LATITUDE = 85.0511287798066
+TILE_MAX_ZOOM = 20
+# largest icon size a tile can be clustered for
+TILE_MAX_ICON_SIZE = 128
+
+
+def tile_bbox(zoom, x, y):
+    """
+    Calculate a bbox (minx, miny, maxx, maxy) in degrees for a slippy map tile
+    """
+
+    tiles = 2.0 ** zoom
+
+    def tile_lat(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / tiles))))
+
+    return (
+        x / tiles * 360.0 - 180.0, tile_lat(y + 1),
+        (x + 1) / tiles * 360.0 - 180.0, tile_lat(y)
+    )
+
+
+def point_tile(zoom, lng, lat):
+    """
+    Get a slippy map tile (x, y) that contains a point (lng, lat)
+    """
+
+    tiles = 2 ** zoom
+    lat = max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)
+
+    x = int((lng + 180.0) / 360.0 * tiles)
+    y = int(
+        (1 - math.log(math.tan(math.radians(lat)) + 1 / math.cos(math.radians(lat))) / math.pi) / 2 * tiles
+    )
+    return (min(max(x, 0), tiles - 1), min(max(y, 0), tiles - 1))
+
+
+def tile_buffer(zoom, pix_x, pix_y):
+    """
+    Calculate a buffer (lng_deg, lat_deg) around a tile, as large as a cluster
+    'catchment' area, so clusters near tile edges are created from the same
+    points as in the neighbouring tile
+    """
+
+    cell_size = grid_cell_size(zoom, pix_x, pix_y)
+    return (cell_size[0] * 2, cell_size[1] * 2)
+
+
+def tile_filename(zoom, x, y, icon_size, extension='json'):
+    """
+    Get cache filename of a slippy map tile
+    """
+
+    return os.path.join(
+        settings.CLUSTER_CACHE_DIR, 'tiles', str(zoom), str(x),
+        '{}_{}_{}.{}'.format(y, icon_size[0], icon_size[1], extension)
+    )
+
+
+def cluster_tile(zoom, x, y, pix_x, pix_y):
+    """
+    Create point clusters of master Localities for a slippy map tile
+
+    Localities are clustered within a buffered tile, and only clusters which
+    'geom' is within the tile are returned, so every cluster is in exactly one
+    tile
+    """
+
+    minx, miny, maxx, maxy = tile_bbox(zoom, x, y)
+    buffer_x, buffer_y = tile_buffer(zoom, pix_x, pix_y)
+
+    buffered_bbox = (
+        minx - buffer_x, miny - buffer_y, maxx + buffer_x, maxy + buffer_y
+    )
+
+    snapshot = get_fresh_snapshot()
+    if snapshot is not None:
+        clusters = cluster_snapshot(snapshot, zoom, pix_x, pix_y, buffered_bbox)
+    else:
+        localities = Locality.objects.filter(master=None).in_bbox(
+            Polygon.from_bbox(buffered_bbox))
+        clusters = cluster(localities, zoom, pix_x, pix_y)
+
+    return [
+        cluster_point for cluster_point in clusters
+        if minx <= cluster_point['geom'][0] < maxx and miny <= cluster_point['geom'][1] < maxy
+    ]
+
+
+def make_tile_dir(filename):
+    """
+    Create a directory of a cached tile if needed
+    """
+
+    try:
+        os.makedirs(os.path.dirname(filename))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def write_tile(filename, data):
+    """
+    Write a cached tile atomically, with precompressed siblings, creating its
+    directory if needed
+    """
+
+    make_tile_dir(filename)
+    write_cache_file(filename, data, compress=True)
+
+
+def encode_cluster_tile(zoom, x, y, icon_size, extension='json'):
+    """
+    Cluster a slippy map tile and encode it as JSON ('json') or as a Mapbox
+    Vector Tile ('mvt')
+    """
+
+    clusters = cluster_tile(zoom, x, y, *icon_size)
+    if extension == 'mvt':
+        return encode_tile(zoom, x, y, clusters)
+    return json.dumps(clusters)
+
+
+def get_tile(zoom, x, y, icon_size, extension='json'):
+    """
+    Get JSON ('json') or Mapbox Vector Tile ('mvt') representation of
+    clustered Localities for a slippy map tile, from the tile cache if
+    possible
+
+    A missing tile is clustered by only one request, raises CacheTimeout if
+    it's not clustered within CLUSTER_CACHE_LOCK_TIMEOUT
+    """
+
+    filename = tile_filename(zoom, x, y, icon_size, extension)
+    make_tile_dir(filename)
+    return get_cache_file(
+        filename, lambda: encode_cluster_tile(zoom, x, y, icon_size, extension),
+        compress=True
+    )
+
+
+def invalidate_tiles(lng, lat):
+    """
+    Remove cached tiles, for every zoom, icon size and format, that might
+    have a cluster with a point (lng, lat)
+
+    A point is in its own tile and in every neighbouring tile which buffer,
+    for the largest icon size, contains the point. Lock files are removed
+    with the tiles, so they don't pile up, a tile might be clustered twice
+    by requests racing with a removal
+    """
+
+    for zoom in range(TILE_MAX_ZOOM + 1):
+        buffer_x, buffer_y = tile_buffer(zoom, TILE_MAX_ICON_SIZE, TILE_MAX_ICON_SIZE)
+        min_x, min_y = point_tile(zoom, lng - buffer_x, lat + buffer_y)
+        max_x, max_y = point_tile(zoom, lng + buffer_x, lat - buffer_y)
+        for tile_x in range(min_x, max_x + 1):
+            for tile_y in range(min_y, max_y + 1):
+                pattern = os.path.join(
+                    settings.CLUSTER_CACHE_DIR, 'tiles', str(zoom), str(tile_x),
+                    '{}_*'.format(tile_y)
+                )
+                for filename in glob.glob(pattern):
+                    try:
+                        os.remove(filename)
+                    except OSError:
+                        pass
+
+
+def clear_tiles():
+    """
+    Remove all cached tiles
+    """
+
+    shutil.rmtree(
+        os.path.join(settings.CLUSTER_CACHE_DIR, 'tiles'), ignore_errors=True
+    )
@@ -1,7 +1,12 @@
 # -*- coding: utf-8 -*-
 from django.conf.urls import patterns, url
 from .views import (
+    LocalitiesClusterCache,
+    LocalitiesDensityGrid,
+    LocalitiesDensityGridJSON,
     LocalitiesLayer,
+    LocalitiesTileLayer,
+    LocalitiesVectorTileLayer,
     LocalityInfo,
     DataLoaderView
 )
@@ -12,6 +17,31 @@ urlpatterns = patterns(
         r'^localities.json$', LocalitiesLayer.as_view(),
         name='localities'
     ),
+    url(
+        r'^localities/tiles/(?P<zoom>\d+)/(?P<x>\d+)/(?P<y>\d+).json$',
+        LocalitiesTileLayer.as_view(),
+        name='localities-tile'
+    ),
+    url(
+        r'^localities/tiles/(?P<zoom>\d+)/(?P<x>\d+)/(?P<y>\d+).mvt$',
+        LocalitiesVectorTileLayer.as_view(),
+        name='localities-tile-mvt'
+    ),
+    url(
+        r'^localities/clusters/(?P<zoom>\d+)_(?P<width>\d+)_(?P<height>\d+)_localities.json$',
+        LocalitiesClusterCache.as_view(),
+        name='localities-clusters'
+    ),
+    url(
+        r'^localities/density/(?P<zoom>\d+).bin$',
+        LocalitiesDensityGrid.as_view(),
+        name='localities-density'
+    ),
+    url(
+        r'^localities/density/(?P<zoom>\d+).json$',
+        LocalitiesDensityGridJSON.as_view(),
+        name='localities-density-json'
+    ),
     url(
         r'^localities/(?P<uuid>\w{32})$', LocalityInfo.as_view(),
         name='locality-info'
@@ -5,19 +5,21 @@ __license__ = "GPL"
 __copyright__ = 'kartoza.com'
 
 import json
-import os
 import uuid
 from core.utilities import extract_time
 from datetime import datetime
-from django.conf import settings
 from django.contrib.gis.geos import Point
 from django.contrib.gis.measure import D
 from django.core.paginator import Paginator
 from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
 from django.db.models import Count, Max
-from localities.models import Attribute, Changeset, Country, Domain, Locality, LocalityArchive, Specification, User, \
+from localities.cluster_cache import locality_facets
+from localities.map_clustering import COMPLETENESS_BUCKETS, FACILITY_TYPES
+from localities.models import Attribute, Changeset, Country, CountryStatistic, Domain, Locality, LocalityArchive, Specification, User, \
     Value, ValueArchive
-from localities.tasks import regenerate_cache, regenerate_cache_cluster
+from localities.tasks import regenerate_cache, update_cache_cluster
+from localities.tiles import invalidate_tiles
 from social_users.utils import get_profile
 
 limit = 100
@@ -61,109 +63,143 @@ def extract_updates(updates):
 
 
 def get_country_statistic(query):
+    """
+    Get statistics of master Localities of a Country named *query*, or of
+    the world if *query* is empty, from the Country statistics summary
+
+    Missing statistics are counted from scratch
+    """
+
     output = ""
     try:
+        country = None
         if query != "":
-            # getting country's polygon
-            country = Country.objects.get(
-                name__iexact=query)
-            polygons = country.polygon_geometry
-
-            # get cache
-            filename = os.path.join(
-                settings.CLUSTER_CACHE_DIR,
-                country.name + '_statistic'
-            )
-            try:
-                file = open(filename, 'r')
-                data = file.read()
-                output = json.loads(data)
-            except IOError as e:
-                try:
-                    # query for each of attribute
-                    healthsites = get_heathsites_master().in_polygon(
-                        polygons)
-                    output = get_statistic(healthsites)
-                    result = json.dumps(output, cls=DjangoJSONEncoder)
-                    file = open(filename, 'w')
-                    file.write(result)  # python will convert \n to os.linesep
-                    file.close()  # you can omit in most cases as the destructor will call it
-                except Exception as e:
-                    pass
-        else:
-            # get cache
-            filename = os.path.join(
-                settings.CLUSTER_CACHE_DIR,
-                'world_statistic'
-            )
-            try:
-                file = open(filename, 'r')
-                data = file.read()
-                output = json.loads(data)
-            except IOError as e:
-                try:
-                    # query for each of attribute
-                    healthsites = get_heathsites_master()
-                    output = get_statistic(healthsites)
-                    result = json.dumps(output, cls=DjangoJSONEncoder)
-                    file = open(filename, 'w')
-                    file.write(result)  # python will convert \n to os.linesep
-                    file.close()  # you can omit in most cases as the destructor will call it
-                except Exception as e:
-                    pass
+            country = Country.objects.get(name__iexact=query)
+
+        try:
+            statistic = CountryStatistic.objects.filter(country=country).first()
+            if statistic is None:
+                statistic = update_country_statistic(country)
+            output = statistic.get_statistic()
+        except Exception as e:
+            pass
 
     except Country.DoesNotExist:
         output = ""
     return output
 
 
+def get_country_healthsites(country=None):
+    """
+    Get master Localities of a Country, or of the world if *country* is None
+    """
+
+    healthsites = get_heathsites_master()
+    if country is not None:
+        healthsites = healthsites.in_country(country)
+    return healthsites
+
+
+def update_country_statistic(country=None):
+    """
+    Count statistics of master Localities of a Country, or of the world if
+    *country* is None, from scratch and save them to the Country statistics
+    summary
+    """
+
+    statistic, created = CountryStatistic.objects.get_or_create(country=country)
+    statistic.set_statistic(get_statistic(get_country_healthsites(country)))
+    statistic.save()
+    return statistic
+
+
+def update_country_statistic_updates(country=None):
+    """
+    Refresh the latest updates of the Country statistics summary of a
+    Country, or of the world if *country* is None, counts are kept as they
+    are updated by deltas
+
+    Missing statistics are counted from scratch
+    """
+
+    statistic = CountryStatistic.objects.filter(country=country).first()
+    if statistic is None:
+        return update_country_statistic(country)
+
+    histories = localities_updates(get_country_healthsites(country))
+    statistic.last_update = json.dumps(extract_updates(histories), cls=DjangoJSONEncoder)
+    statistic.save(update_fields=['last_update'])
+    return statistic
+
+
 def get_heathsites_master():
     return Locality.objects.filter(master=None)
 
 
 def get_heathsites_master_by_polygon(request, polygon):
+    """
+    Yield representations of master Localities in a polygon, at most *limit*
+    of them, Localities are read from the database as they are yielded
+    """
     healthsites = get_heathsites_master().in_polygon(
         polygon)
+    return get_heathsites_master_by_request(request, healthsites)
+
+
+def get_heathsites_master_by_country(request, country):
+    """
+    Yield representations of master Localities in a Country, at most *limit*
+    of them
+    """
+    healthsites = get_heathsites_master().in_country(country)
+    return get_heathsites_master_by_request(request, healthsites)
 
+
+def get_heathsites_master_by_request(request, healthsites):
+    """
+    Yield representations of Localities of the facility type of a request,
+    at most *limit* of them
+    """
     facility_type = ""
     if 'facility_type' in request.GET:
         facility_type = request.GET['facility_type']
 
-    output = []
     index = 1;
-    for healthsite in healthsites:
+    for healthsite in healthsites.iterator():
         if healthsite.is_type(facility_type):
-            output.append(healthsite.repr_dict())
+            yield healthsite.repr_dict()
             index += 1
         if index == limit:
             break
-    return output
 
 
 def get_heathsites_master_by_page(page):
+    """
+    Get representations of master Localities on a page, the page is checked
+    right away and Localities are read as they are iterated
+    """
     healthsites = get_heathsites_master()
     paginator = Paginator(healthsites, 100)
     try:
         healthsites = paginator.page(page)
     except Exception as e:
-        return []
+        return iter(())
 
-    output = []
-    for healthsite in healthsites:
-        output.append(healthsite.repr_dict())
-    return output
+    return (healthsite.repr_dict() for healthsite in healthsites)
 
 
 def get_heathsites_synonyms():
+    """
+    Yield representations of Localities which are synonyms, at most *limit*
+    of them
+    """
     healthsites = Locality.objects.exclude(master=None)
-    output = []
     index = 1;
-    for healthsite in healthsites:
-        output.append(healthsite.repr_dict())
+    for healthsite in healthsites.iterator():
+        yield healthsite.repr_dict()
         index += 1
         if index == limit:
             break
-    return output
 
 
 def get_json_from_request(request):
@@ -341,7 +377,9 @@ def locality_create(request):
                 loc.set_values(json_request, request.user, tmp_changeset)
 
                 regenerate_cache.delay(tmp_changeset.pk, loc.pk)
-                regenerate_cache_cluster.delay()
+                if loc.master is None:
+                    update_cache_cluster.delay(loc.uuid, None, [loc.geom.x, loc.geom.y])
+                invalidate_tiles(loc.geom.x, loc.geom.y)
 
                 return {"success": json_request['is_valid'], "uuid": tmp_uuid, "reason": ""}
             else:
@@ -361,6 +399,8 @@ def locality_edit(request):
             if json_request['is_valid'] == True:
                 locality = Locality.objects.get(uuid=json_request['uuid'])
                 old_geom = [locality.geom.x, locality.geom.y]
+                was_master = locality.master is None
+                old_facets = locality_facets(locality.uuid) if was_master else None
 
                 locality.set_geom(float(json_request['long']), float(json_request['lat']))
 
@@ -389,10 +429,20 @@ def locality_edit(request):
 
                 regenerate_cache.delay(tmp_changeset.pk, locality.pk)
 
-                # if location is changed
+                # apply location, master and name changes to cached clusters
                 new_geom = [locality.geom.x, locality.geom.y]
+                is_master = locality.master is None
+                if was_master or is_master:
+                    update_cache_cluster.delay(
+                        locality.uuid,
+                        old_geom if was_master else None,
+                        new_geom if is_master else None,
+                        old_facets
+                    )
                 if new_geom != old_geom:
-                    regenerate_cache_cluster.delay()
+                    invalidate_tiles(*old_geom)
+                # values, like name, of a cluster might be changed
+                invalidate_tiles(*new_geom)
 
                 return {"success": json_request['is_valid'], "uuid": json_request['uuid'], "reason": ""}
             else:
@@ -403,33 +453,70 @@ def locality_edit(request):
     return {"success": False, "reason": "There is error occured"}
 
 
+STATISTIC_SQL = """
+    SELECT
+        count(DISTINCT l.id),
+        {type_counts},
+        count(DISTINCT CASE WHEN l.completeness = 100 THEN l.id END),
+        count(DISTINCT CASE WHEN l.completeness > 30 AND l.completeness < 100 THEN l.id END),
+        count(DISTINCT CASE WHEN l.completeness <= 30 THEN l.id END)
+    FROM {locality} l
+    LEFT JOIN {value} v ON v.locality_id = l.id AND v.specification_id IN (
+        SELECT s.id
+        FROM {specification} s
+        JOIN {attribute} a ON a.id = s.attribute_id
+        WHERE a.key = 'type'
+    )
+    WHERE l.id IN ({localities})
+"""
+
+
 def get_statistic(healthsites):
-    # locality which in polygon
-    # data for frontend
-
-    healthsites_number = healthsites.count()
-    values = Value.objects.filter(locality__in=healthsites)
-
-    hospital_number = values.filter(
-        specification__attribute__key='type').filter(
-        data__icontains='hospital').count()
-    medical_clinic_number = values.filter(
-        specification__attribute__key='type').filter(
-        data__icontains='clinic').count()
-    orthopaedic_clinic_number = values.filter(
-        specification__attribute__key='type').filter(
-        data__icontains='orthopaedic').count()
+    """
+    Get statistics of Localities for the frontend, counts of Localities by
+    facility type and by completeness and the latest updates
 
-    # count completeness based attributes
-    # this make long waiting, need to more good query
-    complete = healthsites.filter(completeness=100).count()
-    partial = healthsites.filter(completeness__gt=30).filter(completeness__lt=100).count()
-    basic = healthsites.filter(completeness__lte=30).count()
-
-    output = {"numbers": {"hospital": hospital_number, "medical_clinic": medical_clinic_number
-        , "orthopaedic_clinic": orthopaedic_clinic_number},
-              "completeness": {"complete": complete, "partial": partial, "basic": basic},
-              "localities": healthsites_number}
+    *healthsites* is a queryset of Localities, or any queryset of Locality
+    ids. Every count is calculated by a single conditional aggregation
+    query, instead of a query for every count
+    """
+
+    if healthsites.model is not Locality:
+        # e.g. values of Localities found by a search
+        healthsites = Locality.objects.filter(id__in=healthsites)
+
+    localities_sql, params = healthsites.values('id').query.sql_with_params()
+    sql = STATISTIC_SQL.format(
+        type_counts=', '.join(
+            'count(CASE WHEN UPPER(v.data::text) LIKE UPPER(%s) THEN v.id END)'
+            for _ in FACILITY_TYPES
+        ),
+        locality=Locality._meta.db_table,
+        value=Value._meta.db_table,
+        specification=Specification._meta.db_table,
+        attribute=Attribute._meta.db_table,
+        localities=localities_sql
+    )
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            sql, ['%%%s%%' % keyword for name, keyword in FACILITY_TYPES] + list(params)
+        )
+        counts = cursor.fetchone()
+    finally:
+        cursor.close()
+
+    types = len(FACILITY_TYPES)
+    output = {
+        "numbers": dict(
+            (name, counts[1 + index]) for index, (name, keyword) in enumerate(FACILITY_TYPES)
+        ),
+        "completeness": dict(
+            (name, counts[1 + types + index]) for index, name in enumerate(COMPLETENESS_BUCKETS)
+        ),
+        "localities": counts[0]
+    }
     # updates
     histories = localities_updates(healthsites)
     output["last_update"] = extract_updates(histories)
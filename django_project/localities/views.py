@@ -2,34 +2,87 @@
 import googlemaps
 import json
 import logging
-import os
 
 LOG = logging.getLogger(__name__)
 
 # register signals
+from .cache_files import CacheTimeout, get_cache_file
+from .cluster_cache import cluster_cache_filename, get_cluster_index, snap_icon_size
+from .density import decode_density_grid, density_filename, density_grids, encode_density_grid
 from .forms import DataLoaderForm
-from .map_clustering import cluster
+from .map_clustering import FACILITY_TYPES, cluster, cluster_in_database
 from .models import Locality, Domain, Changeset, Value, Attribute, Specification
+from .search_cache import search_cache, snap_bbox
+from .snapshot import cluster_snapshot, current_watermark, get_fresh_snapshot
+from .tiles import TILE_MAX_ICON_SIZE, TILE_MAX_ZOOM, get_tile
 from .utils import parse_bbox, get_country_statistic, get_heathsites_master, get_locality_detail, locality_create, \
     locality_edit, \
     locality_updates, get_locality_by_spec_data
 
 from braces.views import JSONResponseMixin, LoginRequiredMixin
+from core.utilities import streaming_json_response
 from datetime import datetime
 from django.conf import settings
+from django.contrib.gis.geos import Polygon
 from django.core.serializers.json import DjangoJSONEncoder
 from django.http import HttpResponse, Http404
-from django.views.generic import DetailView, ListView, FormView
+from django.utils.cache import patch_cache_control
+from django.views.generic import DetailView, ListView, FormView, View
 from localities.models import Country, DataLoaderPermission
 
 LOG = logging.getLogger(__name__)
 
 
+def _is_set(value):
+    """
+    Check if a search request argument is set
+    """
+
+    return value not in ('', 'undefined', None)
+
+
+def _cache_timeout_response(message):
+    """
+    Get a response for a cache which is being generated by another request
+    """
+
+    response = HttpResponse(message, content_type='text/plain', status=503)
+    response['Retry-After'] = 5
+    return response
+
+
+def _cluster_cache_facets():
+    """
+    Check if cached clusters count facets, same as the ones generated by the
+    gen_cluster_cache command
+    """
+
+    return getattr(settings, 'CLUSTER_CACHE_FACETS', False)
+
+
+def _cluster_world(zoom, icon_size):
+    """
+    Create point clusters of all master Localities, for cached clusters
+
+    Clusters are created from the Locality snapshot if it's not stale, unless
+    facets are counted, which the snapshot doesn't have
+    """
+
+    facets = _cluster_cache_facets()
+    if not facets:
+        snapshot = get_fresh_snapshot()
+        if snapshot is not None:
+            return cluster_snapshot(snapshot, zoom, *icon_size)
+    localities = get_heathsites_master().in_bbox(parse_bbox('-180,-90,180,90'))
+    return cluster(localities, zoom, icon_size[0], icon_size[1], facets=facets)
+
+
 class LocalitiesLayer(JSONResponseMixin, ListView):
     """
     Returns JSON representation of clustered points for the current map view
 
-    Map view is defined by a *bbox*, *zoom* and *iconsize*
+    Map view is defined by a *bbox*, *zoom* and *iconsize*, clusters are
+    streamed as they are serialized
     """
 
     def _parse_request_params(self, request):
@@ -59,39 +112,117 @@ class LocalitiesLayer(JSONResponseMixin, ListView):
         if zoom < 0 or zoom > 20:
             # zoom should be between 0 and 20
             raise Http404
-        if any((size < 0 for size in icon_size)):
+        if len(icon_size) != 2 or any((size < 0 for size in icon_size)):
             # icon sizes should be positive
             raise Http404
 
+        # clusters are created for the nearest cached icon size
+        icon_size = snap_icon_size(icon_size)
+
         return (bbox_poly, zoom, icon_size, geoname, tag, spec, data, uuid)
 
+    def _get_cluster_function(self, request):
+        """
+        Get clustering function for uncached clusters, clustering backend can
+        be set by *backend* request argument or by CLUSTER_BACKEND setting
+
+        'python' backend clusters Localities in Python and 'postgis' backend
+        clusters them in the database
+        """
+
+        backend = request.GET.get(
+            'backend', getattr(settings, 'CLUSTER_BACKEND', 'python'))
+
+        if backend == 'postgis':
+            return cluster_in_database
+        elif backend == 'python':
+            return cluster
+        else:
+            raise Http404
+
+    def _is_unfiltered(self, geoname, tag, spec, data, uuid):
+        """
+        Check if request arguments select all master Localities in a bbox
+        """
+
+        return not (
+            _is_set(geoname) or _is_set(tag) or (_is_set(spec) and _is_set(data)) or uuid
+        )
+
+    def _get_search_cache_key(self, zoom, iconsize, tiles, geoname, tag, spec, data, uuid,
+                              cluster_function):
+        """
+        Get a search cache key of normalized request arguments
+
+        Arguments which are ignored by a search are left out of the key, so
+        tag and data searches, which are not limited to a bbox, have the same
+        key for every bbox
+        """
+
+        if _is_set(geoname):
+            search = ('geoname', geoname.lower())
+        elif _is_set(tag):
+            search, tiles = ('tag', tag), None
+        elif _is_set(spec) and _is_set(data):
+            search, tiles = ('spec', spec, data), None
+        else:
+            search = ()
+
+        return (
+            search, uuid or '', zoom, tuple(iconsize), tiles, cluster_function.__name__
+        )
+
+    def _get_cached_response(self, filename, cluster_function, bbox):
+        """
+        Get a response with cached clusters within a bbox, clusters are
+        created by *cluster_function* and cached if the cache is missing
+
+        Missing cache is created by only one request, other requests wait
+        for it and get 503 response if it's not created in time
+        """
+
+        cluster_index = get_cluster_index(filename)
+        if cluster_index is None:
+            try:
+                get_cache_file(
+                    filename, lambda: json.dumps(cluster_function()), compress=True)
+            except CacheTimeout:
+                return _cache_timeout_response('Clusters are being generated')
+            cluster_index = get_cluster_index(filename)
+
+        return streaming_json_response(cluster_index.query(bbox.extent))
+
     def get(self, request, *args, **kwargs):
         # parse request params
         bbox, zoom, iconsize, geoname, tag, spec, data, uuid = self._parse_request_params(request)
+        cluster_function = self._get_cluster_function(request)
         if not geoname and not tag and not spec and not data and zoom <= settings.CLUSTER_CACHE_MAX_ZOOM:
             # if geoname and tag are not set we can return the cached layer
             # try to read localities from disk
-            filename = os.path.join(
-                settings.CLUSTER_CACHE_DIR,
-                '{}_{}_{}_localities.json'.format(zoom, *iconsize)
-            )
-
-            try:
-                cached_locs = open(filename, 'rb')
-                cached_data = cached_locs.read()
+            filename = cluster_cache_filename(zoom, iconsize)
 
-                return HttpResponse(
-                    cached_data, content_type='application/json', status=200
-                )
-            except IOError as e:
-                localities = get_heathsites_master().in_bbox(parse_bbox('-180,-90,180,90'))
-                object_list = cluster(localities, zoom, *iconsize)
-
-                # create the missing cache
-                with open(filename, 'wb') as cache_file:
-                    json.dump(object_list, cache_file)
-                return self.render_json_response(object_list)
+            return self._get_cached_response(
+                filename, lambda: _cluster_world(zoom, iconsize), bbox)
         else:
+            # search results are cached for the tiles which cover the bbox
+            tiles, snapped_bbox = snap_bbox(zoom, bbox.extent)
+            bbox = Polygon.from_bbox(snapped_bbox)
+            cache_key = self._get_search_cache_key(
+                zoom, iconsize, tiles, geoname, tag, spec, data, uuid, cluster_function)
+            watermark = current_watermark()
+            object_list = search_cache.get(cache_key, watermark)
+            if object_list is not None:
+                return streaming_json_response(object_list)
+
+            if cluster_function is cluster and self._is_unfiltered(geoname, tag, spec, data, uuid):
+                # master Localities within a bbox can be clustered from the snapshot
+                snapshot = get_fresh_snapshot()
+                if snapshot is not None:
+                    object_list = cluster_snapshot(
+                        snapshot, zoom, iconsize[0], iconsize[1], snapped_bbox)
+                    search_cache.set(cache_key, watermark, object_list)
+                    return streaming_json_response(object_list)
+
             # cluster Localites for a view
             # localities = Locality.objects.in_bbox(bbox)
             # just master
@@ -105,29 +236,18 @@ class LocalitiesLayer(JSONResponseMixin, ListView):
                     if zoom <= settings.CLUSTER_CACHE_MAX_ZOOM:
                         # check the cache
                         # try to read localities from disk
-                        filename = os.path.join(
-                            settings.CLUSTER_CACHE_DIR,
-                            '{}_{}_{}_localities_{}.json'.format(zoom, iconsize[0], iconsize[1], country.name)
-                        )
-                        try:
-                            cached_locs = open(filename, 'rb')
-                            cached_data = cached_locs.read()
-
-                            return HttpResponse(
-                                cached_data, content_type='application/json', status=200
+                        filename = cluster_cache_filename(zoom, iconsize, country.name)
+
+                        def cluster_country():
+                            localities = get_heathsites_master().in_country(country)
+                            return cluster(
+                                localities, zoom, iconsize[0], iconsize[1],
+                                facets=_cluster_cache_facets()
                             )
-                        except IOError as e:
-                            polygon = country.polygon_geometry
-                            localities = get_heathsites_master().in_polygon(polygon)
-                            object_list = cluster(localities, zoom, *iconsize)
-
-                            # create the missing cache
-                            with open(filename, 'wb') as cache_file:
-                                json.dump(object_list, cache_file)
-                            return self.render_json_response(object_list)
+
+                        return self._get_cached_response(filename, cluster_country, bbox)
                     else:
-                        polygon = country.polygon_geometry
-                        localities = localities.in_polygon(polygon)
+                        localities = localities.in_country(country)
 
                 else:
                     raise Country.DoesNotExist
@@ -154,10 +274,179 @@ class LocalitiesLayer(JSONResponseMixin, ListView):
                 focused = Locality.objects.filter(uuid=uuid)
                 focused = cluster(focused, zoom, *iconsize)
             if not exception:
-                object_list = cluster(localities, zoom, *iconsize)
+                object_list = cluster_function(localities, zoom, *iconsize)
                 if focused:
                     object_list = object_list + focused
-            return self.render_json_response(object_list)
+            search_cache.set(cache_key, watermark, object_list)
+            return streaming_json_response(object_list)
+
+
+class LocalitiesTileLayer(View):
+    """
+    Returns JSON representation of clustered master Localities for a slippy
+    map tile
+
+    Tile is defined by *zoom*, *x* and *y* and an optional *iconsize*,
+    clustered tiles are cached until a Locality in the tile is changed
+    """
+
+    extension = 'json'
+    content_type = 'application/json'
+
+    def _parse_request_params(self, request, zoom, x, y):
+        """
+        Try to parse arguments for a request and any error during parsing will
+        raise Http404 exception
+        """
+
+        try:
+            zoom, x, y = int(zoom), int(x), int(y)
+            icon_size = map(int, request.GET.get('iconsize', '48,46').split(','))
+        except ValueError:
+            raise Http404
+
+        if zoom < 0 or zoom > TILE_MAX_ZOOM:
+            raise Http404
+        if x >= 2 ** zoom or y >= 2 ** zoom:
+            raise Http404
+        if len(icon_size) != 2 or any((
+                size < 0 or size > TILE_MAX_ICON_SIZE for size in icon_size)):
+            raise Http404
+
+        return (zoom, x, y, snap_icon_size(icon_size))
+
+    def get(self, request, zoom, x, y, *args, **kwargs):
+        zoom, x, y, icon_size = self._parse_request_params(request, zoom, x, y)
+
+        try:
+            data = get_tile(zoom, x, y, icon_size, self.extension)
+        except CacheTimeout:
+            return _cache_timeout_response('Tile is being generated')
+
+        response = HttpResponse(data, content_type=self.content_type, status=200)
+        patch_cache_control(
+            response, public=True, max_age=settings.CLUSTER_TILE_MAX_AGE
+        )
+        return response
+
+
+class LocalitiesVectorTileLayer(LocalitiesTileLayer):
+    """
+    Returns Mapbox Vector Tile representation of clustered master Localities
+    for a slippy map tile, with a 'localities' layer of cluster points
+    """
+
+    extension = 'mvt'
+    content_type = 'application/vnd.mapbox-vector-tile'
+
+
+class LocalitiesClusterCache(View):
+    """
+    Returns cached clusters of all master Localities for a *zoom* and icon
+    size (*width* and *height*)
+
+    Cache files are served directly by the web server, with precompressed
+    siblings, this view only creates missing cache files
+    """
+
+    def get(self, request, zoom, width, height, *args, **kwargs):
+        zoom, icon_size = int(zoom), [int(width), int(height)]
+        if zoom > settings.CLUSTER_CACHE_MAX_ZOOM:
+            raise Http404
+        if any((size > TILE_MAX_ICON_SIZE for size in icon_size)):
+            raise Http404
+        icon_size = snap_icon_size(icon_size)
+
+        try:
+            data = get_cache_file(
+                cluster_cache_filename(zoom, icon_size),
+                lambda: json.dumps(_cluster_world(zoom, icon_size)),
+                compress=True
+            )
+        except CacheTimeout:
+            return _cache_timeout_response('Clusters are being generated')
+
+        response = HttpResponse(data, content_type='application/json', status=200)
+        patch_cache_control(
+            response, public=True, max_age=settings.CLUSTER_TILE_MAX_AGE
+        )
+        return response
+
+
+class LocalitiesDensityGrid(View):
+    """
+    Returns a density grid of master Localities for a *zoom*, counts of
+    Localities in every non empty cell of a regular grid, optionally only of
+    Localities of a facility *type*
+
+    Density grids are precomputed by the gen_density_grid command, this view
+    only creates missing ones
+    """
+
+    extension = 'bin'
+    content_type = 'application/octet-stream'
+
+    def _parse_request_params(self, request, zoom):
+        """
+        Try to parse arguments for a request and any error during parsing will
+        raise Http404 exception
+        """
+
+        zoom = int(zoom)
+        if zoom > settings.DENSITY_GRID_MAX_ZOOM:
+            raise Http404
+
+        facility_type = request.GET.get('type') or None
+        if facility_type is not None and facility_type not in dict(FACILITY_TYPES):
+            raise Http404
+
+        return zoom, facility_type
+
+    def _render(self, data):
+        return data
+
+    def get(self, request, zoom, *args, **kwargs):
+        zoom, facility_type = self._parse_request_params(request, zoom)
+
+        try:
+            data = get_cache_file(
+                density_filename(zoom, facility_type),
+                lambda: encode_density_grid(
+                    zoom, density_grids(get_heathsites_master(), zoom)[facility_type]),
+                compress=True
+            )
+        except CacheTimeout:
+            return _cache_timeout_response('Density grid is being generated')
+
+        response = HttpResponse(
+            self._render(data), content_type=self.content_type, status=200)
+        patch_cache_control(
+            response, public=True, max_age=settings.CLUSTER_TILE_MAX_AGE
+        )
+        return response
+
+
+class LocalitiesDensityGridJSON(LocalitiesDensityGrid):
+    """
+    Returns JSON representation of a density grid of master Localities, a
+    list of non empty cells [column, row, count], cells are numbered from the
+    top left corner (-180, 90) of the world
+    """
+
+    extension = 'json'
+    content_type = 'application/json'
+
+    def _render(self, data):
+        zoom, columns, rows, grid = decode_density_grid(data)
+        return json.dumps({
+            'zoom': zoom,
+            'columns': columns,
+            'rows': rows,
+            'cell_size': 360.0 / columns,
+            'cells': sorted(
+                [column, row, count] for (column, row), count in grid.iteritems()
+            )
+        })
 
 
 class LocalityInfo(JSONResponseMixin, DetailView):